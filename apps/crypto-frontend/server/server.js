@@ -1,6 +1,7 @@
 import express from 'express';
 import sqlite3 from 'sqlite3';
 import cors from 'cors';
+import fs from 'fs';
 import path from 'path';
 import { fileURLToPath } from 'url';
 
@@ -10,6 +11,18 @@ const __dirname = path.dirname(__filename);
 const app = express();
 const port = process.env.PORT || 4000;
 const DB_PATH = process.env.DB_PATH || '/data/crypto.db';
+// crypto-ingestor keeps the latest tick per symbol in memory (GET /latest);
+// when set, latest-price lookups ask it first and fall back to SQLite.
+const INGESTOR_URL = process.env.INGESTOR_URL || '';
+// With the ingestor's STORAGE_LAYOUT=sharded, a symbol's prices live in
+// SHARD_DIR/<SYMBOL>.db; per-symbol queries read that file when it exists.
+const SHARD_DIR = process.env.SHARD_DIR || '/data/shards';
+// When set, reads prefer the consistent copies the ingestor publishes every
+// SNAPSHOT_INTERVAL seconds (SNAPSHOT_DIR/crypto.db, SNAPSHOT_DIR/shards/):
+// they are never written in place, so they are opened immutable, without
+// locking. History is then up to one interval behind; latest prices still
+// come from INGESTOR_URL.
+const SNAPSHOT_DIR = process.env.SNAPSHOT_DIR || '';
 
 app.use(cors());
 app.use(express.json());
@@ -22,16 +35,50 @@ app.get('/health', (req, res) => {
 // Serve static files from the React app
 app.use(express.static(path.join(__dirname, '../dist')));
 
-const getDb = () => {
-    return new sqlite3.Database(DB_PATH, sqlite3.OPEN_READONLY, (err) => {
+const shardPath = (dir, symbol) => path.join(dir, symbol.replace(/[^A-Za-z0-9_.-]/g, '_') + '.db');
+
+const getDb = (symbol) => {
+    const candidates = [];
+    if (symbol) {
+        if (SNAPSHOT_DIR) candidates.push({ file: shardPath(path.join(SNAPSHOT_DIR, 'shards'), symbol), snapshot: true });
+        candidates.push({ file: shardPath(SHARD_DIR, symbol) });
+    }
+    if (SNAPSHOT_DIR) candidates.push({ file: path.join(SNAPSHOT_DIR, path.basename(DB_PATH)), snapshot: true });
+    const { file, snapshot } = candidates.find(c => fs.existsSync(c.file)) || { file: DB_PATH };
+    if (snapshot) {
+        return new sqlite3.Database(`file:${file}?immutable=1`, sqlite3.OPEN_READONLY | sqlite3.OPEN_URI, (err) => {
+            if (err) {
+                console.error('Error opening snapshot:', err.message);
+            }
+        });
+    }
+    return new sqlite3.Database(file, sqlite3.OPEN_READONLY, (err) => {
         if (err) {
             console.error('Error opening database:', err.message);
         }
     });
 };
 
+// Resolves to the ingestor's JSON answer, or null if it is not configured,
+// unreachable or does not know the symbol
+const fromIngestor = async (urlPath) => {
+    if (!INGESTOR_URL) return null;
+    try {
+        const response = await fetch(INGESTOR_URL + urlPath, { signal: AbortSignal.timeout(500) });
+        return response.ok ? await response.json() : null;
+    } catch (err) {
+        return null;
+    }
+};
+
 // API: Get list of available cryptos
-app.get('/api/cryptos', (req, res) => {
+app.get('/api/cryptos', async (req, res) => {
+    const latest = await fromIngestor('/latest');
+    if (latest && Object.keys(latest).length) {
+        res.json(Object.keys(latest).sort());
+        return;
+    }
+    const shards = fs.existsSync(SHARD_DIR) ? fs.readdirSync(SHARD_DIR).filter(name => name.endsWith('.db')) : [];
     const db = getDb();
     const query = `
     SELECT DISTINCT symbol 
@@ -44,15 +91,23 @@ app.get('/api/cryptos', (req, res) => {
             res.status(500).json({ error: err.message });
             return;
         }
-        res.json(rows.map(row => row.symbol));
+        const symbols = new Set(rows.map(row => row.symbol));
+        shards.forEach(name => symbols.add(name.slice(0, -3)));
+        res.json([...symbols].sort());
         db.close();
     });
 });
 
 // API: Get latest price for a crypto
-app.get('/api/price/:symbol', (req, res) => {
-    const db = getDb();
+app.get('/api/price/:symbol', async (req, res) => {
     const symbol = req.params.symbol.toUpperCase();
+    const tick = await fromIngestor(`/latest/${encodeURIComponent(symbol)}`);
+    if (tick) {
+        delete tick.recent;
+        res.json(tick);
+        return;
+    }
+    const db = getDb(symbol);
     const query = `
     SELECT * FROM crypto_prices 
     WHERE symbol = ? 
@@ -70,11 +125,44 @@ app.get('/api/price/:symbol', (req, res) => {
     });
 });
 
+// Rollup intervals maintained by crypto-ingestor (price_rollups table)
+const ROLLUP_INTERVALS = ['1m', '5m', '1h', '1d'];
+
 // API: Get history for a crypto (for charts)
+// ?interval=1m|5m|1h|1d returns the most recent OHLC buckets instead of raw
+// points, with price set to the bucket close so existing charts still work.
 app.get('/api/history/:symbol', (req, res) => {
-    const db = getDb();
     const symbol = req.params.symbol.toUpperCase();
+    const db = getDb(symbol);
     const limit = req.query.limit || 100;
+    const interval = req.query.interval;
+
+    if (interval) {
+        if (!ROLLUP_INTERVALS.includes(interval)) {
+            res.status(400).json({ error: `interval must be one of ${ROLLUP_INTERVALS.join(', ')}` });
+            db.close();
+            return;
+        }
+        const rollupQuery = `
+    SELECT * FROM (
+        SELECT symbol, bucket AS timestamp, close AS price, open, high, low, close,
+               price_sum / count AS avg, count
+        FROM price_rollups
+        WHERE symbol = ? AND interval = ?
+        ORDER BY bucket DESC
+        LIMIT ?
+    ) ORDER BY timestamp ASC
+  `;
+        db.all(rollupQuery, [symbol, interval, limit], (err, rows) => {
+            if (err) {
+                res.status(500).json({ error: err.message });
+                return;
+            }
+            res.json(rows);
+            db.close();
+        });
+        return;
+    }
 
     const query = `
     SELECT * FROM crypto_prices 
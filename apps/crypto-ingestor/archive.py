@@ -0,0 +1,208 @@
+import os
+import re
+import sys
+import mmap
+import struct
+from array import array
+from datetime import datetime, timezone
+
+# Parquet is only written when pyarrow happens to be installed; the default
+# image stays on the standard library and writes the binary format below.
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# Cold storage for raw price history. Closed days are moved out of
+# crypto_prices into one file per (symbol, source, UTC day):
+#
+#   <archive dir>/<SYMBOL>/<source>/<YYYY-MM-DD>.cpa      (or .parquet)
+#
+# .cpa layout, all little-endian:
+#
+#   offset  size      field
+#   0       4         magic b"CPA1"
+#   4       2         format version (1)
+#   6       2         reserved, 0
+#   8       8         int64 row count N
+#   16      8         int64 first timestamp (epoch ms)
+#   24      8         int64 last timestamp (epoch ms)
+#   32      8 * N     int64 timestamps (epoch ms), ascending, unique
+#   32+8N   8 * N     float64 prices
+#
+# Both columns start on an 8-byte boundary, so readers can map them in place:
+# numpy.memmap(path, "<i8", offset=32, shape=(N,)) for the timestamps and
+# offset=32 + 8 * N for the prices, or ArchiveFile without numpy. Parquet
+# files hold the same two columns, "timestamp" (int64) and "price" (double).
+
+MAGIC = b"CPA1"
+VERSION = 1
+HEADER = struct.Struct("<4sHHqqq")
+DAY_MS = 24 * 60 * 60 * 1000
+FORMATS = ("binary", "parquet")
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def resolve_format(name):
+    """Map ARCHIVE_FORMAT (auto|binary|parquet) to the format actually written."""
+    if name == "auto":
+        return "parquet" if pyarrow is not None else "binary"
+    if name not in FORMATS:
+        raise ValueError(f"unknown archive format {name!r}")
+    if name == "parquet" and pyarrow is None:
+        raise ValueError("ARCHIVE_FORMAT=parquet needs pyarrow installed")
+    return name
+
+
+def _component(value):
+    # Symbols and sources also arrive through POST /ingest; keep each one to a
+    # single safe path segment
+    return _UNSAFE.sub("_", value) if value else "_"
+
+
+def symbol_dir(archive_dir, symbol):
+    return os.path.join(archive_dir, _component(symbol))
+
+
+def day_path(archive_dir, symbol, source, day_start, fmt):
+    day = datetime.fromtimestamp(day_start / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+    extension = ".parquet" if fmt == "parquet" else ".cpa"
+    return os.path.join(symbol_dir(archive_dir, symbol), _component(source), day + extension)
+
+
+class ArchiveFile:
+    """A memory-mapped .cpa file; timestamps and prices are zero-copy views."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        if size < HEADER.size:
+            self.close()
+            raise ValueError(f"{path}: truncated archive header")
+        magic, version, _, count, self.first, self.last = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path}: not a version {VERSION} price archive")
+        if size != HEADER.size + 16 * count:
+            self.close()
+            raise ValueError(f"{path}: expected {count} rows, file is {size} bytes")
+        view = memoryview(self.map)
+        self.count = count
+        self.timestamps = view[HEADER.size:HEADER.size + 8 * count].cast("q")
+        self.prices = view[HEADER.size + 8 * count:].cast("d")
+        if sys.byteorder != "little":
+            # Mapped views would be byte-swapped; fall back to swapped copies
+            self.timestamps = _swapped("q", self.timestamps)
+            self.prices = _swapped("d", self.prices)
+
+    def close(self):
+        for name in ("timestamps", "prices"):
+            view = getattr(self, name, None)
+            if isinstance(view, memoryview):
+                view.release()
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _swapped(typecode, view):
+    values = array(typecode, view.tobytes())
+    values.byteswap()
+    view.release()
+    return values
+
+
+def read_archive(path):
+    """Return (timestamps, prices) lists from a .cpa or .parquet archive file."""
+    if path.endswith(".parquet"):
+        table = pyarrow.parquet.read_table(path, memory_map=True)
+        return table.column("timestamp").to_pylist(), table.column("price").to_pylist()
+    with ArchiveFile(path) as f:
+        return f.timestamps.tolist(), f.prices.tolist()
+
+
+def write_archive(path, timestamps, prices):
+    """Atomically write one archive file; the format follows the extension."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    if path.endswith(".parquet"):
+        table = pyarrow.table({
+            "timestamp": pyarrow.array(timestamps, type=pyarrow.int64()),
+            "price": pyarrow.array(prices, type=pyarrow.float64()),
+        })
+        pyarrow.parquet.write_table(table, tmp)
+    else:
+        ts_column = array("q", timestamps)
+        price_column = array("d", prices)
+        if sys.byteorder != "little":
+            ts_column.byteswap()
+            price_column.byteswap()
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0, len(timestamps), timestamps[0], timestamps[-1]))
+            f.write(ts_column.tobytes())
+            f.write(price_column.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def archive_next_day(conn, archive_dir, cutoff, fmt):
+    """Move the oldest closed day of one symbol, older than cutoff, into files.
+
+    cutoff is epoch ms and is rounded down to a UTC day boundary. Rows for a
+    day that already has a file (late backfill) are merged into it, the newer
+    price winning. Files are fsynced before the rows are deleted, so a crash in
+    between only leaves rows that the next call merges again. Returns the
+    number of rows moved; call again until it returns 0.
+    """
+    cutoff = (cutoff // DAY_MS) * DAY_MS
+    for (symbol,) in conn.execute("SELECT DISTINCT symbol FROM price_rollups WHERE interval = '1d'").fetchall():
+        oldest = conn.execute(
+            "SELECT min(timestamp) FROM crypto_prices WHERE symbol = ? AND timestamp < ?", (symbol, cutoff)
+        ).fetchone()[0]
+        if oldest is not None:
+            return _archive_day(conn, archive_dir, symbol, (oldest // DAY_MS) * DAY_MS, fmt)
+    return 0
+
+
+def _archive_day(conn, archive_dir, symbol, day_start, fmt):
+    span = (symbol, day_start, day_start + DAY_MS)
+    conn.execute("BEGIN IMMEDIATE")
+    with conn:
+        by_source = {}
+        for source, timestamp, price in conn.execute("""
+            SELECT source, timestamp, price FROM crypto_prices
+            WHERE symbol = ? AND timestamp >= ? AND timestamp < ?
+            ORDER BY timestamp, id
+        """, span):
+            by_source.setdefault(source, {})[timestamp] = price
+
+        for source, points in by_source.items():
+            path = day_path(archive_dir, symbol, source, day_start, fmt)
+            # Any existing file for the day, in either format
+            for existing in (day_path(archive_dir, symbol, source, day_start, f) for f in FORMATS):
+                if os.path.exists(existing):
+                    old_ts, old_prices = read_archive(existing)
+                    merged = dict(zip(old_ts, old_prices))
+                    merged.update(points)
+                    points = merged
+            timestamps = sorted(points)
+            write_archive(path, timestamps, [points[ts] for ts in timestamps])
+            for f in FORMATS:
+                stale = day_path(archive_dir, symbol, source, day_start, f)
+                if stale != path and os.path.exists(stale):
+                    os.remove(stale)
+
+        return conn.execute(
+            "DELETE FROM crypto_prices WHERE symbol = ? AND timestamp >= ? AND timestamp < ?", span
+        ).rowcount
@@ -0,0 +1,331 @@
+import re
+import time
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import rollups
+
+
+# Per-connection tuning. WAL lets the frontend and tools/check_db.py read while
+# the ingestor writes; synchronous=NORMAL only fsyncs at checkpoints, which is
+# still durable against application crashes in WAL mode.
+CONNECTION_PRAGMAS = [
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -8000",      # 8 MiB page cache
+    "PRAGMA mmap_size = 33554432",    # 32 MiB memory-mapped reads
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+]
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+TIMESTAMP_RE = re.compile(
+    r"^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?(Z|[+-]\d{2}:?\d{2})?$"
+)
+
+
+UNIQUE_INDEX = "idx_crypto_prices_point"
+
+# A kline re-fetched after a collector restart replaces the stored point
+# instead of adding a copy; the WHERE skips the write when nothing changed.
+UPSERT_SQL = """
+    INSERT INTO crypto_prices (symbol, price, timestamp, source) VALUES (?, ?, ?, ?)
+    ON CONFLICT (symbol, timestamp, source) DO UPDATE SET price = excluded.price
+    WHERE price <> excluded.price
+"""
+
+# Used until compact_duplicates() has made the unique index possible
+INSERT_MISSING_SQL = """
+    INSERT INTO crypto_prices (symbol, price, timestamp, source)
+    SELECT ?1, ?2, ?3, ?4
+    WHERE NOT EXISTS (
+        SELECT 1 FROM crypto_prices WHERE symbol = ?1 AND timestamp = ?3 AND source IS ?4
+    )
+"""
+
+
+# Written in the same transaction as a file's last row. A file is identified
+# by (name, size, mtime_ns), which survives the rename into processing/, so a
+# file replayed after a crash between commit and unlink is recognised.
+LEDGER_INSERT_SQL = """
+    INSERT OR IGNORE INTO ingest_ledger (name, size, mtime_ns, records, ingested_at)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+
+def connect(path, **kwargs):
+    conn = sqlite3.connect(path, **kwargs)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def parse_timestamp(value):
+    """Convert a collector timestamp to integer epoch milliseconds.
+
+    Accepts RFC 3339 strings as written by Go's time.Time (any number of
+    fractional digits, "Z" or a numeric offset; naive values are UTC) and
+    numeric epochs in seconds or milliseconds. Returns None if unparseable.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(round(value if value > 1e11 else value * 1000))
+    if not isinstance(value, str):
+        return None
+
+    match = TIMESTAMP_RE.match(value.strip())
+    if not match:
+        return None
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    tz = timezone.utc
+    if offset and offset != "Z":
+        sign = -1 if offset[0] == "-" else 1
+        digits = offset[1:].replace(":", "")
+        tz = timezone(sign * timedelta(hours=int(digits[:2]), minutes=int(digits[2:])))
+    micros = int((fraction or "0")[:6].ljust(6, "0"))
+    dt = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), micros, tzinfo=tz)
+    return (dt - EPOCH) // timedelta(milliseconds=1)
+
+
+def _create_prices_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS crypto_prices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            symbol TEXT,
+            price REAL,
+            timestamp TEXT,
+            source TEXT
+        );
+    """)
+
+
+def _epoch_timestamps(conn):
+    # SQLite cannot change a column type in place, so rebuild the table and
+    # backfill the TEXT timestamps as epoch milliseconds.
+    conn.create_function("parse_timestamp", 1, parse_timestamp, deterministic=True)
+    conn.execute("""
+        CREATE TABLE crypto_prices_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            symbol TEXT NOT NULL,
+            price REAL NOT NULL,
+            timestamp INTEGER NOT NULL,
+            source TEXT
+        );
+    """)
+    total = conn.execute("SELECT count(*) FROM crypto_prices").fetchone()[0]
+    copied = conn.execute("""
+        INSERT INTO crypto_prices_new (id, symbol, price, timestamp, source)
+        SELECT id, symbol, price, ts, source
+        FROM (SELECT id, symbol, price, parse_timestamp(timestamp) AS ts, source FROM crypto_prices)
+        WHERE ts IS NOT NULL AND symbol IS NOT NULL AND price IS NOT NULL
+    """).rowcount
+    if copied < total:
+        print(f"   Dropped {total - copied} rows with a missing or unparseable timestamp")
+    conn.execute("DROP TABLE crypto_prices")
+    conn.execute("ALTER TABLE crypto_prices_new RENAME TO crypto_prices")
+
+
+def _symbol_timestamp_index(conn):
+    # Covers the frontend's and check_db.py's "WHERE symbol = ? ORDER BY
+    # timestamp" lookups without touching the table itself
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_crypto_prices_symbol_ts
+        ON crypto_prices (symbol, timestamp, price, source)
+    """)
+
+
+def _price_rollups(conn):
+    conn.execute(rollups.CREATE_TABLE_SQL)
+    rollups.rebuild_rollups(conn)
+
+
+def _ingest_ledger(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_ledger (
+            name TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            records INTEGER NOT NULL,
+            ingested_at INTEGER NOT NULL,
+            PRIMARY KEY (name, size, mtime_ns)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ingest_ledger_ingested_at ON ingest_ledger (ingested_at)")
+
+
+# Applied in order, each in its own transaction; PRAGMA user_version records
+# the last one that committed. Never edit an entry once it has shipped.
+MIGRATIONS = [
+    (1, "create crypto_prices", _create_prices_table),
+    (2, "integer epoch-millisecond timestamps", _epoch_timestamps),
+    (3, "(symbol, timestamp) covering index", _symbol_timestamp_index),
+    (4, "1m/5m/1h/1d OHLC rollups", _price_rollups),
+    (5, "ingest ledger", _ingest_ledger),
+]
+
+
+def migrate(conn):
+    # journal_mode cannot change inside a transaction; it is persistent, so
+    # every later connection (including read-only ones) sees WAL
+    conn.execute("PRAGMA journal_mode = WAL")
+
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, description, apply in MIGRATIONS:
+        if target <= version:
+            continue
+        print(f"Applying schema migration {target}: {description}")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            apply(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = target
+    return version
+
+
+def has_unique_index(conn):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (UNIQUE_INDEX,)
+    ).fetchone()
+    return row is not None
+
+
+def ensure_unique_index(conn):
+    """Enforce one row per (symbol, timestamp, source) if the data allows it.
+
+    Returns False while duplicates from before the constraint remain; run
+    compact_duplicates() (``python main.py compact``) to remove them.
+    """
+    if has_unique_index(conn):
+        return True
+    try:
+        with conn:
+            conn.execute(f"""
+                CREATE UNIQUE INDEX {UNIQUE_INDEX}
+                ON crypto_prices (symbol, timestamp, source)
+            """)
+    except sqlite3.IntegrityError:
+        return False
+    return True
+
+
+# Secondary indexes a bulk load may drop and rebuild in one pass afterwards,
+# instead of updating them row by row (the same definitions as migrations 3
+# and 5). The unique index always stays: upserts and rollup refreshes use it,
+# and it still serves per-symbol reads while the covering index is gone.
+DEFERRABLE_INDEXES = {
+    "idx_crypto_prices_symbol_ts": "ON crypto_prices (symbol, timestamp, price, source)",
+    "idx_ingest_ledger_ingested_at": "ON ingest_ledger (ingested_at)",
+}
+
+
+def drop_deferrable_indexes(conn):
+    """Drop DEFERRABLE_INDEXES; returns False (and keeps them) without the unique index."""
+    if not has_unique_index(conn):
+        return False
+    with conn:
+        for name in DEFERRABLE_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+    return True
+
+
+def index_names(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def create_deferrable_indexes(conn):
+    """Build whichever of DEFERRABLE_INDEXES is missing; returns how many were built."""
+    existing = index_names(conn)
+    missing = [name for name in DEFERRABLE_INDEXES if name not in existing]
+    with conn:
+        for name in missing:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} {DEFERRABLE_INDEXES[name]}")
+    return len(missing)
+
+
+def insert_sql(conn):
+    return UPSERT_SQL if has_unique_index(conn) else INSERT_MISSING_SQL
+
+
+# Rows in an id range with a newer copy of the same point
+DUPLICATES_WHERE = """
+    id BETWEEN ? AND ?
+    AND EXISTS (
+        SELECT 1 FROM crypto_prices AS newer
+        WHERE newer.symbol = crypto_prices.symbol
+        AND newer.timestamp = crypto_prices.timestamp
+        AND newer.source IS crypto_prices.source
+        AND newer.id > crypto_prices.id
+    )
+"""
+
+
+def compact_duplicates(conn, chunk_size=5000, pause=0.05, raw_since=None):
+    """Delete duplicate price points, keeping the newest copy of each.
+
+    Works through the table in id ranges of chunk_size, one short transaction
+    per range, and sleeps between them so the ingestor can take the write
+    lock. The rollup buckets of the deleted rows are refreshed in the same
+    transaction (raw_since as for rollups.update_rollups). Returns the number
+    of rows removed.
+    """
+    low, high = conn.execute("SELECT min(id), max(id) FROM crypto_prices").fetchone()
+    if low is None:
+        return 0
+
+    removed = 0
+    for start in range(low, high + 1, chunk_size):
+        bounds = (start, start + chunk_size - 1)
+        conn.execute("BEGIN IMMEDIATE")
+        with conn:
+            points = conn.execute(
+                f"SELECT DISTINCT symbol, timestamp FROM crypto_prices WHERE {DUPLICATES_WHERE}", bounds
+            ).fetchall()
+            if points:
+                removed += conn.execute(f"DELETE FROM crypto_prices WHERE {DUPLICATES_WHERE}", bounds).rowcount
+                rollups.update_rollups(conn, points, raw_since)
+        if pause:
+            time.sleep(pause)
+    return removed
+
+
+def in_ledger(conn, key):
+    row = conn.execute(
+        "SELECT 1 FROM ingest_ledger WHERE name = ? AND size = ? AND mtime_ns = ?", key
+    ).fetchone()
+    return row is not None
+
+
+def purge_symbol(conn, symbol, limit=5000):
+    """Delete up to limit rows of one symbol: raw prices first, then its rollups.
+
+    Returns (raw rows deleted, rollup rows deleted); call again until both
+    are 0. Each call is one short transaction.
+    """
+    with conn:
+        raw = conn.execute("""
+            DELETE FROM crypto_prices WHERE id IN (
+                SELECT id FROM crypto_prices WHERE symbol = ? LIMIT ?
+            )
+        """, (symbol, limit)).rowcount
+        if raw:
+            return raw, 0
+        return 0, conn.execute("""
+            DELETE FROM price_rollups WHERE (symbol, interval, bucket) IN (
+                SELECT symbol, interval, bucket FROM price_rollups WHERE symbol = ? LIMIT ?
+            )
+        """, (symbol, limit)).rowcount
+
+
+def prune_ledger(conn, cutoff, limit=5000):
+    """Delete up to limit ledger entries recorded before cutoff (epoch ms)."""
+    with conn:
+        return conn.execute("""
+            DELETE FROM ingest_ledger WHERE (name, size, mtime_ns) IN (
+                SELECT name, size, mtime_ns FROM ingest_ledger WHERE ingested_at < ? LIMIT ?
+            )
+        """, (cutoff, limit)).rowcount
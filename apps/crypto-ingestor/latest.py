@@ -0,0 +1,85 @@
+import threading
+from collections import deque
+from itertools import islice
+
+
+# In-memory view of the newest ticks, fed by the writer thread after each
+# commit so readers never touch SQLite. Per symbol it keeps the latest tick
+# and a ring buffer of the last `window` ticks; every change is also appended
+# to a shared event log that Server-Sent Events subscribers follow by sequence
+# number. A subscriber that falls more than `backlog` events behind skips
+# ahead to the current state instead of growing a queue.
+
+class LatestPrices:
+    def __init__(self, window=300, backlog=10000):
+        self.window = window
+        self.latest = {}
+        self.recent = {}
+        self.events = deque(maxlen=backlog)
+        self.seq = 0
+        self.changed = threading.Condition()
+
+    def update(self, rows):
+        """Apply committed (symbol, price, timestamp, source) rows."""
+        with self.changed:
+            for symbol, price, timestamp, source in sorted(rows, key=lambda row: row[2]):
+                current = self.latest.get(symbol)
+                # Backfilled points are older than what is shown; keep them
+                # out of the latest tick and the ring buffer
+                if current is not None and timestamp < current["timestamp"]:
+                    continue
+                tick = {"symbol": symbol, "price": price, "timestamp": timestamp, "source": source}
+                self.latest[symbol] = tick
+                recent = self.recent.setdefault(symbol, deque(maxlen=self.window))
+                if recent and recent[-1][0] == timestamp:
+                    recent[-1] = (timestamp, price)
+                else:
+                    recent.append((timestamp, price))
+                self.seq += 1
+                self.events.append((self.seq, tick))
+            self.changed.notify_all()
+
+    def load(self, conn):
+        """Seed from the database at startup, so a restart does not empty the cache."""
+        symbols = [row[0] for row in conn.execute("SELECT DISTINCT symbol FROM price_rollups WHERE interval = '1d'")]
+        rows = []
+        for symbol in symbols:
+            rows.extend(reversed(conn.execute("""
+                SELECT symbol, price, timestamp, source FROM crypto_prices
+                WHERE symbol = ? ORDER BY timestamp DESC LIMIT ?
+            """, (symbol, self.window)).fetchall()))
+        self.update(rows)
+
+    def forget(self, symbol):
+        with self.changed:
+            self.latest.pop(symbol, None)
+            self.recent.pop(symbol, None)
+
+    def get(self, symbol=None):
+        with self.changed:
+            if symbol is None:
+                return dict(self.latest)
+            tick = self.latest.get(symbol)
+            if tick is None:
+                return None
+            return dict(tick, recent=[list(point) for point in self.recent[symbol]])
+
+    def wait(self, after, timeout):
+        """Ticks with a sequence number above `after`, blocking up to timeout.
+
+        Returns (last sequence number, ticks). A subscriber starts with
+        after=None and gets the current latest tick of every symbol.
+        """
+        with self.changed:
+            if after is None:
+                return self.seq, list(self.latest.values())
+            if self.seq == after:
+                self.changed.wait(timeout)
+            if not self.events or self.seq == after:
+                return self.seq, []
+            first = self.events[0][0]
+            if first > after + 1:
+                # Fell behind the event log
+                return self.seq, list(self.latest.values())
+            # Sequence numbers in the log are contiguous
+            return self.seq, [tick for _, tick in islice(self.events, after + 1 - first, None)]
@@ -1,72 +1,1495 @@
+import io
 import os
+import math
+import sys
 import time
 import json
+import hmac
 import sqlite3
-import glob
+import queue
+import select
+import signal
+import shutil
+import struct
+import ctypes
+import ctypes.util
 import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
+import db
+import archive
+import latest
+import shards
+import segment
+import snapshot
+import profiling
+import watermarks
+import metrics
+import rollups
 
-DATA_DIR = "/data/raw"
-DB_PATH = "/data/crypto.db"
-PORT = 8080
+
+DATA_DIR = os.environ.get("DATA_DIR", "/data/raw")
+# Files are claimed by renaming them into PROCESSING_DIR before they are read;
+# files that cannot be parsed are moved to QUARANTINE_DIR with an .error.json
+# next to them instead of being retried forever.
+PROCESSING_DIR = os.path.join(DATA_DIR, "processing")
+QUARANTINE_DIR = os.path.join(DATA_DIR, "quarantine")
+DB_PATH = os.environ.get("DB_PATH", "/data/crypto.db")
+PORT = int(os.environ.get("PORT", "8080"))
+
+# STORAGE_LAYOUT=sharded writes each symbol's prices and rollups to its own
+# database, SHARD_DIR/<SYMBOL>.db (see shards.py), committing the shards a
+# batch touches on up to SHARD_WRITERS threads at once. DB_PATH keeps the
+# ingest ledger and any rows written before the switch; purging a symbol
+# deletes its shard file. "single" keeps everything in DB_PATH.
+STORAGE_LAYOUT = os.environ.get("STORAGE_LAYOUT", "single")
+SHARD_DIR = os.environ.get("SHARD_DIR", "/data/shards")
+SHARD_WRITERS = int(os.environ.get("SHARD_WRITERS", "4"))
+if STORAGE_LAYOUT not in ("single", "sharded"):
+    raise ValueError(f"unknown STORAGE_LAYOUT {STORAGE_LAYOUT!r}, expected single or sharded")
+
+# Batch ingestion: files are grouped into one transaction of up to BATCH_SIZE
+# rows, committed early once the oldest pending row has waited FLUSH_INTERVAL
+# seconds. Under steady load the writer never goes idle, so this deadline,
+# not BATCH_LINGER, bounds how long a file takes to become visible.
+BATCH_SIZE = int(os.environ.get("BATCH_SIZE", "500"))
+FLUSH_INTERVAL = float(os.environ.get("FLUSH_INTERVAL", "0.05"))
+
+# File discovery: "inotify" reacts to IN_CLOSE_WRITE/IN_MOVED_TO events, "poll"
+# rescans DATA_DIR with an interval that backs off from MIN_POLL_INTERVAL to
+# POLL_INTERVAL while idle. "auto" prefers inotify and falls back to polling.
+# Use "poll" when /data is a network filesystem that does not deliver inotify
+# events for writes made on other nodes.
+WATCH_MODE = os.environ.get("WATCH_MODE", "auto")
+MIN_POLL_INTERVAL = float(os.environ.get("MIN_POLL_INTERVAL", "0.05"))
+POLL_INTERVAL = float(os.environ.get("POLL_INTERVAL", "5"))
+
+# Pipeline: discovery -> PARSE_WORKERS parser threads -> one writer thread.
+# Both hand-off queues hold at most QUEUE_SIZE items, so a slow writer blocks
+# the parsers and a slow parser stage blocks discovery. The writer commits once
+# no record has arrived for BATCH_LINGER seconds.
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", str(os.cpu_count() or 2)))
+QUEUE_SIZE = int(os.environ.get("QUEUE_SIZE", "2000"))
+BATCH_LINGER = float(os.environ.get("BATCH_LINGER", "0.02"))
+
+# Catch-up mode: when more than CATCHUP_BACKLOG files wait in DATA_DIR (e.g.
+# after an outage) the writer commits CATCHUP_BATCH_SIZE-row transactions,
+# runs with synchronous=OFF and drops db.DEFERRABLE_INDEXES, rebuilding them
+# once the backlog is under a tenth of the threshold. With synchronous=OFF a
+# power loss (not a process crash) can lose the last commits of files that
+# were already deleted. Checked every CATCHUP_CHECK_INTERVAL seconds; /health
+# reports the progress. 0 disables it.
+CATCHUP_BACKLOG = int(os.environ.get("CATCHUP_BACKLOG", "10000"))
+CATCHUP_BATCH_SIZE = int(os.environ.get("CATCHUP_BATCH_SIZE", "20000"))
+CATCHUP_FLUSH_INTERVAL = 5.0
+CATCHUP_CHECK_INTERVAL = 5
+
+# Raw rows older than RAW_RETENTION_DAYS are pruned in small chunks while the
+# writer is idle; the OHLC rollups keep the full history. 0 keeps raw forever.
+# A late point older than the cutoff (see raw_horizon) only fills a minute
+# with no rollup yet; it does not change the rollups of pruned minutes.
+RAW_RETENTION_DAYS = float(os.environ.get("RAW_RETENTION_DAYS", "0"))
+RETENTION_CHECK_INTERVAL = 60
+LEDGER_RETENTION_DAYS = float(os.environ.get("LEDGER_RETENTION_DAYS", "7"))
+
+# Closed UTC days older than ARCHIVE_AFTER_DAYS are moved from crypto_prices
+# into per-symbol columnar files under ARCHIVE_DIR (see archive.py for the
+# format), one symbol-day per idle tick. ARCHIVE_FORMAT is "binary",
+# "parquet" (needs pyarrow) or "auto". 0 keeps all raw rows in SQLite. Runs
+# before RAW_RETENTION_DAYS pruning, so set that longer or leave it at 0.
+ARCHIVE_AFTER_DAYS = float(os.environ.get("ARCHIVE_AFTER_DAYS", "0"))
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "/data/archive")
+ARCHIVE_FORMAT = archive.resolve_format(os.environ.get("ARCHIVE_FORMAT", "auto"))
+
+# A file whose batch failed to commit is retried after RETRY_DELAY seconds. A
+# parse error on a file modified less than QUARANTINE_GRACE seconds ago gets
+# one more attempt, in case a poll caught it while it was still being written.
+# A batch failing with one of POISON_ERRORS is retried one file (or push) at
+# a time right away, and the files that fail alone are quarantined.
+RETRY_DELAY = 5
+QUARANTINE_GRACE = 2
+POISON_ERRORS = (
+    sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError, sqlite3.DataError,
+    ValueError, TypeError, OverflowError,
+)
+
+# Collector files may hold one record, a JSON array or NDJSON; they are decoded
+# STREAM_CHUNK_SIZE characters at a time and any single record is capped at
+# MAX_RECORD_BYTES, so large backfill files never have to fit in memory.
+# Files starting with segment.MAGIC are binary segments (see segment.py),
+# decoded from a memory map. Only names ending in DROP_SUFFIXES are picked up.
+STREAM_CHUNK_SIZE = 64 * 1024
+MAX_RECORD_BYTES = 1024 * 1024
+DROP_SUFFIXES = (".json", segment.SUFFIX)
+
+# Push ingestion: POST /ingest answers once the records have committed, or
+# with 503 if that takes longer than INGEST_TIMEOUT seconds. The body comes
+# with a Content-Length or chunked (Transfer-Encoding), up to MAX_INGEST_BYTES.
+# It is decoded as it is read and queued BATCH_SIZE records at a time, so a
+# push holds one decode chunk and one batch in memory, whatever its size;
+# records before a bad one may already have committed when it gets its 400.
+INGEST_TIMEOUT = float(os.environ.get("INGEST_TIMEOUT", "10"))
+MAX_INGEST_BYTES = int(os.environ.get("MAX_INGEST_BYTES", str(8 * 1024 * 1024)))
+
+# Records are checked before they are queued: symbol and source must be
+# non-empty strings, price a finite number and the timestamp must fit the
+# INTEGER column as epoch milliseconds. A push with a bad record gets a 400;
+# a file with one is quarantined.
+MIN_TIMESTAMP, MAX_TIMESTAMP = -2**63, 2**63 - 1
+
+# GET /latest and /latest/<symbol> answer from memory: the newest tick per
+# symbol plus its last LATEST_WINDOW ticks, updated as batches commit.
+# GET /stream pushes each new tick as a Server-Sent Event, with a comment
+# line every SSE_HEARTBEAT seconds to keep idle proxies from closing it.
+LATEST_WINDOW = int(os.environ.get("LATEST_WINDOW", "300"))
+SSE_HEARTBEAT = 15
+
+# POST /admin/purge/<symbol> removes a coin's raw rows, rollups and archive
+# files. The writer thread deletes PURGE_CHUNK_SIZE rows at a time, at most
+# once per PURGE_INTERVAL seconds and in between ingest batches, so a large
+# purge never holds the write lock for long. GET reports progress. Every
+# /admin request must send the ADMIN_TOKEN in an X-Admin-Token header (not
+# Authorization, which the API server's service proxy consumes); without an
+# ADMIN_TOKEN the admin endpoints are disabled.
+PURGE_CHUNK_SIZE = int(os.environ.get("PURGE_CHUNK_SIZE", "2000"))
+PURGE_INTERVAL = float(os.environ.get("PURGE_INTERVAL", "0.1"))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# Every SNAPSHOT_INTERVAL seconds a consistent copy of DB_PATH (and of each
+# shard) is published under SNAPSHOT_DIR for readers that should not touch the
+# live files (see snapshot.py). The copy runs on its own thread, SNAPSHOT_PAGES
+# pages at a time, and never takes the write lock. 0 disables it.
+SNAPSHOT_INTERVAL = float(os.environ.get("SNAPSHOT_INTERVAL", "0"))
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "/data/snapshot")
+SNAPSHOT_PAGES = int(os.environ.get("SNAPSHOT_PAGES", "1024"))
+
+# POST /admin/profile?seconds=N samples the stacks of the PROFILE_THREADS
+# pipeline threads every ?interval= seconds (default 0.01) for at most
+# PROFILE_MAX_SECONDS; GET /admin/profile/collapsed (flame graphs) or
+# /admin/profile/pstats reads the result. GET /admin/trace?batches=K lists
+# the per-stage timings of the last K (at most TRACE_BATCHES) batches.
+PROFILE_MAX_SECONDS = 300
+PROFILE_THREADS = ("discovery", "parser", "writer", "shard-writer")
+TRACE_BATCHES = int(os.environ.get("TRACE_BATCHES", "200"))
+
+# Per-(symbol, source) watermark and gap index (see watermarks.py), updated
+# on every commit, served on GET /watermarks[?symbol=] and written to
+# WATERMARKS_PATH (at most every WATERMARKS_WRITE_INTERVAL seconds), where
+# collectors read it to backfill only missing ranges. Points more than
+# WATERMARK_GAP_SECONDS apart leave a gap; gaps are tracked for the last
+# WATERMARK_WINDOW_HOURS.
+WATERMARKS_PATH = os.environ.get("WATERMARKS_PATH", os.path.join(os.path.dirname(DB_PATH), "watermarks.json"))
+WATERMARK_GAP_SECONDS = float(os.environ.get("WATERMARK_GAP_SECONDS", "120"))
+WATERMARK_WINDOW_HOURS = float(os.environ.get("WATERMARK_WINDOW_HOURS", "24"))
+WATERMARKS_WRITE_INTERVAL = 5
+
+class BacklogStats:
+    """Files waiting in a directory, rescanned at most once per max_age.
+
+    Read by /metrics scrapes, /health and the discovery thread at once; the
+    lock also keeps concurrent callers from scanning a large backlog twice.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.scanned_at = 0.0
+        self.value = (0, 0.0)
+
+    def get(self, max_age=5.0):
+        """(file count, oldest file age in seconds)."""
+        with self.lock:
+            now = time.time()
+            if now - self.scanned_at >= max_age:
+                self.value = self._scan(now)
+                self.scanned_at = now
+            return self.value
+
+    def _scan(self, now):
+        count, oldest = 0, now
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if entry.name.endswith(DROP_SUFFIXES):
+                        count += 1
+                        try:
+                            oldest = min(oldest, entry.stat().st_mtime)
+                        except FileNotFoundError:
+                            pass
+        except FileNotFoundError:
+            pass
+        return count, now - oldest
+
+BACKLOG = BacklogStats(DATA_DIR)
+
+# Hot-path instrumentation, exposed on /metrics
+FILES_INGESTED = metrics.Counter("crypto_ingestor_files_ingested_total", "Collector files committed to the database")
+FILES_FAILED = metrics.Counter("crypto_ingestor_files_failed_total", "Collector files that could not be read or parsed")
+FILES_QUARANTINED = metrics.Counter("crypto_ingestor_files_quarantined_total", f"Files moved to {QUARANTINE_DIR}")
+FILES_REPLAYED = metrics.Counter(
+    "crypto_ingestor_files_replayed_total", "Files skipped because the ingest ledger shows them as committed",
+)
+RECORDS_INGESTED = metrics.Counter("crypto_ingestor_records_ingested_total", "Price records committed (files and pushes)")
+ROWS_PURGED = metrics.Counter("crypto_ingestor_purged_rows_total", "Raw and rollup rows deleted by symbol purges")
+BATCHES_FAILED = metrics.Counter("crypto_ingestor_batch_commit_failures_total", "Batches whose transaction failed")
+WRITER_ERRORS = metrics.Counter("crypto_ingestor_writer_errors_total", "Unexpected errors caught by the writer loop")
+PARSER_ERRORS = metrics.Counter("crypto_ingestor_parser_errors_total", "Unexpected errors caught by the parser threads")
+BATCH_SIZE_HIST = metrics.Histogram(
+    "crypto_ingestor_batch_size", "Records per committed batch",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+COMMIT_DURATION = metrics.Histogram(
+    "crypto_ingestor_commit_duration_seconds", "Insert, rollup refresh and commit time per batch, after the lock is held",
+)
+LOCK_WAIT = metrics.Histogram(
+    "crypto_ingestor_db_lock_wait_seconds", "Time spent waiting for the SQLite write lock per batch",
+)
+LIST_TIME = metrics.Counter(
+    "crypto_ingestor_list_seconds_total", f"Time spent listing {DATA_DIR} or reading its inotify events",
+)
+PARSE_DURATION = metrics.Histogram(
+    "crypto_ingestor_parse_duration_seconds", "Time to read and decode one collector file",
+    buckets=(.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, 1),
+)
+metrics.Gauge("crypto_ingestor_backlog_files", f"Collector files waiting in {DATA_DIR}", lambda: BACKLOG.get()[0])
+metrics.Gauge(
+    "crypto_ingestor_backlog_oldest_file_age_seconds", f"Age of the oldest file waiting in {DATA_DIR}",
+    lambda: BACKLOG.get()[1],
+)
+CATCHING_UP = metrics.Gauge("crypto_ingestor_catching_up", "1 while in backlog catch-up mode", lambda: 0)
+PARSE_QUEUE_DEPTH = metrics.Gauge("crypto_ingestor_parse_queue_depth", "Paths waiting for a parser thread", lambda: 0)
+WRITE_QUEUE_DEPTH = metrics.Gauge("crypto_ingestor_write_queue_depth", "Records waiting for the writer thread", lambda: 0)
+SNAPSHOT_DURATION = metrics.Histogram(
+    "crypto_ingestor_snapshot_duration_seconds", f"Time to publish one set of snapshots to {SNAPSHOT_DIR}",
+    buckets=(.1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+SNAPSHOTS_FAILED = metrics.Counter("crypto_ingestor_snapshot_failures_total", "Snapshot publications that failed")
+SNAPSHOT_AGE = metrics.Gauge(
+    "crypto_ingestor_snapshot_age_seconds",
+    "Time since the snapshots were last published or found up to date (-1 before the first)",
+    lambda: -1,
+)
+metrics.Gauge("crypto_ingestor_up", "Service availability (1 = up, 0 = down)", lambda: 1)
+
+LATEST = latest.LatestPrices(LATEST_WINDOW)
+PROFILER = profiling.SamplingProfiler(PROFILE_THREADS)
+TRACE = profiling.BatchTrace(TRACE_BATCHES)
+WATERMARKS = watermarks.Watermarks(int(WATERMARK_GAP_SECONDS * 1000), int(WATERMARK_WINDOW_HOURS * 3600 * 1000))
 
 class HealthHandler(BaseHTTPRequestHandler):
     def do_GET(self):
-        if self.path == '/health':
+        url = urlsplit(self.path)
+        if url.path == '/latest':
+            self.send_json(200, LATEST.get())
+        elif url.path.startswith('/latest/'):
+            tick = LATEST.get(url.path[len('/latest/'):].upper())
+            if tick is None:
+                self.send_json(404, {"error": "unknown symbol"})
+            else:
+                self.send_json(200, tick)
+        elif url.path.startswith('/admin/'):
+            self.admin('GET', url.path, parse_qs(url.query))
+        elif url.path == '/watermarks':
+            symbol = parse_qs(url.query).get('symbol')
+            self.send_json(200, WATERMARKS.get(int(time.time() * 1000), symbol[0].upper() if symbol else None))
+        elif url.path == '/stream':
+            symbols = parse_qs(url.query).get('symbols')
+            self.stream_ticks(set(symbols[0].upper().split(',')) if symbols else None)
+        elif url.path == '/health':
+            # Always 200, the liveness probe uses it too; the body tells
+            # whether the ingestor is still migrating or catching up
+            pipeline = self.server.pipeline
+            self.send_json(200, pipeline.health() if pipeline else {"status": "migrating"})
+        elif url.path == '/metrics':
+            body = metrics.REGISTRY.exposition().encode()
             self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
-            self.wfile.write(b'OK')
+            self.wfile.write(body)
         else:
             self.send_response(404)
             self.end_headers()
 
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path.startswith('/admin/'):
+            self.admin('POST', url.path, parse_qs(url.query))
+            return
+        if url.path != '/ingest':
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        encoding = self.headers.get('Transfer-Encoding', '').strip().lower()
+        length = self.headers.get('Content-Length')
+        if encoding not in ('', 'chunked'):
+            self.send_json(501, {"error": f"unsupported Transfer-Encoding {encoding!r}"})
+            return
+        if not encoding and length is None:
+            self.send_json(411, {"error": "Content-Length or Transfer-Encoding: chunked required"})
+            return
+        if not encoding and not (length.isascii() and length.isdigit()):
+            self.send_json(400, {"error": f"invalid Content-Length {length!r}"})
+            return
+        if not encoding and int(length) > MAX_INGEST_BYTES:
+            self.send_json(413, {"error": f"body larger than {MAX_INGEST_BYTES} bytes"})
+            return
+        pipeline = self.server.pipeline
+        if pipeline is None:
+            self.send_json(503, {"error": "migrating the database, retry later"})
+            return
+
+        body = ChunkedBody(self.rfile, MAX_INGEST_BYTES) if encoding else LengthBody(self.rfile, int(length))
+        acks = []
+        error = None
+        try:
+            rows = []
+            for data in iter_json_values(io.TextIOWrapper(io.BufferedReader(body), encoding='utf-8')):
+                rows.append(parse_record(data))
+                if len(rows) >= BATCH_SIZE:
+                    acks.append((pipeline.submit(rows, INGEST_TIMEOUT), len(rows)))
+                    rows = []
+                    if acks[-1][0].error:
+                        break
+            else:
+                if rows:
+                    acks.append((pipeline.submit(rows, INGEST_TIMEOUT), len(rows)))
+        except BodyTooLarge:
+            error = (413, f"body larger than {MAX_INGEST_BYTES} bytes")
+        except KeyError as e:
+            error = (400, f"missing field {e}")
+        except (ValueError, TypeError) as e:
+            error = (400, str(e))
+
+        # Whatever was queued before an error still commits; report how much
+        ingested = 0
+        deadline = time.monotonic() + INGEST_TIMEOUT
+        for ack, count in acks:
+            if not ack.wait(max(0.0, deadline - time.monotonic())):
+                error = error or (503, ack.error or "timed out waiting for commit")
+                break
+            ingested += count
+        if error:
+            self.send_json(error[0], {"error": error[1], "ingested": ingested})
+        else:
+            self.send_json(200, {"ingested": ingested})
+
+    def admin(self, method, path, query):
+        if not ADMIN_TOKEN:
+            self.send_json(403, {"error": "admin endpoints are disabled, ADMIN_TOKEN is not set"})
+            return
+        if not hmac.compare_digest(self.headers.get('X-Admin-Token', '').encode(), ADMIN_TOKEN.encode()):
+            self.send_json(401, {"error": "X-Admin-Token header missing or wrong"})
+            return
+        pipeline = self.server.pipeline
+        if path.startswith('/admin/purge') and pipeline is None:
+            self.send_json(503, {"error": "migrating the database, retry later"})
+        elif path == '/admin/purge' and method == 'GET':
+            self.send_json(200, pipeline.purge_jobs())
+        elif path.startswith('/admin/purge/'):
+            symbol = path[len('/admin/purge/'):].upper()
+            if method == 'POST':
+                self.send_json(202, pipeline.purge(symbol))
+                return
+            job = pipeline.purge_jobs().get(symbol)
+            if job is None:
+                self.send_json(404, {"error": "no purge for this symbol"})
+            else:
+                self.send_json(200, job)
+        elif path == '/admin/profile' and method == 'POST':
+            try:
+                seconds = float(query.get('seconds', ['30'])[0])
+                interval = float(query.get('interval', ['0.01'])[0])
+            except ValueError:
+                self.send_json(400, {"error": "seconds and interval must be numbers"})
+                return
+            if not 0 < seconds <= PROFILE_MAX_SECONDS or not 0.001 <= interval <= 1:
+                self.send_json(400, {"error": f"seconds must be in (0, {PROFILE_MAX_SECONDS}], interval in [0.001, 1]"})
+            elif PROFILER.start(seconds, interval):
+                self.send_json(202, PROFILER.status())
+            else:
+                self.send_json(409, {"error": "a profile is already running", **PROFILER.status()})
+        elif path == '/admin/profile/stop' and method == 'POST':
+            PROFILER.stop()
+            self.send_json(200, PROFILER.status())
+        elif path == '/admin/profile':
+            self.send_json(200, PROFILER.status())
+        elif path == '/admin/profile/collapsed':
+            self.send_text(200, PROFILER.collapsed())
+        elif path == '/admin/profile/pstats':
+            sort = query.get('sort', ['cumulative'])[0]
+            limit = query.get('limit', ['40'])[0]
+            if sort not in profiling.SORT_KEYS or not limit.isdigit():
+                self.send_json(400, {"error": f"sort must be one of {', '.join(profiling.SORT_KEYS)}, limit a count"})
+            else:
+                self.send_text(200, PROFILER.pstats(sort, int(limit)))
+        elif path == '/admin/trace':
+            try:
+                count = int(query.get('batches', ['20'])[0])
+            except ValueError:
+                self.send_json(400, {"error": "batches must be an integer"})
+                return
+            self.send_json(200, TRACE.last(max(1, count)))
+        else:
+            self.send_json(404, {"error": "unknown admin endpoint"})
+
+    def stream_ticks(self, symbols):
+        """Server-Sent Events: one "tick" event per new price, until the client leaves."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        seq = None
+        try:
+            while True:
+                seq, ticks = LATEST.wait(seq, SSE_HEARTBEAT)
+                lines = [
+                    f"id: {seq}\nevent: tick\ndata: {json.dumps(tick)}\n\n"
+                    for tick in ticks if symbols is None or tick["symbol"] in symbols
+                ]
+                self.wfile.write(("".join(lines) or ": keepalive\n\n").encode())
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, status, text):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def log_message(self, format, *args):
         return
 
-def get_db_connection():
-    return sqlite3.connect(DB_PATH)
+def get_db_connection(**kwargs):
+    return db.connect(DB_PATH, **kwargs)
 
 def init_db():
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS crypto_prices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            symbol TEXT,
-            price REAL,
-            timestamp TEXT,
-            source TEXT
-        );
-    """)
-    conn.commit()
+    version = db.migrate(conn)
+    if not db.ensure_unique_index(conn):
+        print("Duplicate price points found; skipping them on insert until 'python main.py compact' is run")
     conn.close()
-    print("Database initialized (SQLite)")
+    print(f"Database initialized (SQLite, schema v{version}, WAL)")
+
+class Ack:
+    """Completion handle for rows pushed over HTTP, resolved by the writer thread."""
+
+    def __init__(self, expected):
+        self.pending = expected
+        self.error = None
+        self.event = threading.Event()
+
+    def committed(self, count):
+        self.pending -= count
+        if self.pending <= 0:
+            self.event.set()
+
+    def failed(self, error):
+        self.error = error
+        self.event.set()
+
+    def wait(self, timeout):
+        return self.event.wait(timeout) and self.error is None
+
+class FileDone:
+    """Queued after the last row of a claimed file.
+
+    With ok=True the file is recorded in the ingest ledger and deleted once
+    that row commits; with ok=False it was quarantined and is only forgotten.
+    read_time and parse_time are the parser's seconds, for the batch trace.
+    """
+
+    def __init__(self, filepath, key=None, records=0, ok=True, read_time=0.0, parse_time=0.0):
+        self.filepath = filepath
+        self.key = key
+        self.records = records
+        self.ok = ok
+        self.read_time = read_time
+        self.parse_time = parse_time
+
+class BatchWriter:
+    """Groups records into executemany transactions on one long-lived connection.
+
+    Source files are only removed after the transaction holding their last row
+    (and their ingest ledger entry) has committed, so a crash never loses data
+    that was already dropped on disk. A large file may span several batches;
+    if any of them fails the file is kept for a retry (upserts make the replay
+    harmless). Pushed rows carry an Ack instead, resolved once their batch
+    commits.
+
+    A batch that fails on its data (POISON_ERRORS) is split by source file or
+    push and each part committed on its own: the parts that still fail are
+    quarantined (files) or rejected (pushes), and the rest commit as usual.
+
+    With a ShardSet, rows are committed to their symbols' shards first and the
+    ledger entries to conn afterwards; a crash in between only means the
+    files are replayed.
+    """
+
+    def __init__(self, conn, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, on_flush=None, shards=None):
+        self.conn = conn
+        self.shards = shards
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self.insert_sql = db.insert_sql(conn)
+        self.rows = []
+        self.sources = []
+        self.files = {}
+        self.touched = set()
+        self.tainted = set()
+        self.poisoned = {}
+        self.acks = {}
+        self.first_pending = None
+        self.listed = LIST_TIME.value
+
+    def add(self, row, filepath=None, ack=None):
+        if filepath in self.poisoned:
+            # The file will be quarantined once the parser is done with it
+            return
+        if not self.rows:
+            self.first_pending = time.monotonic()
+        self.rows.append(row)
+        self.sources.append(filepath or ack)
+        if filepath:
+            self.touched.add(filepath)
+        if ack:
+            self.acks[ack] = self.acks.get(ack, 0) + 1
+        if len(self.rows) >= self.batch_size or self.due():
+            self.flush()
+
+    def finish_file(self, done):
+        if not done.ok:
+            self.tainted.discard(done.filepath)
+            self.poisoned.pop(done.filepath, None)
+            return
+        if done.filepath in self.poisoned:
+            self._quarantine(done, self.poisoned.pop(done.filepath))
+            return
+        if done.filepath in self.tainted:
+            self.tainted.discard(done.filepath)
+            if self.on_flush:
+                self.on_flush({done.filepath}, False)
+            return
+        self.files[done.filepath] = done
+        if not self.rows or self.due():
+            # Everything it contained has already committed, or the batch is due
+            self.flush()
+
+    def due(self):
+        return bool(self.rows) and time.monotonic() - self.first_pending >= self.flush_interval
+
+    def flush(self):
+        if not self.rows and not self.files:
+            return 0
+        rows, sources, files, touched, acks = self.rows, self.sources, self.files, self.touched, self.acks
+        self.rows, self.sources, self.files, self.touched, self.acks = [], [], {}, set(), {}
+        self.first_pending = None
+        now_ms = int(time.time() * 1000)
+        try:
+            started, locked, inserted, committed = self._commit(rows, files, now_ms)
+        except Exception as e:
+            # sqlite3.Error, or anything a row slipping past check_row raises
+            # in executemany
+            print(f"Batch commit failed ({len(rows)} records): {e}")
+            BATCHES_FAILED.inc()
+            if isinstance(e, POISON_ERRORS):
+                return self._isolate(rows, sources, files, now_ms)
+            self._failed(touched, files, acks, e)
+            return 0
+        LOCK_WAIT.observe(locked - started)
+        COMMIT_DURATION.observe(committed - locked)
+
+        self._committed(rows, files, acks, now_ms)
+        listed, self.listed = self.listed, LIST_TIME.value
+        TRACE.record({
+            "committed_at": now_ms,
+            "records": len(rows),
+            "files": len(files),
+            # Discovery and parser seconds since the previous batch; parsers
+            # run in parallel, so read + parse can exceed the batch's wall time
+            "list": round(self.listed - listed, 6),
+            "read": round(sum(done.read_time for done in files.values()), 6),
+            "parse": round(sum(done.parse_time for done in files.values()), 6),
+            "lock_wait": round(locked - started, 6),
+            "insert": round(inserted - locked, 6),
+            "commit": round(committed - inserted, 6),
+            "unlink": round(time.perf_counter() - committed, 6),
+        })
+        if rows:
+            BATCH_SIZE_HIST.observe(len(rows))
+            print(f"Committed batch of {len(rows)} records")
+        return len(rows)
+
+    def _commit(self, rows, files, now_ms):
+        """One transaction for rows plus the ledger entries of files; returns its timestamps."""
+        ledger = [done.key + (done.records, now_ms) for done in files.values()]
+        raw_since = raw_horizon()
+        started = time.perf_counter()
+        if self.shards is not None:
+            # The shards commit in parallel: "insert" includes their commits
+            lock_wait = self.shards.write(rows, raw_since) if rows else 0.0
+            locked = started + lock_wait
+            inserted = time.perf_counter()
+            with self.conn:
+                self.conn.executemany(db.LEDGER_INSERT_SQL, ledger)
+        else:
+            self.conn.execute("BEGIN IMMEDIATE")
+            locked = time.perf_counter()
+            with self.conn:
+                if rows:
+                    self.conn.executemany(self.insert_sql, rows)
+                    rollups.update_rollups(self.conn, [(row[0], row[2]) for row in rows], raw_since)
+                self.conn.executemany(db.LEDGER_INSERT_SQL, ledger)
+                inserted = time.perf_counter()
+        return started, locked, inserted, time.perf_counter()
+
+    def _committed(self, rows, files, acks, now_ms):
+        for filepath in files:
+            try:
+                os.remove(filepath)
+            except FileNotFoundError:
+                pass
+        for ack, count in acks.items():
+            ack.committed(count)
+        if rows:
+            LATEST.update(rows)
+            WATERMARKS.update(rows, now_ms)
+            RECORDS_INGESTED.inc(len(rows))
+        if self.on_flush:
+            self.on_flush(set(files), True)
+        FILES_INGESTED.inc(len(files))
+
+    def _failed(self, touched, files, acks, error):
+        # Files stay in PROCESSING_DIR and are retried after RETRY_DELAY
+        self.tainted |= touched - files.keys()
+        for ack in acks:
+            ack.failed(f"commit failed: {error}")
+        if self.on_flush:
+            self.on_flush(set(files), False)
+
+    def _isolate(self, rows, sources, files, now_ms):
+        """Commit each file's and push's rows of a failed batch on their own."""
+        parts = {filepath: [] for filepath in files}
+        for row, source in zip(rows, sources):
+            parts.setdefault(source, []).append(row)
+        total = 0
+        for source, part in parts.items():
+            done = files.get(source)
+            ack = source if isinstance(source, Ack) else None
+            part_files = {source: done} if done else {}
+            try:
+                self._commit(part, part_files, now_ms)
+            except POISON_ERRORS as e:
+                if ack is not None:
+                    ack.failed(f"rejected: {e}")
+                elif done is not None:
+                    self._quarantine(done, e)
+                elif source is not None:
+                    # Its FileDone has not arrived yet
+                    self.poisoned[source] = e
+                continue
+            except Exception as e:
+                print(f"Commit of {len(part)} records from {source} failed: {e}")
+                self._failed(set() if ack else {source}, part_files, {ack: 0} if ack else {}, e)
+                continue
+            self._committed(part, part_files, {ack: len(part)} if ack else {}, now_ms)
+            total += len(part)
+        if total:
+            print(f"Committed {total} records of the failed batch in isolation")
+        return total
+
+    def _quarantine(self, done, error):
+        try:
+            quarantine(done.filepath, done.key, error, done.records)
+        except OSError as e:
+            print(f"Could not quarantine {done.filepath}: {e}")
+        if self.on_flush:
+            self.on_flush({done.filepath}, None)
+
+def raw_horizon():
+    """Epoch ms before which raw rows may have been pruned or archived; None if none are."""
+    cutoffs = [days for days in (RAW_RETENTION_DAYS, ARCHIVE_AFTER_DAYS) if days > 0]
+    if not cutoffs:
+        return None
+    return int((time.time() - min(cutoffs) * 86400) * 1000)
+
+def parse_record(data):
+    """Turn a collector record ({symbol, price, timestamp, source}) into an insert row."""
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+    price = data['price']
+    if isinstance(price, bool) or not isinstance(price, (int, float, str)):
+        raise ValueError(f"price must be a number, got {type(price).__name__}")
+    try:
+        timestamp = db.parse_timestamp(data['timestamp'])
+    except (ValueError, OverflowError):
+        timestamp = None
+    if timestamp is None:
+        raise ValueError(f"unparseable timestamp {data['timestamp']!r}")
+    return check_row((data['symbol'], float(price), timestamp, data['source']))
+
+def check_row(row):
+    """Return row if SQLite can store it (see MIN_TIMESTAMP), else raise ValueError."""
+    symbol, price, timestamp, source = row
+    if not isinstance(symbol, str) or not symbol:
+        raise ValueError(f"symbol must be a non-empty string, got {symbol!r}")
+    if not isinstance(source, str) or not source:
+        raise ValueError(f"source must be a non-empty string, got {source!r}")
+    if not math.isfinite(price):
+        raise ValueError(f"price must be finite, got {price!r}")
+    if not MIN_TIMESTAMP <= timestamp <= MAX_TIMESTAMP:
+        raise ValueError(f"timestamp {timestamp} out of range")
+    return row
+
+def iter_json_values(f, chunk_size=STREAM_CHUNK_SIZE, max_value_size=MAX_RECORD_BYTES):
+    """Yield JSON values from a text stream holding a single value, a JSON
+    array of values, or NDJSON, reading chunk_size characters at a time.
+
+    Only the current chunk and one partially read value are held in memory,
+    so a file with thousands of records is decoded in constant space.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    while True:
+        # Skip whitespace and the array punctuation between values
+        while pos < len(buf) and buf[pos] in " \t\r\n,[]":
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                return
+            buf, pos = f.read(chunk_size), 0
+            eof = not buf
+            continue
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                raise
+            if len(buf) - pos > max_value_size:
+                raise ValueError(f"record larger than {max_value_size} bytes")
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        if end == len(buf) and not eof:
+            # A number at the end of the buffer may continue in the next chunk
+            chunk = f.read(chunk_size)
+            if chunk:
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            eof = True
+        yield value
+        pos = end
+
+class BodyTooLarge(ValueError):
+    pass
+
+class LengthBody(io.RawIOBase):
+    """The length bytes of a request body from rfile; ValueError if it ends early."""
+
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.left = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.left:
+            return 0
+        data = self.rfile.read(min(len(buffer), self.left))
+        if not data:
+            raise ValueError(f"body ended {self.left} bytes short of its Content-Length")
+        buffer[:len(data)] = data
+        self.left -= len(data)
+        return len(data)
+
+class ChunkedBody(io.RawIOBase):
+    """Decodes a Transfer-Encoding: chunked request body from rfile.
+
+    Raises BodyTooLarge once the chunks add up to more than limit bytes and
+    ValueError on a malformed or truncated body.
+    """
+
+    def __init__(self, rfile, limit):
+        self.rfile = rfile
+        self.limit = limit
+        self.total = 0
+        self.left = 0
+        self.after_chunk = False
+        self.done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.done:
+            return 0
+        if not self.left:
+            if self.after_chunk and self.rfile.readline(3) != b"\r\n":
+                raise ValueError("malformed chunked body: missing CRLF after a chunk")
+            line = self.rfile.readline(1024)
+            try:
+                size = int(line.split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise ValueError(f"malformed chunk size {line[:40]!r}")
+            if size < 0:
+                raise ValueError(f"malformed chunk size {line[:40]!r}")
+            if size == 0:
+                # Skip any trailer fields up to the blank line
+                while self.rfile.readline(1024) not in (b"\r\n", b"\n", b""):
+                    pass
+                self.done = True
+                return 0
+            self.total += size
+            if self.total > self.limit:
+                raise BodyTooLarge(f"body larger than {self.limit} bytes")
+            self.left = size
+        data = self.rfile.read(min(len(buffer), self.left))
+        if not data:
+            raise ValueError("truncated chunked body")
+        buffer[:len(data)] = data
+        self.left -= len(data)
+        self.after_chunk = not self.left
+        return len(data)
 
 def process_file(filepath):
-    print(f"Processing {filepath}...")
+    """Stream the insert rows out of one collector file, JSON or segment."""
+    with open(filepath, 'rb') as f:
+        if f.read(len(segment.MAGIC)) == segment.MAGIC:
+            for row in segment.read_segment(f):
+                yield check_row(row)
+            return
+        f.seek(0)
+        for data in iter_json_values(io.TextIOWrapper(f, encoding='utf-8')):
+            yield parse_record(data)
+
+def quarantine(filepath, key, error, records):
+    """Move a file that cannot be parsed aside, with the error next to it."""
+    os.makedirs(QUARANTINE_DIR, exist_ok=True)
+    name = f"{int(time.time())}-{os.path.basename(filepath)}"
+    dest = os.path.join(QUARANTINE_DIR, name)
+    os.rename(filepath, dest)
+    with open(dest + ".error.json", "w") as f:
+        json.dump({
+            "file": key[0],
+            "size": key[1],
+            "mtime_ns": key[2],
+            "error": f"{type(error).__name__}: {error}",
+            "records_before_error": records,
+            "quarantined_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }, f, indent=2)
+    FILES_QUARANTINED.inc()
+    print(f"Quarantined {filepath} as {dest}")
+
+def scan_dir(path):
     try:
-        with open(filepath, 'r') as f:
-            content = f.read()
-            data = json.loads(content)
-        
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO crypto_prices (symbol, price, timestamp, source) VALUES (?, ?, ?, ?)",
-            (data['symbol'], data['price'], data['timestamp'], data['source'])
+        with os.scandir(path) as entries:
+            return [entry.path for entry in entries if entry.name.endswith(DROP_SUFFIXES) and entry.is_file()]
+    except FileNotFoundError:
+        return []
+
+def timed_scan(path):
+    # Discovery's share of the "list" stage in /admin/trace
+    started = time.perf_counter()
+    try:
+        return scan_dir(path)
+    finally:
+        LIST_TIME.inc(time.perf_counter() - started)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+class InotifyWatcher:
+    """Reports files as soon as a writer closes them or renames them into DATA_DIR.
+
+    The directory is scanned once at startup (and again after a queue
+    overflow); in steady state only the kernel events are read.
+    """
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.path = path
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {path}")
+        self.needs_rescan = True
+
+    def rescan(self):
+        self.needs_rescan = True
+
+    def wait(self, timeout=None):
+        if self.needs_rescan:
+            self.needs_rescan = False
+            return timed_scan(self.path)
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        started = time.perf_counter()
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        offset = 0
+        while offset < len(buf):
+            _, mask, _, name_len = INOTIFY_EVENT.unpack_from(buf, offset)
+            offset += INOTIFY_EVENT.size
+            name = buf[offset:offset + name_len].rstrip(b"\0").decode()
+            offset += name_len
+            if mask & IN_Q_OVERFLOW:
+                print("inotify queue overflow, rescanning directory")
+                self.needs_rescan = False
+                return timed_scan(self.path)
+            if name.endswith(DROP_SUFFIXES):
+                paths.append(os.path.join(self.path, name))
+        LIST_TIME.inc(time.perf_counter() - started)
+        return paths
+
+class ScandirPoller:
+    """Fallback discovery that polls DATA_DIR, backing off while it stays empty."""
+
+    def __init__(self, path, min_interval=MIN_POLL_INTERVAL, max_interval=POLL_INTERVAL):
+        self.path = path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.known = set()
+
+    def rescan(self):
+        self.known = set()
+
+    def wait(self, timeout=None):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        current = timed_scan(self.path)
+        new = [p for p in current if p not in self.known]
+        self.known = set(current)
+        if new:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        return new
+
+def create_watcher(path, mode=WATCH_MODE):
+    if mode in ("auto", "inotify"):
+        try:
+            watcher = InotifyWatcher(path)
+            print(f"Watching {path} with inotify")
+            return watcher
+        except (OSError, AttributeError) as e:
+            if mode == "inotify":
+                raise
+            print(f"inotify unavailable ({e}), falling back to polling")
+    print(f"Polling {path} every {MIN_POLL_INTERVAL}-{POLL_INTERVAL}s")
+    return ScandirPoller(path)
+
+class IngestPipeline:
+    """Discovery, parsing and writing as separate stages joined by bounded queues.
+
+    The discovery thread owns the watcher, the parser threads claim and decode
+    files (reading the ingest ledger only), and the writer thread is the only
+    one writing to SQLite, so commits never contend for the write lock.
+    """
+
+    def __init__(self, watcher, conn, workers=PARSE_WORKERS, queue_size=QUEUE_SIZE, shards=None):
+        self.watcher = watcher
+        self.shards = shards
+        self.writer = BatchWriter(conn, on_flush=self._flushed, shards=shards)
+        self.workers = max(1, workers)
+        self.paths = queue.Queue(maxsize=queue_size)
+        self.records = queue.Queue(maxsize=queue_size)
+        self.retries = queue.SimpleQueue()
+        self.in_flight = set()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stopping = threading.Event()
+        self.next_retention_check = 0
+        # Symbol purges, run by the writer thread one chunk at a time
+        self.purges = {}
+        self.purging = False
+        self.next_purge = 0
+        # Backlog catch-up: the discovery thread decides, the writer switches
+        self.catchup = None
+        self.next_backlog_check = 0
+        self.bulk = False
+        self.indexes_deferred = any(
+            db.DEFERRABLE_INDEXES.keys() - db.index_names(c) for c in data_connections(conn, shards)
         )
-        conn.commit()
-        conn.close()
-        print(f"Ingested data for {data['symbol']}")
-        
+        self.next_mode_change = 0
+        self.next_watermarks_write = 0
+
+    def start(self):
+        self.discovery_thread = threading.Thread(target=self.ingestion_loop, name="discovery", daemon=True)
+        self.parser_threads = [
+            threading.Thread(target=self._parse, name=f"parser-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        self.writer_thread = threading.Thread(target=self._write, name="writer", daemon=True)
+        for thread in [self.discovery_thread, self.writer_thread] + self.parser_threads:
+            thread.start()
+        if SNAPSHOT_INTERVAL > 0:
+            threading.Thread(target=self._publish_snapshots, name="snapshot", daemon=True).start()
+        PARSE_QUEUE_DEPTH.function = self.paths.qsize
+        CATCHING_UP.function = lambda: int(self.bulk)
+        WRITE_QUEUE_DEPTH.function = self.records.qsize
+        print(f"Pipeline started: {self.workers} parser(s), batches of up to {self.writer.batch_size}")
+
+    def stop(self, timeout=30):
+        """Stop discovering new files and drain everything already queued."""
+        print("Draining ingestion pipeline...")
+        self.stopping.set()
+        self.discovery_thread.join(timeout)
+        for _ in self.parser_threads:
+            self.paths.put(None)
+        for thread in self.parser_threads:
+            thread.join(timeout)
+        self.records.put(None)
+        self.writer_thread.join(timeout)
+        print("Ingestion pipeline drained")
+
+    def submit(self, rows, timeout=None):
+        """Queue pushed rows for the writer; the returned Ack resolves on commit."""
+        ack = Ack(len(rows))
+        try:
+            for row in rows:
+                # Blocks while the writer is behind (backpressure)
+                self.records.put((row, None, ack), timeout=timeout)
+        except queue.Full:
+            ack.failed("ingest queue full")
+        return ack
+
+    def purge(self, symbol):
+        """Queue removal of every row of symbol (no-op while one is in progress)."""
+        with self.lock:
+            job = self.purges.get(symbol)
+            if job is None or job["state"] in ("done", "failed"):
+                job = self.purges[symbol] = {
+                    "symbol": symbol, "state": "queued", "total": None, "deleted": 0,
+                    "rollups_deleted": 0, "progress": 0.0, "error": None,
+                    "queued_at": int(time.time() * 1000), "finished_at": None,
+                }
+            self.purging = True
+            return dict(job)
+
+    def purge_jobs(self):
+        with self.lock:
+            return {symbol: dict(job) for symbol, job in self.purges.items()}
+
+    def health(self):
+        with self.lock:
+            catchup = dict(self.catchup) if self.catchup else None
+            in_flight = len(self.in_flight)
+        files, oldest = BACKLOG.get()
+        # Epoch ms of each symbol's newest committed tick, for `ops-cli status`
+        last_seen = {symbol: tick["timestamp"] for symbol, tick in LATEST.get().items()}
+        if catchup is None:
+            return {
+                "status": "rebuilding indexes" if self.indexes_deferred else "ok",
+                "backlog_files": files,
+                "backlog_oldest_file_age_seconds": round(oldest, 1),
+                "last_seen": last_seen,
+            }
+        # The directory is only rescanned every CATCHUP_CHECK_INTERVAL; in
+        # between, count down by the files committed since that scan. Files
+        # queued or being parsed are still waiting, whatever the scan said.
+        ingested = FILES_INGESTED.value
+        backlog = max(in_flight, catchup["backlog"] - (ingested - catchup["files_at_check"]))
+        elapsed = time.monotonic() - catchup["started"]
+        rate = (ingested - catchup["files_at_start"]) / elapsed if elapsed > 0 else 0
+        return {
+            "status": "catching up",
+            "since": catchup["since"],
+            "backlog_files": backlog,
+            "backlog_at_start": catchup["backlog_at_start"],
+            "backlog_checked_at": catchup["checked_at"],
+            "progress": round(max(0.0, 1 - backlog / catchup["backlog_at_start"]), 4),
+            "files_per_sec": round(rate, 1),
+            "eta_seconds": round(backlog / rate) if rate else None,
+            "backlog_oldest_file_age_seconds": round(oldest, 1),
+            "last_seen": last_seen,
+        }
+
+    def _check_backlog(self):
+        # Discovery thread; the stat() per waiting file is kept off the writer
+        if not CATCHUP_BACKLOG or time.monotonic() < self.next_backlog_check:
+            return
+        self.next_backlog_check = time.monotonic() + CATCHUP_CHECK_INTERVAL
+        files = BACKLOG.get(max_age=0)[0]
+        checked = {"backlog": files, "files_at_check": FILES_INGESTED.value, "checked_at": int(time.time() * 1000)}
+        with self.lock:
+            if self.catchup is None and files > CATCHUP_BACKLOG:
+                print(f"{files} files waiting, switching to catch-up mode")
+                self.catchup = {
+                    "since": checked["checked_at"], "started": time.monotonic(),
+                    "backlog_at_start": files, "files_at_start": FILES_INGESTED.value, **checked,
+                }
+            elif self.catchup is not None:
+                self.catchup.update(checked)
+                if files < CATCHUP_BACKLOG // 10:
+                    self.catchup = None
+
+    def ingestion_loop(self):
+        # Files left in PROCESSING_DIR were claimed by a previous run that
+        # stopped before deleting them; the ledger tells whether they committed
+        for filepath in scan_dir(PROCESSING_DIR):
+            self.paths.put(filepath)
+
+        waiting = []
+        while not self.stopping.is_set():
+            try:
+                while True:
+                    try:
+                        waiting.append(self.retries.get_nowait())
+                    except queue.Empty:
+                        break
+                now = time.monotonic()
+                due = [filepath for retry_at, filepath in waiting if retry_at <= now]
+                waiting = [(retry_at, filepath) for retry_at, filepath in waiting if retry_at > now]
+
+                self._check_backlog()
+                for filepath in due + self.watcher.wait(0.5):
+                    # Also checked here: the startup scan of a large backlog
+                    # keeps this loop busy until it has all been handed over
+                    self._check_backlog()
+                    with self.lock:
+                        if filepath in self.in_flight:
+                            continue
+                        self.in_flight.add(filepath)
+                    # Blocks while the parsers are behind (backpressure)
+                    self.paths.put(filepath)
+
+            except Exception as e:
+                print(f"Loop error: {e}")
+                time.sleep(1)
+
+    def _parse(self):
+        while True:
+            filepath = self.paths.get()
+            if filepath is None:
+                return
+            started = time.perf_counter()
+            claimed = None
+            try:
+                claimed = self._claim(filepath)
+                if claimed:
+                    self._ingest_claimed(claimed, started)
+            except Exception as e:
+                # E.g. an OSError from stat() or quarantine(): keep the
+                # thread, and give the file another go after RETRY_DELAY
+                # instead of leaving it claimed until the next restart
+                PARSER_ERRORS.inc()
+                print(f"Parser error on {filepath}: {type(e).__name__}: {e}")
+                if claimed:
+                    self.records.put(FileDone(claimed, ok=False))
+                self._release([claimed or filepath])
+                self._retry([claimed or filepath])
+
+    def _claim(self, filepath):
+        """Atomically move a discovered file into PROCESSING_DIR.
+
+        Returns the claimed path, or None if the file is gone or has to wait
+        for an earlier file of the same name to finish.
+        """
+        if os.path.dirname(filepath) == PROCESSING_DIR:
+            return filepath
+        claimed = os.path.join(PROCESSING_DIR, os.path.basename(filepath))
+        try:
+            if os.path.exists(claimed):
+                self._retry([filepath])
+                return None
+            os.rename(filepath, claimed)
+        except FileNotFoundError:
+            # Already claimed; reported by both the startup scan and an event
+            return None
+        finally:
+            self._release([filepath])
+        return claimed
 
-        os.remove(filepath)
-        
-    except Exception as e:
-        print(f"Error processing {filepath}: {e}")
+    def _ingest_claimed(self, filepath, started):
+        # "read" in the batch trace: claim, stat and ledger lookup; the file
+        # itself is read while it is decoded, so that time counts as "parse"
+        try:
+            st = os.stat(filepath)
+        except FileNotFoundError:
+            self._release([filepath])
+            return
+        key = (os.path.basename(filepath), st.st_size, st.st_mtime_ns)
+        try:
+            replayed = db.in_ledger(self._read_conn(), key)
+        except sqlite3.Error as e:
+            print(f"Ledger lookup failed for {filepath}: {e}")
+            replayed = False
+        if replayed:
+            print(f"Skipping {filepath}: already committed")
+            FILES_REPLAYED.inc()
+            os.remove(filepath)
+            self._release([filepath])
+            return
+
+        read_time = time.perf_counter() - started
+        parse_time = 0.0
+        for attempt in (1, 2):
+            records = 0
+            try:
+                rows = process_file(filepath)
+                while True:
+                    started = time.perf_counter()
+                    row = next(rows, None)
+                    parse_time += time.perf_counter() - started
+                    if row is None:
+                        break
+                    records += 1
+                    # Blocks while the writer is behind (backpressure)
+                    self.records.put((row, filepath, None))
+            except Exception as e:
+                print(f"Error processing {filepath}: {e}")
+                FILES_FAILED.inc()
+                age = time.time() - st.st_mtime
+                if attempt == 1 and age < QUARANTINE_GRACE:
+                    time.sleep(QUARANTINE_GRACE - age)
+                    st = os.stat(filepath)
+                    key = (key[0], st.st_size, st.st_mtime_ns)
+                    continue
+                quarantine(filepath, key, e, records)
+                self.records.put(FileDone(filepath, ok=False))
+                self._release([filepath])
+                return
+            break
+        PARSE_DURATION.observe(parse_time)
+        self.records.put(FileDone(filepath, key, records, read_time=read_time, parse_time=parse_time))
+
+    def _read_conn(self):
+        # One read-only connection per parser thread for ledger lookups
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = get_db_connection()
+        return conn
+
+    def _write(self):
+        while True:
+            try:
+                if not self._write_step():
+                    return
+            except Exception as e:
+                # Never let one bad item stop the only writer: /health would
+                # keep answering while the queues fill up
+                WRITER_ERRORS.inc()
+                print(f"Writer error: {type(e).__name__}: {e}")
+                time.sleep(1)
+
+    def _write_step(self):
+        """Handle one queued item (or an idle tick); False once told to stop."""
+        writer = self.writer
+        if (self.catchup is not None) != self.bulk or (self.indexes_deferred and self.catchup is None):
+            self._switch_mode()
+        try:
+            idle = PURGE_INTERVAL if self.purging else 0.5
+            item = self.records.get(timeout=BATCH_LINGER if writer.rows else idle)
+        except queue.Empty:
+            writer.flush()
+            if self.purging:
+                self._purge_step()
+            self._enforce_retention()
+            self._write_watermarks()
+            return True
+        if item is None:
+            writer.flush()
+            writer.conn.close()
+            if self.shards is not None:
+                self.shards.close()
+            return False
+        if isinstance(item, FileDone):
+            writer.finish_file(item)
+        else:
+            row, filepath, ack = item
+            writer.add(row, filepath, ack)
+        if self.purging:
+            self._purge_step()
+        return True
+
+    def _publish_snapshots(self):
+        # Own thread with its own read-only connections; ingestion carries on
+        shard_dir = SHARD_DIR if self.shards is not None else None
+        tracker = snapshot.ChangeTracker()
+        while not self.stopping.wait(SNAPSHOT_INTERVAL):
+            try:
+                files, pages, seconds = snapshot.publish_all(
+                    DB_PATH, shard_dir, SNAPSHOT_DIR, SNAPSHOT_PAGES, tracker=tracker
+                )
+            except Exception as e:
+                SNAPSHOTS_FAILED.inc()
+                print(f"Snapshot to {SNAPSHOT_DIR} failed: {e}")
+                continue
+            published = time.monotonic()
+            SNAPSHOT_AGE.function = lambda: time.monotonic() - published
+            if files:
+                SNAPSHOT_DURATION.observe(seconds)
+                print(f"Published {files} snapshot(s), {pages} pages, to {SNAPSHOT_DIR} in {seconds:.2f}s")
+        tracker.close()
+
+    def _switch_mode(self):
+        # Writer thread: enter or leave catch-up mode between batches
+        if time.monotonic() < self.next_mode_change:
+            return
+        writer = self.writer
+        writer.flush()
+        conns = data_connections(writer.conn, self.shards)
+        try:
+            if self.catchup is not None:
+                for conn in conns:
+                    conn.execute("PRAGMA synchronous = OFF")
+                    self.indexes_deferred = db.drop_deferrable_indexes(conn) or self.indexes_deferred
+                writer.batch_size, writer.flush_interval = CATCHUP_BATCH_SIZE, CATCHUP_FLUSH_INTERVAL
+                self.bulk = True
+                print(f"Catch-up mode: batches of up to {CATCHUP_BATCH_SIZE}, synchronous=OFF, deferred indexes dropped")
+                return
+            started = time.monotonic()
+            built = 0
+            for conn in conns:
+                built += db.create_deferrable_indexes(conn)
+                conn.execute("PRAGMA synchronous = NORMAL")
+            writer.batch_size, writer.flush_interval = BATCH_SIZE, FLUSH_INTERVAL
+            self.bulk = False
+            self.indexes_deferred = False
+            print(f"Caught up: rebuilt {built} index(es) in {time.monotonic() - started:.1f}s, back to normal batching")
+        except sqlite3.Error as e:
+            print(f"Switching catch-up mode failed: {e}")
+            self.next_mode_change = time.monotonic() + RETRY_DELAY
+
+    def _enforce_retention(self):
+        # Runs on the writer thread between batches, one chunk per idle tick
+        if time.monotonic() < self.next_retention_check:
+            return
+        now = time.time()
+        deleted = 0
+        try:
+            for conn in data_connections(self.writer.conn, self.shards):
+                if ARCHIVE_AFTER_DAYS > 0:
+                    moved = archive.archive_next_day(
+                        conn, ARCHIVE_DIR, int((now - ARCHIVE_AFTER_DAYS * 86400) * 1000), ARCHIVE_FORMAT
+                    )
+                    if moved:
+                        print(f"Archived {moved} raw rows to {ARCHIVE_DIR}")
+                    deleted += moved
+                if RAW_RETENTION_DAYS > 0:
+                    pruned = rollups.prune_raw(conn, int((now - RAW_RETENTION_DAYS * 86400) * 1000))
+                    if pruned:
+                        print(f"Pruned {pruned} raw rows older than {RAW_RETENTION_DAYS} days")
+                    deleted += pruned
+            deleted += db.prune_ledger(self.writer.conn, int((now - LEDGER_RETENTION_DAYS * 86400) * 1000))
+        except (sqlite3.Error, OSError, ValueError) as e:
+            print(f"Retention pruning failed: {e}")
+            deleted = 0
+        if not deleted:
+            self.next_retention_check = time.monotonic() + RETENTION_CHECK_INTERVAL
+
+    def _purge_step(self):
+        # Writer thread only: one chunk per PURGE_INTERVAL, between batches
+        if time.monotonic() < self.next_purge:
+            return
+        self.next_purge = time.monotonic() + PURGE_INTERVAL
+        with self.lock:
+            job = next((j for j in self.purges.values() if j["state"] in ("queued", "running")), None)
+            if job is None:
+                self.purging = False
+                return
+        symbol = job["symbol"]
+        conn = self.writer.conn
+        try:
+            if job["state"] == "queued":
+                total = conn.execute("SELECT count(*) FROM crypto_prices WHERE symbol = ?", (symbol,)).fetchone()[0]
+                if self.shards is not None:
+                    total += self.shards.count(symbol)[0]
+                with self.lock:
+                    job.update(state="running", total=total)
+                print(f"Purging {symbol}: {total} raw rows")
+            raw, rollup_rows = db.purge_symbol(conn, symbol, PURGE_CHUNK_SIZE)
+            ROWS_PURGED.inc(raw + rollup_rows)
+            with self.lock:
+                job["deleted"] += raw
+                job["rollups_deleted"] += rollup_rows
+                job["progress"] = round(min(1.0, job["deleted"] / job["total"]), 4) if job["total"] else 1.0
+            if raw or rollup_rows:
+                return
+            if self.shards is not None:
+                # Rows written before the switch are gone; the rest is one file
+                raw, rollup_rows = self.shards.count(symbol)
+                self.shards.remove(symbol)
+                ROWS_PURGED.inc(raw + rollup_rows)
+                with self.lock:
+                    job["deleted"] += raw
+                    job["rollups_deleted"] += rollup_rows
+            LATEST.forget(symbol)
+            WATERMARKS.forget(symbol)
+            shutil.rmtree(archive.symbol_dir(ARCHIVE_DIR, symbol), ignore_errors=True)
+            with self.lock:
+                job.update(state="done", progress=1.0, finished_at=int(time.time() * 1000))
+            print(f"Purged {symbol}: {job['deleted']} raw rows, {job['rollups_deleted']} rollup rows")
+        except (sqlite3.Error, OSError) as e:
+            print(f"Purge of {symbol} failed: {e}")
+            with self.lock:
+                job.update(state="failed", error=str(e), finished_at=int(time.time() * 1000))
+
+    def _write_watermarks(self):
+        # Writer thread, after commits and when idle
+        if time.monotonic() < self.next_watermarks_write:
+            return
+        self.next_watermarks_write = time.monotonic() + WATERMARKS_WRITE_INTERVAL
+        try:
+            WATERMARKS.write(WATERMARKS_PATH, int(time.time() * 1000))
+        except OSError as e:
+            print(f"Writing {WATERMARKS_PATH} failed: {e}")
+
+    def _flushed(self, files, committed):
+        # committed is None for files the writer quarantined
+        self._release(files)
+        if committed:
+            self._write_watermarks()
+        elif committed is not None:
+            self._retry(files)
+
+    def _retry(self, files):
+        retry_at = time.monotonic() + RETRY_DELAY
+        for filepath in files:
+            self.retries.put((retry_at, filepath))
+
+    def _release(self, files):
+        with self.lock:
+            self.in_flight.difference_update(files)
+
+def open_shards():
+    return shards.ShardSet(SHARD_DIR, SHARD_WRITERS) if STORAGE_LAYOUT == "sharded" else None
 
-def ingestion_loop():
+def data_connections(conn, shard_set):
+    """conn plus, in the sharded layout, every shard's connection."""
+    return [conn] + (shard_set.connections() if shard_set is not None else [])
+
+def start_ingestion():
     print("Starting Ingestion Loop...")
     
 
@@ -75,33 +1498,89 @@ def ingestion_loop():
         time.sleep(5)
 
     init_db()
-    
-    while True:
-        try:
-
-            files = glob.glob(os.path.join(DATA_DIR, "*.json"))
-            if files:
-                for filepath in files:
-                    process_file(filepath)
-            else:
-                pass
-                
-        except Exception as e:
-            print(f"Loop error: {e}")
-            
-        time.sleep(5)
+    conn = get_db_connection(check_same_thread=False)
+    shard_set = open_shards()
+    now_ms = int(time.time() * 1000)
+    for data_conn in data_connections(conn, shard_set):
+        LATEST.load(data_conn)
+        WATERMARKS.load(data_conn, now_ms)
+    WATERMARKS.restore(WATERMARKS_PATH)
+    os.makedirs(PROCESSING_DIR, exist_ok=True)
+    os.makedirs(QUARANTINE_DIR, exist_ok=True)
+    pipeline = IngestPipeline(create_watcher(DATA_DIR), conn, shards=shard_set)
+    pipeline.start()
+    return pipeline
 
 def main():
     print(f"Starting Crypto Ingestor (HTTP + Worker Mode) on port {PORT}...")
     
 
-    worker_thread = threading.Thread(target=ingestion_loop, daemon=True)
-    worker_thread.start()
+    # Listen before migrating: rebuilding a large table takes longer than the
+    # liveness probe allows, so /health answers "migrating" meanwhile
+    server = ThreadingHTTPServer(('0.0.0.0', PORT), HealthHandler)
+    server.daemon_threads = True
+    server.pipeline = None
+    failed = threading.Event()
 
+    def start():
+        try:
+            server.pipeline = start_ingestion()
+        except Exception as e:
+            print(f"Startup failed: {type(e).__name__}: {e}")
+            failed.set()
+            server.shutdown()
+
+    def handle_sigterm(signum, frame):
+        # serve_forever() runs on this thread, so shut it down from another one
+        print("SIGTERM received, shutting down...")
+        threading.Thread(target=server.shutdown, daemon=True).start()
 
-    server = HTTPServer(('0.0.0.0', PORT), HealthHandler)
-    print(f"Health check server listening on {PORT}")
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    print(f"Health check, /metrics and /ingest server listening on {PORT}")
+    threading.Thread(target=start, name="startup", daemon=True).start()
     server.serve_forever()
+    if failed.is_set():
+        sys.exit(1)
+    if server.pipeline is not None:
+        # A SIGTERM during the migrations leaves nothing to drain; the
+        # interrupted migration rolls back and reruns on the next start
+        server.pipeline.stop()
+
+def compact_command():
+    """Remove duplicate price points left from before upserts, then enforce uniqueness."""
+    init_db()
+    conn = get_db_connection()
+    print("Compacting duplicate price points...")
+    removed = db.compact_duplicates(conn, raw_since=raw_horizon())
+    print(f"Removed {removed} duplicate rows")
+    if db.ensure_unique_index(conn):
+        print("Unique (symbol, timestamp, source) index in place; restart the ingestor to switch to upserts")
+    else:
+        print("Duplicates were written during compaction, run compact again")
+    conn.close()
+
+def archive_command():
+    """Archive every closed day older than ARCHIVE_AFTER_DAYS (default 1) now."""
+    init_db()
+    conn = get_db_connection()
+    shard_set = open_shards()
+    cutoff = int((time.time() - (ARCHIVE_AFTER_DAYS or 1) * 86400) * 1000)
+    total = 0
+    for data_conn in data_connections(conn, shard_set):
+        while True:
+            moved = archive.archive_next_day(data_conn, ARCHIVE_DIR, cutoff, ARCHIVE_FORMAT)
+            if not moved:
+                break
+            total += moved
+    print(f"Archived {total} raw rows to {ARCHIVE_DIR} ({ARCHIVE_FORMAT})")
+    if shard_set is not None:
+        shard_set.close()
+    conn.close()
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == "compact":
+        compact_command()
+    elif len(sys.argv) > 1 and sys.argv[1] == "archive":
+        archive_command()
+    else:
+        main()
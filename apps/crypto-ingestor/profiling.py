@@ -0,0 +1,166 @@
+import io
+import os
+import re
+import sys
+import time
+import pstats
+import threading
+from collections import deque
+
+
+# On-demand visibility into where the ingestor spends its time, served on
+# /admin/profile and /admin/trace (see main.py). The sampling profiler has no
+# hooks in the code it watches: while it runs, a thread of its own reads
+# every selected thread's stack with sys._current_frames() once per interval,
+# and when it is stopped nothing runs at all.
+
+_NUMBERED = re.compile(r"[-_]\d+$")
+SORT_KEYS = tuple(sorted(pstats.Stats.sort_arg_dict_default))
+
+
+def _thread_group(name):
+    # parser-0 .. parser-N (and shard-writer_0 ..) fold into one flame graph root
+    return _NUMBERED.sub("", name)
+
+
+class _SampledStats:
+    """Just enough of a profiler for pstats.Stats to load."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class SamplingProfiler:
+    """Periodic stack sampling of the threads whose names start with one of prefixes."""
+
+    def __init__(self, prefixes):
+        self.prefixes = tuple(prefixes)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stacks = {}
+        self.ticks = 0
+        self.interval = 0.0
+        self.started_at = None
+        self.ended_at = None
+        self.seconds = 0
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds, interval=0.01):
+        """Sample for seconds, discarding the previous results; False if already running."""
+        with self.lock:
+            if self.running():
+                return False
+            self.stacks = {}
+            self.ticks = 0
+            self.interval = interval
+            self.seconds = seconds
+            self.started_at = time.time()
+            self.ended_at = None
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._sample, args=(seconds, interval), name="profiler", daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        self.stop_event.set()
+        thread = self.thread
+        if thread is not None:
+            thread.join()
+
+    def status(self):
+        with self.lock:
+            return {
+                "running": self.running(),
+                "threads": list(self.prefixes),
+                "seconds": self.seconds,
+                "interval": self.interval,
+                "started_at": int(self.started_at * 1000) if self.started_at else None,
+                "ended_at": int(self.ended_at * 1000) if self.ended_at else None,
+                "ticks": self.ticks,
+                "samples": sum(self.stacks.values()),
+            }
+
+    def _sample(self, seconds, interval):
+        deadline = time.monotonic() + seconds
+        own = threading.get_ident()
+        while not self.stop_event.wait(interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            with self.lock:
+                self.ticks += 1
+                for ident, frame in frames.items():
+                    name = names.get(ident)
+                    if ident == own or name is None or not name.startswith(self.prefixes):
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                        frame = frame.f_back
+                    key = (_thread_group(name), tuple(reversed(stack)))
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+        with self.lock:
+            self.ended_at = time.time()
+
+    def collapsed(self):
+        """Brendan Gregg's folded format, one "thread;outer;...;inner count" line per stack."""
+        with self.lock:
+            stacks = dict(self.stacks)
+        lines = []
+        for (group, stack), count in stacks.items():
+            frames = [group] + [f"{name} ({os.path.basename(filename)}:{line})" for filename, line, name in stack]
+            lines.append(f"{';'.join(frames)} {count}")
+        return "\n".join(sorted(lines)) + "\n" if lines else ""
+
+    def pstats(self, sort="cumulative", limit=40):
+        """pstats report of the samples; a "call" is one sample, times are sample estimates."""
+        with self.lock:
+            stacks = dict(self.stacks)
+            ticks, started, ended = self.ticks, self.started_at, self.ended_at or time.time()
+        if not stacks:
+            return "No samples\n"
+        # The real spacing of samples, which is at least the interval
+        per_sample = (ended - started) / ticks if ticks else self.interval
+
+        own, total, callers = {}, {}, {}
+        for (_, stack), count in stacks.items():
+            own[stack[-1]] = own.get(stack[-1], 0) + count
+            for func in set(stack):
+                total[func] = total.get(func, 0) + count
+            for caller, func in set(zip(stack, stack[1:])):
+                edges = callers.setdefault(func, {})
+                edges[caller] = edges.get(caller, 0) + count
+
+        stats = {}
+        for func, count in total.items():
+            stats[func] = (
+                count, count, own.get(func, 0) * per_sample, count * per_sample,
+                {caller: (n, n, 0.0, n * per_sample) for caller, n in callers.get(func, {}).items()},
+            )
+        out = io.StringIO()
+        report = pstats.Stats(_SampledStats(stats), stream=out)
+        report.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+class BatchTrace:
+    """The per-stage timings of the last maxlen committed batches."""
+
+    def __init__(self, maxlen):
+        self.batches = deque(maxlen=max(1, maxlen))
+        self.lock = threading.Lock()
+
+    def record(self, entry):
+        with self.lock:
+            self.batches.append(entry)
+
+    def last(self, count=None):
+        with self.lock:
+            batches = list(self.batches)
+        return batches[-count:] if count else batches
@@ -0,0 +1,153 @@
+# Incrementally maintained OHLC rollups of crypto_prices. Each interval is
+# rebuilt from the one below it (raw -> 1m -> 5m -> 1h -> 1d), and only for the
+# buckets a committed batch touched, so keeping them current costs a handful of
+# index range scans per batch. Rows carry price_sum next to count so averages
+# over any span stay exact.
+
+# (name, bucket width in ms, interval it is aggregated from; None means raw)
+INTERVALS = [
+    ("1m", 60 * 1000, None),
+    ("5m", 5 * 60 * 1000, "1m"),
+    ("1h", 60 * 60 * 1000, "5m"),
+    ("1d", 24 * 60 * 60 * 1000, "1h"),
+]
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS price_rollups (
+        symbol TEXT NOT NULL,
+        interval TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        open REAL NOT NULL,
+        high REAL NOT NULL,
+        low REAL NOT NULL,
+        close REAL NOT NULL,
+        price_sum REAL NOT NULL,
+        count INTEGER NOT NULL,
+        first_ts INTEGER NOT NULL,
+        last_ts INTEGER NOT NULL,
+        PRIMARY KEY (symbol, interval, bucket)
+    ) WITHOUT ROWID
+"""
+
+# open/close come from window functions over each bucket; they are constant
+# within a group, so selecting them next to the aggregates is well defined.
+FROM_RAW_SQL = """
+    INSERT OR REPLACE INTO price_rollups
+        (symbol, interval, bucket, open, high, low, close, price_sum, count, first_ts, last_ts)
+    SELECT :symbol, :interval, bucket, open, max(price), min(price), close,
+           sum(price), count(*), min(timestamp), max(timestamp)
+    FROM (
+        SELECT price, timestamp, (timestamp / :width) * :width AS bucket,
+               first_value(price) OVER win AS open,
+               last_value(price) OVER win AS close
+        FROM crypto_prices
+        WHERE symbol = :symbol AND timestamp >= :start AND timestamp < :end
+        WINDOW win AS (
+            PARTITION BY timestamp / :width ORDER BY timestamp, id
+            ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+        )
+    )
+    GROUP BY bucket
+"""
+
+# For 1m buckets whose raw rows may already be pruned or archived: a late
+# point only creates a missing bucket and never replaces one built when the
+# bucket was complete.
+KEEP_FROM_RAW_SQL = FROM_RAW_SQL.replace("INSERT OR REPLACE", "INSERT OR IGNORE", 1)
+
+FROM_ROLLUP_SQL = """
+    INSERT OR REPLACE INTO price_rollups
+        (symbol, interval, bucket, open, high, low, close, price_sum, count, first_ts, last_ts)
+    SELECT :symbol, :interval, parent, open, max(high), min(low), close,
+           sum(price_sum), sum(count), min(first_ts), max(last_ts)
+    FROM (
+        SELECT high, low, price_sum, count, first_ts, last_ts,
+               (bucket / :width) * :width AS parent,
+               first_value(open) OVER win AS open,
+               last_value(close) OVER win AS close
+        FROM price_rollups
+        WHERE symbol = :symbol AND interval = :source
+        AND bucket >= :start AND bucket < :end
+        WINDOW win AS (
+            PARTITION BY bucket / :width ORDER BY bucket
+            ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+        )
+    )
+    GROUP BY parent
+"""
+
+
+def _runs(buckets, width):
+    """Merge bucket starts into contiguous [start, end) ranges."""
+    runs = []
+    for bucket in sorted(buckets):
+        if runs and runs[-1][1] == bucket:
+            runs[-1][1] = bucket + width
+        else:
+            runs.append([bucket, bucket + width])
+    return runs
+
+
+def update_rollups(conn, points, raw_since=None):
+    """Refresh every rollup bucket containing one of the (symbol, timestamp) points.
+
+    raw_since (epoch ms) is where the raw table becomes complete, when
+    retention or archiving removes older rows: existing 1m buckets starting
+    before it are kept instead of being rebuilt from what raw rows remain.
+    Must run in the same transaction as the insert of those points.
+    """
+    by_symbol = {}
+    for symbol, timestamp in points:
+        by_symbol.setdefault(symbol, set()).add(timestamp)
+
+    for symbol, timestamps in by_symbol.items():
+        for interval, width, source in INTERVALS:
+            buckets = {(ts // width) * width for ts in timestamps}
+            if source is not None:
+                parts = [(FROM_ROLLUP_SQL, buckets)]
+            elif raw_since is None:
+                parts = [(FROM_RAW_SQL, buckets)]
+            else:
+                parts = [
+                    (KEEP_FROM_RAW_SQL, {b for b in buckets if b < raw_since}),
+                    (FROM_RAW_SQL, {b for b in buckets if b >= raw_since}),
+                ]
+            for sql, part in parts:
+                for start, end in _runs(part, width):
+                    conn.execute(sql, {
+                        "symbol": symbol, "interval": interval, "source": source,
+                        "width": width, "start": start, "end": end,
+                    })
+
+
+def rebuild_rollups(conn):
+    """Recompute all rollups from the raw table (used when the table is created)."""
+    symbols = [row[0] for row in conn.execute("SELECT DISTINCT symbol FROM crypto_prices")]
+    for symbol in symbols:
+        for interval, width, source in INTERVALS:
+            sql = FROM_RAW_SQL if source is None else FROM_ROLLUP_SQL
+            conn.execute(sql, {
+                "symbol": symbol, "interval": interval, "source": source,
+                "width": width, "start": -2 ** 62, "end": 2 ** 62,
+            })
+
+
+def prune_raw(conn, cutoff, limit=5000):
+    """Delete up to limit raw rows older than cutoff (epoch ms), per symbol.
+
+    Returns the number of rows deleted; call again until it returns 0.
+    """
+    deleted = 0
+    symbols = [row[0] for row in conn.execute(
+        "SELECT DISTINCT symbol FROM price_rollups WHERE interval = '1d'"
+    )]
+    for symbol in symbols:
+        with conn:
+            deleted += conn.execute("""
+                DELETE FROM crypto_prices WHERE id IN (
+                    SELECT id FROM crypto_prices
+                    WHERE symbol = ? AND timestamp < ?
+                    LIMIT ?
+                )
+            """, (symbol, cutoff, limit)).rowcount
+    return deleted
@@ -0,0 +1,101 @@
+import os
+import mmap
+import struct
+
+
+# Segment files carry many price points in one drop into DATA_DIR, e.g. a
+# collector backfill, instead of one JSON file per point. They are recognised
+# by their magic number, whatever the file is called. Layout, little-endian:
+#
+#   offset  size      field
+#   0       4         magic b"CPS1"
+#   4       2         format version (1)
+#   6       2         reserved, 0
+#   8       4         uint32 header length H; records start at offset H
+#   12      4         uint32 record count N
+#   16      2         uint16 symbol count S
+#   18      2         uint16 source count T
+#   20      ...       S symbols, then T sources: uint8 byte length + UTF-8
+#   H       20 * N    records: int64 timestamp (epoch ms), float64 price,
+#                     uint16 symbol index, uint16 source index
+#
+# Fixed-size records decode with one struct.iter_unpack pass over a
+# memoryview of the mapped file: no per-record string parsing or dicts.
+# Writers go through a temporary name and rename into place, as the ingestor
+# may pick a file up as soon as it appears.
+
+MAGIC = b"CPS1"
+VERSION = 1
+SUFFIX = ".cps"
+HEADER = struct.Struct("<4sHHIIHH")
+RECORD = struct.Struct("<qdHH")
+
+
+def encode(rows):
+    """Encode (symbol, price, timestamp ms, source) rows as one segment."""
+    symbols, sources = {}, {}
+    records = bytearray(RECORD.size * len(rows))
+    for i, (symbol, price, timestamp, source) in enumerate(rows):
+        RECORD.pack_into(
+            records, i * RECORD.size, timestamp, price,
+            symbols.setdefault(symbol, len(symbols)), sources.setdefault(source, len(sources)),
+        )
+    tables = bytearray()
+    for name in list(symbols) + list(sources):
+        data = name.encode()
+        if len(data) > 255:
+            raise ValueError(f"name longer than 255 bytes: {name!r}")
+        tables += bytes([len(data)]) + data
+    if len(symbols) > 0xFFFF or len(sources) > 0xFFFF:
+        raise ValueError("more than 65535 distinct symbols or sources")
+    header = HEADER.pack(MAGIC, VERSION, 0, HEADER.size + len(tables), len(rows), len(symbols), len(sources))
+    return header + bytes(tables) + bytes(records)
+
+
+def write_segment(path, rows):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(encode(rows))
+    os.replace(tmp, path)
+
+
+def decode(buffer):
+    """Yield (symbol, price, timestamp ms, source) rows from a segment buffer."""
+    view = memoryview(buffer)
+    try:
+        if len(view) < HEADER.size:
+            raise ValueError("truncated segment header")
+        magic, version, _, header_size, count, symbol_count, source_count = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"not a version {VERSION} segment")
+        if header_size < HEADER.size or len(view) != header_size + RECORD.size * count:
+            raise ValueError(f"expected {count} records, segment is {len(view)} bytes")
+
+        names = []
+        offset = HEADER.size
+        for _ in range(symbol_count + source_count):
+            length = view[offset] if offset < header_size else 0
+            if offset + 1 + length > header_size:
+                raise ValueError("symbol and source tables overrun the header")
+            names.append(bytes(view[offset + 1:offset + 1 + length]).decode())
+            offset += 1 + length
+        symbols, sources = names[:symbol_count], names[symbol_count:]
+
+        records = view[header_size:]
+        try:
+            for timestamp, price, symbol, source in RECORD.iter_unpack(records):
+                yield symbols[symbol], price, timestamp, sources[source]
+        except IndexError:
+            raise ValueError("record refers to a symbol or source missing from the tables")
+        finally:
+            records.release()
+    finally:
+        view.release()
+
+
+def read_segment(f):
+    """Yield the rows of the segment in the open binary file f, memory-mapped."""
+    if os.fstat(f.fileno()).st_size == 0:
+        raise ValueError("empty segment")
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        yield from decode(mapped)
@@ -0,0 +1,126 @@
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import rollups
+
+
+# STORAGE_LAYOUT=sharded keeps each symbol's crypto_prices and price_rollups
+# in its own database, <shard dir>/<SYMBOL>.db, with the same schema as the
+# single database. Every shard has its own write lock, so one batch commits
+# its symbols in parallel, a per-coin scan only reads that coin's file, and
+# removing a coin is an unlink. Readers that want every symbol ATTACH the
+# shards and query a UNION ALL view (see tools/check_db.py --shards).
+
+SUFFIX = ".db"
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def shard_path(shard_dir, symbol):
+    # Same sanitising as archive.symbol_dir, symbols arrive through POST /ingest
+    return os.path.join(shard_dir, (_UNSAFE.sub("_", symbol) or "_") + SUFFIX)
+
+
+class ShardSet:
+    """Per-symbol databases under one directory, opened (and migrated) on first use.
+
+    Owned by the writer thread: only write() hands connections to its pool,
+    and waits for them before returning.
+    """
+
+    def __init__(self, shard_dir, workers=4):
+        self.shard_dir = shard_dir
+        self.conns = {}
+        self.insert_sql = {}
+        self.pool = ThreadPoolExecutor(max(1, workers), thread_name_prefix="shard-writer")
+        os.makedirs(shard_dir, exist_ok=True)
+
+    def symbols(self):
+        return sorted(
+            name[:-len(SUFFIX)] for name in os.listdir(self.shard_dir) if name.endswith(SUFFIX)
+        )
+
+    def conn(self, symbol):
+        conn = self.conns.get(symbol)
+        if conn is None:
+            conn = db.connect(shard_path(self.shard_dir, symbol), check_same_thread=False)
+            db.migrate(conn)
+            db.ensure_unique_index(conn)
+            self.insert_sql[symbol] = db.insert_sql(conn)
+            self.conns[symbol] = conn
+        return conn
+
+    def connections(self):
+        return [self.conn(symbol) for symbol in self.symbols()]
+
+    def write(self, rows, raw_since=None):
+        """Upsert rows into their symbols' shards, one transaction per shard.
+
+        Shards are committed concurrently; returns the longest write-lock
+        wait. Raises the first error after every shard has finished, so a
+        failed batch can be retried as a whole (upserts make the rows that
+        did commit harmless to replay).
+        """
+        by_symbol = {}
+        for row in rows:
+            by_symbol.setdefault(row[0], []).append(row)
+        # Open on this thread; the pool threads only use existing connections
+        jobs = [
+            (self.conn(symbol), self.insert_sql[symbol], symbol_rows, raw_since)
+            for symbol, symbol_rows in by_symbol.items()
+        ]
+        if len(jobs) == 1:
+            return _commit(*jobs[0])
+        futures = [self.pool.submit(_commit, *job) for job in jobs]
+        waits = []
+        error = None
+        for future in futures:
+            try:
+                waits.append(future.result())
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+        return max(waits)
+
+    def count(self, symbol):
+        """(raw rows, rollup rows) held by symbol's shard; (0, 0) if it has none."""
+        if not os.path.exists(shard_path(self.shard_dir, symbol)):
+            return 0, 0
+        conn = self.conn(symbol)
+        return (
+            conn.execute("SELECT count(*) FROM crypto_prices").fetchone()[0],
+            conn.execute("SELECT count(*) FROM price_rollups").fetchone()[0],
+        )
+
+    def remove(self, symbol):
+        """Close and delete symbol's shard, WAL and shared-memory files included."""
+        conn = self.conns.pop(symbol, None)
+        self.insert_sql.pop(symbol, None)
+        if conn is not None:
+            conn.close()
+        path = shard_path(self.shard_dir, symbol)
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        self.pool.shutdown()
+        for conn in self.conns.values():
+            conn.close()
+        self.conns.clear()
+
+
+def _commit(conn, insert_sql, rows, raw_since):
+    started = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    locked = time.perf_counter()
+    with conn:
+        conn.executemany(insert_sql, rows)
+        rollups.update_rollups(conn, [(row[0], row[2]) for row in rows], raw_since)
+    return locked - started
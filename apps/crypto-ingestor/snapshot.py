@@ -0,0 +1,158 @@
+import os
+import sqlite3
+import time
+
+
+# Read-only copies of the ingestor's databases for the frontend and
+# tools/check_db.py, so their long scans never touch the live files (or their
+# locks, which are unreliable on network filesystems). Layout under the
+# snapshot directory mirrors /data:
+#
+#   <snapshot dir>/crypto.db               copy of DB_PATH
+#   <snapshot dir>/shards/<SYMBOL>.db      copy of each shard (sharded layout)
+#
+# Each copy is made with the online backup API, a few pages per step, from a
+# connection that holds one WAL read transaction for the whole copy: the
+# ingestor keeps committing meanwhile, and the copy is the database as of
+# the moment the read began (writes by other connections would otherwise
+# restart the backup). Copies are written under a temporary name in rollback
+# journal mode and renamed into place, so a reader sees either the previous
+# snapshot or the new one, never a partial file. A published file is never
+# modified again, so readers may open it with ?immutable=1 and skip locking.
+# A database with no commits since its last copy (PRAGMA data_version, see
+# ChangeTracker) is not copied again.
+
+TMP_SUFFIX = ".tmp"
+
+
+def publish(source_path, target_path, pages=1024, pause=0.005):
+    """Copy source_path to target_path as a consistent snapshot; returns pages copied."""
+    os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+    tmp = target_path + TMP_SUFFIX
+    for suffix in ("", "-journal"):
+        try:
+            os.remove(tmp + suffix)
+        except FileNotFoundError:
+            pass
+
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True, isolation_level=None)
+    target = sqlite3.connect(tmp, isolation_level=None)
+    copied = 0
+    try:
+        source.execute("BEGIN")
+        source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+
+        def progress(status, remaining, total):
+            nonlocal copied
+            copied = total - remaining
+
+        source.backup(target, pages=pages, progress=progress, sleep=pause)
+        source.execute("COMMIT")
+        # The copied header says WAL; readers of an immutable file need none
+        target.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        target.close()
+        source.close()
+
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, target_path)
+    return copied
+
+
+class ChangeTracker:
+    """Tells which databases committed anything since their last snapshot.
+
+    Keeps one read-only connection per database: its PRAGMA data_version
+    changes whenever another connection, in any process, commits. A file
+    replaced under the same name (a shard purged and recreated) is reopened.
+    """
+
+    def __init__(self):
+        self.conns = {}
+        self.published = {}
+
+    def version(self, path):
+        """A token that differs from the last one whenever path has changed."""
+        inode = os.stat(path).st_ino
+        entry = self.conns.get(path)
+        if entry is None or entry[0] != inode:
+            self.forget(path)
+            entry = self.conns[path] = (inode, sqlite3.connect(f"file:{path}?mode=ro", uri=True))
+        return inode, entry[1].execute("PRAGMA data_version").fetchone()[0]
+
+    def changed(self, path, target):
+        """(whether path needs a new snapshot at target, the version to mark it with)."""
+        version = self.version(path)
+        return version != self.published.get(path) or not os.path.exists(target), version
+
+    def mark(self, path, version):
+        self.published[path] = version
+
+    def forget(self, path):
+        entry = self.conns.pop(path, None)
+        self.published.pop(path, None)
+        if entry is not None:
+            entry[1].close()
+
+    def retain(self, paths):
+        """Close the connections of databases no longer snapshotted."""
+        for path in set(self.conns) - set(paths):
+            self.forget(path)
+
+    def close(self):
+        self.retain(())
+
+
+def snapshot_paths(db_path, shard_dir, snapshot_dir):
+    """(source, snapshot) pairs for db_path and, if shard_dir is set, every shard in it."""
+    pairs = [(db_path, os.path.join(snapshot_dir, os.path.basename(db_path)))]
+    if shard_dir and os.path.isdir(shard_dir):
+        for name in sorted(os.listdir(shard_dir)):
+            if name.endswith(".db"):
+                pairs.append((os.path.join(shard_dir, name), os.path.join(snapshot_dir, "shards", name)))
+    return pairs
+
+
+def remove_stale(snapshot_dir, pairs):
+    """Delete snapshot shards whose source is gone (e.g. a purged symbol)."""
+    keep = {target for _, target in pairs}
+    shard_snapshots = os.path.join(snapshot_dir, "shards")
+    if not os.path.isdir(shard_snapshots):
+        return
+    for name in os.listdir(shard_snapshots):
+        path = os.path.join(shard_snapshots, name)
+        if path not in keep and name.endswith((".db", ".db" + TMP_SUFFIX)):
+            os.remove(path)
+
+
+def publish_all(db_path, shard_dir, snapshot_dir, pages=1024, pause=0.005, tracker=None):
+    """Snapshot db_path and every shard; returns (files, pages, seconds).
+
+    With a ChangeTracker, only the databases that changed since their last
+    snapshot are copied, and files counts just those.
+    """
+    started = time.monotonic()
+    pairs = snapshot_paths(db_path, shard_dir, snapshot_dir)
+    if tracker is not None:
+        tracker.retain([source for source, _ in pairs])
+    files = total = 0
+    for source, target in pairs:
+        try:
+            version = None
+            if tracker is not None:
+                changed, version = tracker.changed(source, target)
+                if not changed:
+                    continue
+            total += publish(source, target, pages, pause)
+            files += 1
+            if tracker is not None:
+                # Read before the copy began: a commit racing it only means
+                # one more copy next time
+                tracker.mark(source, version)
+        except (sqlite3.Error, FileNotFoundError):
+            # A shard unlinked by a purge since the listing
+            if os.path.exists(source):
+                raise
+    remove_stale(snapshot_dir, pairs)
+    return files, total, time.monotonic() - started
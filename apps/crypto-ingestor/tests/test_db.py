@@ -0,0 +1,155 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import db
+import rollups
+
+# crypto_prices as the ingestor created it before schema versions existed
+BASELINE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS crypto_prices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        symbol TEXT,
+        price REAL,
+        timestamp TEXT,
+        source TEXT
+    );
+"""
+
+
+def connect(test):
+    tmp = tempfile.TemporaryDirectory()
+    test.addCleanup(tmp.cleanup)
+    conn = db.connect(os.path.join(tmp.name, "crypto.db"))
+    test.addCleanup(conn.close)
+    return conn
+
+
+def raw_totals(conn):
+    """(count, price sum) per symbol from the raw table."""
+    return {
+        symbol: (count, total) for symbol, count, total in
+        conn.execute("SELECT symbol, count(*), sum(price) FROM crypto_prices GROUP BY symbol")
+    }
+
+
+def rollup_totals(conn, interval):
+    """(count, price sum) per symbol over one rollup interval."""
+    return {
+        symbol: (count, total) for symbol, count, total in conn.execute(
+            "SELECT symbol, sum(count), sum(price_sum) FROM price_rollups WHERE interval = ? GROUP BY symbol",
+            (interval,),
+        )
+    }
+
+
+class MigrateTest(unittest.TestCase):
+    def test_migrates_the_baseline_schema(self):
+        conn = connect(self)
+        conn.executescript(BASELINE_SCHEMA)
+        conn.executemany("INSERT INTO crypto_prices (symbol, price, timestamp, source) VALUES (?, ?, ?, ?)", [
+            ("BTC", 100.0, "2024-01-01T00:00:30Z", "binance"),
+            ("BTC", 110.0, "2024-01-01T00:01:15.123456789+00:00", "binance"),
+            ("ETH", 10.0, "2024-01-01 00:00:00", "binance"),
+            ("ETH", 11.0, "not a timestamp", "binance"),
+        ])
+        conn.commit()
+
+        self.assertEqual(db.migrate(conn), db.MIGRATIONS[-1][0])
+
+        rows = conn.execute("SELECT symbol, price, timestamp FROM crypto_prices ORDER BY id").fetchall()
+        self.assertEqual(rows, [
+            ("BTC", 100.0, 1704067230000),
+            ("BTC", 110.0, 1704067275123),
+            ("ETH", 10.0, 1704067200000),
+        ])
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertIn("idx_crypto_prices_symbol_ts", db.index_names(conn))
+        # Migration 4 builds the rollups of the rows already there
+        self.assertEqual(rollup_totals(conn, "1m"), {"BTC": (2, 210.0), "ETH": (1, 10.0)})
+        self.assertEqual(rollup_totals(conn, "1d"), rollup_totals(conn, "1m"))
+
+    def test_migrate_is_idempotent(self):
+        conn = connect(self)
+        version = db.migrate(conn)
+        self.assertEqual(db.migrate(conn), version)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], version)
+
+    def test_failed_migration_rolls_back(self):
+        conn = connect(self)
+        conn.executescript(BASELINE_SCHEMA)
+        broken = db.MIGRATIONS + [(99, "broken", lambda c: c.execute("SELECT * FROM missing"))]
+        original, db.MIGRATIONS = db.MIGRATIONS, broken
+        self.addCleanup(setattr, db, "MIGRATIONS", original)
+
+        with self.assertRaises(sqlite3.OperationalError):
+            db.migrate(conn)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], original[-1][0])
+
+
+class CompactDuplicatesTest(unittest.TestCase):
+    def test_keeps_the_newest_copy_of_each_point(self):
+        conn = connect(self)
+        db.migrate(conn)
+        rows = [
+            ("BTC", 100.0, 60000, "binance"),
+            ("BTC", 101.0, 60000, "binance"),
+            ("BTC", 102.0, 60000, "binance"),
+            ("BTC", 100.0, 60000, "coinbase"),
+            ("ETH", 10.0, 60000, "binance"),
+        ]
+        # Written before the unique index existed
+        conn.executemany("INSERT INTO crypto_prices (symbol, price, timestamp, source) VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+        self.assertFalse(db.ensure_unique_index(conn))
+
+        self.assertEqual(db.compact_duplicates(conn, chunk_size=2, pause=0), 2)
+
+        self.assertEqual(
+            sorted(conn.execute("SELECT symbol, price, source FROM crypto_prices")),
+            [("BTC", 100.0, "coinbase"), ("BTC", 102.0, "binance"), ("ETH", 10.0, "binance")],
+        )
+        self.assertTrue(db.ensure_unique_index(conn))
+        self.assertEqual(db.insert_sql(conn), db.UPSERT_SQL)
+
+    def test_rollups_match_the_raw_rows_afterwards(self):
+        conn = connect(self)
+        db.migrate(conn)
+        # Every point written twice before upserts, rollups counting both
+        rows = [
+            (symbol, 100.0 + i, 1704067200000 + i * 7000, "binance")
+            for symbol in ("BTC", "ETH") for i in range(2000)
+        ]
+        with conn:
+            for copy in (rows, [(s, p + 1, t, src) for s, p, t, src in rows]):
+                conn.executemany("INSERT INTO crypto_prices (symbol, price, timestamp, source) VALUES (?, ?, ?, ?)", copy)
+                rollups.update_rollups(conn, [(row[0], row[2]) for row in copy])
+        self.assertEqual(rollup_totals(conn, "1m")["BTC"][0], 4000)
+
+        self.assertEqual(db.compact_duplicates(conn, chunk_size=500, pause=0), 4000)
+
+        raw = raw_totals(conn)
+        self.assertEqual(raw["BTC"], (2000, sum(101.0 + i for i in range(2000))))
+        for interval, _, _ in rollups.INTERVALS:
+            with self.subTest(interval=interval):
+                self.assertEqual(rollup_totals(conn, interval), raw)
+
+    def test_empty_table(self):
+        conn = connect(self)
+        db.migrate(conn)
+        self.assertEqual(db.compact_duplicates(conn, pause=0), 0)
+
+
+class UpsertTest(unittest.TestCase):
+    def test_a_refetched_point_replaces_the_stored_one(self):
+        conn = connect(self)
+        db.migrate(conn)
+        self.assertTrue(db.ensure_unique_index(conn))
+        with conn:
+            conn.executemany(db.UPSERT_SQL, [("BTC", 100.0, 60000, "binance"), ("BTC", 105.0, 60000, "binance")])
+        self.assertEqual(conn.execute("SELECT price FROM crypto_prices").fetchall(), [(105.0,)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import json
+import socket
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import main
+
+
+RECORD = {"symbol": "BTC", "price": 43000.5, "timestamp": 1704067200000, "source": "binance"}
+
+
+class FakePipeline:
+    """Commits every submitted row at once."""
+
+    def __init__(self):
+        self.rows = []
+        self.batches = []
+
+    def submit(self, rows, timeout=None):
+        self.rows.extend(rows)
+        self.batches.append(len(rows))
+        ack = main.Ack(len(rows))
+        ack.committed(len(rows))
+        return ack
+
+
+class HandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), main.HealthHandler)
+        self.server.daemon_threads = True
+        self.server.pipeline = None
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def get(self, path):
+        try:
+            with urllib.request.urlopen(self.url + path, timeout=5) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def raw(self, request):
+        """Send raw request bytes; returns (status, JSON body)."""
+        with socket.create_connection(self.server.server_address, timeout=5) as conn:
+            conn.sendall(request)
+            conn.shutdown(socket.SHUT_WR)
+            response = b""
+            while chunk := conn.recv(65536):
+                response += chunk
+        head, _, body = response.partition(b"\r\n\r\n")
+        return int(head.split()[1]), json.loads(body)
+
+    def post(self, headers, body=b""):
+        lines = [b"POST /ingest HTTP/1.1", b"Host: test", b"Connection: close"] + headers
+        return self.raw(b"\r\n".join(lines) + b"\r\n\r\n" + body)
+
+    def test_ingest_with_content_length(self):
+        self.server.pipeline = FakePipeline()
+        body = (json.dumps(RECORD) + "\n") * 3
+        self.assertEqual(self.post([b"Content-Length: %d" % len(body)], body.encode()), (200, {"ingested": 3}))
+        self.assertEqual(len(self.server.pipeline.rows), 3)
+
+    def test_a_large_push_is_queued_in_batches(self):
+        self.server.pipeline = FakePipeline()
+        count = main.BATCH_SIZE * 2 + 7
+        body = ((json.dumps(RECORD) + "\n") * count).encode()
+        self.assertEqual(self.post([b"Content-Length: %d" % len(body)], body), (200, {"ingested": count}))
+        self.assertEqual(self.server.pipeline.batches, [main.BATCH_SIZE, main.BATCH_SIZE, 7])
+
+    def test_a_bad_record_reports_what_was_already_queued(self):
+        self.server.pipeline = FakePipeline()
+        good = (json.dumps(RECORD) + "\n") * (main.BATCH_SIZE + 3)
+        body = (good + json.dumps({**RECORD, "price": "nan"}) + "\n").encode()
+        status, payload = self.post([b"Content-Length: %d" % len(body)], body)
+        self.assertEqual(status, 400)
+        self.assertEqual(payload["ingested"], main.BATCH_SIZE)
+
+    def test_ingest_chunked(self):
+        self.server.pipeline = FakePipeline()
+        line = (json.dumps(RECORD) + "\n").encode()
+        chunks = [line[:10], line[10:] + line, line]
+        body = b"".join(b"%x;ext=1\r\n%s\r\n" % (len(c), c) for c in chunks) + b"0\r\nX-Trailer: 1\r\n\r\n"
+        self.assertEqual(self.post([b"Transfer-Encoding: chunked"], body), (200, {"ingested": 3}))
+        self.assertEqual(self.server.pipeline.rows, [("BTC", 43000.5, 1704067200000, "binance")] * 3)
+
+    def test_ingest_rejects_bad_framing(self):
+        self.server.pipeline = FakePipeline()
+        record = json.dumps(RECORD).encode()
+        cases = [
+            ("no length", [], record, 411),
+            ("non-numeric length", [b"Content-Length: ten"], record, 400),
+            ("negative length", [b"Content-Length: -1"], record, 400),
+            ("short body", [b"Content-Length: %d" % (len(record) + 5)], record, 400),
+            ("too large", [b"Content-Length: %d" % (main.MAX_INGEST_BYTES + 1)], record, 413),
+            ("bad chunk size", [b"Transfer-Encoding: chunked"], b"zz\r\n" + record + b"\r\n0\r\n\r\n", 400),
+            ("truncated chunk", [b"Transfer-Encoding: chunked"], b"%x\r\n" % (len(record) + 5) + record, 400),
+            ("gzip", [b"Transfer-Encoding: gzip"], record, 501),
+        ]
+        for name, headers, body, status in cases:
+            with self.subTest(name):
+                self.assertEqual(self.post(headers, body)[0], status)
+        self.assertEqual(self.server.pipeline.rows, [])
+
+    def test_chunked_body_over_the_limit(self):
+        self.server.pipeline = FakePipeline()
+        original, main.MAX_INGEST_BYTES = main.MAX_INGEST_BYTES, 100
+        self.addCleanup(setattr, main, "MAX_INGEST_BYTES", original)
+        chunk = b" " * 60
+        body = b"3c\r\n" + chunk + b"\r\n3c\r\n" + chunk + b"\r\n0\r\n\r\n"
+        self.assertEqual(self.post([b"Transfer-Encoding: chunked"], body)[0], 413)
+
+    def test_routes_ignore_the_query_string(self):
+        status, body = self.get("/health?probe=liveness")
+        self.assertEqual((status, json.loads(body)), (200, {"status": "migrating"}))
+        status, body = self.get("/metrics?x=1")
+        self.assertEqual(status, 200)
+        self.assertIn(b"crypto_ingestor_files_ingested_total", body)
+        self.assertEqual(self.get("/nothing?x=1")[0], 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import db
+import main
+from tests.test_db import connect
+
+
+class ParserTest(unittest.TestCase):
+    def setUp(self):
+        conn = connect(self)
+        db.migrate(conn)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.data_dir = tmp.name
+        self.processing = os.path.join(tmp.name, "processing")
+        os.makedirs(self.processing)
+        for name, value in (("PROCESSING_DIR", self.processing), ("QUARANTINE_GRACE", 0)):
+            self.addCleanup(setattr, main, name, getattr(main, name))
+            setattr(main, name, value)
+        self.pipeline = main.IngestPipeline(None, conn, workers=1)
+        self.pipeline._read_conn = lambda: conn
+
+    def drop(self, name, content):
+        path = os.path.join(self.data_dir, name)
+        with open(path, "w") as f:
+            f.write(content)
+        self.pipeline.in_flight.add(path)
+        return path
+
+    def parse(self, *paths):
+        """Run one parser thread's loop over paths until it is told to stop."""
+        for path in paths:
+            self.pipeline.paths.put(path)
+        self.pipeline.paths.put(None)
+        self.pipeline._parse()
+        items = []
+        while not self.pipeline.records.empty():
+            items.append(self.pipeline.records.get())
+        return items
+
+    def test_an_unexpected_error_releases_the_file_for_a_retry(self):
+        def broken_quarantine(filepath, key, error, records):
+            raise PermissionError("quarantine is read-only")
+
+        self.addCleanup(setattr, main, "quarantine", main.quarantine)
+        main.quarantine = broken_quarantine
+        bad = self.drop("bad.json", "{not json")
+        good = self.drop("good.json", '{"symbol": "BTC", "price": 1, "timestamp": 1704067200000, "source": "b"}')
+        errors = main.PARSER_ERRORS.value
+
+        items = self.parse(bad, good)
+
+        # The thread carried on with the next file
+        claimed_bad, claimed_good = (os.path.join(self.processing, os.path.basename(p)) for p in (bad, good))
+        done = [item for item in items if isinstance(item, main.FileDone)]
+        self.assertEqual([(d.filepath, d.ok) for d in done], [(claimed_bad, False), (claimed_good, True)])
+        self.assertEqual(main.PARSER_ERRORS.value, errors + 1)
+        self.assertTrue(os.path.exists(claimed_bad))
+        self.assertNotIn(claimed_bad, self.pipeline.in_flight)
+        self.assertEqual(self.pipeline.retries.get_nowait()[1], claimed_bad)
+
+    def test_a_retried_file_is_picked_up_from_processing(self):
+        path = self.drop("a.json", '{"symbol": "BTC", "price": 1, "timestamp": 1704067200000, "source": "b"}')
+        claimed = os.path.join(self.processing, "a.json")
+        os.rename(path, claimed)
+
+        items = self.parse(claimed)
+
+        self.assertEqual(items[0][0], ("BTC", 1.0, 1704067200000, "b"))
+        self.assertEqual((items[1].filepath, items[1].ok, items[1].records), (claimed, True, 1))
+
+
+class CatchUpHealthTest(unittest.TestCase):
+    def setUp(self):
+        conn = connect(self)
+        db.migrate(conn)
+        self.pipeline = main.IngestPipeline(None, conn, workers=1)
+        self.addCleanup(setattr, main, "CATCHUP_BACKLOG", main.CATCHUP_BACKLOG)
+        main.CATCHUP_BACKLOG = 100
+
+    def scan(self, files):
+        with mock.patch.object(main.BACKLOG, "get", return_value=(files, 60.0)):
+            self.pipeline.next_backlog_check = 0
+            self.pipeline._check_backlog()
+
+    def test_backlog_counts_down_between_scans(self):
+        self.scan(1000)
+        health = self.pipeline.health()
+        self.assertEqual((health["status"], health["backlog_files"], health["progress"]), ("catching up", 1000, 0.0))
+
+        # Everything committed before the next directory scan
+        main.FILES_INGESTED.inc(1000)
+        health = self.pipeline.health()
+        self.assertEqual((health["backlog_files"], health["progress"]), (0, 1.0))
+        self.assertLessEqual(health["backlog_checked_at"], int(main.time.time() * 1000))
+
+    def test_files_in_flight_are_still_waiting(self):
+        self.scan(1000)
+        self.pipeline.in_flight.update(f"/data/raw/{i}.json" for i in range(300))
+        main.FILES_INGESTED.inc(900)
+        self.assertEqual(self.pipeline.health()["backlog_files"], 300)
+
+
+if __name__ == "__main__":
+    unittest.main()
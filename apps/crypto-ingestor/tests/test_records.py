@@ -0,0 +1,84 @@
+import io
+import json
+import unittest
+
+import main
+
+RECORD = {"symbol": "BTC", "price": 43000.5, "timestamp": "2024-01-01T00:00:00Z", "source": "binance"}
+ROW = ("BTC", 43000.5, 1704067200000, "binance")
+
+
+def record(**fields):
+    return {**RECORD, **fields}
+
+
+def decode(body):
+    """Decode body the way POST /ingest does."""
+    stream = io.TextIOWrapper(io.BufferedReader(main.LengthBody(io.BytesIO(body), len(body))), encoding="utf-8")
+    return list(main.iter_json_values(stream))
+
+
+class DecodeRecordsTest(unittest.TestCase):
+    def test_accepts_an_object_an_array_and_ndjson(self):
+        one = json.dumps(RECORD).encode()
+        self.assertEqual(decode(one), [RECORD])
+        self.assertEqual(decode(b"[" + one + b", " + one + b"]"), [RECORD, RECORD])
+        self.assertEqual(decode(one + b"\n" + one + b"\n"), [RECORD, RECORD])
+        self.assertEqual(decode(b""), [])
+
+    def test_values_split_across_chunks(self):
+        body = "\n".join(json.dumps(record(price=1.0 + i / 7)) for i in range(50))
+        values = list(main.iter_json_values(io.StringIO(body), chunk_size=16))
+        self.assertEqual([v["price"] for v in values], [1.0 + i / 7 for i in range(50)])
+
+    def test_rejects_malformed_bodies(self):
+        cases = {
+            "truncated": json.dumps(RECORD)[:-1].encode(),
+            "garbage": b"not json",
+            "invalid utf-8": b'{"symbol": "\xff"}',
+        }
+        for name, body in cases.items():
+            with self.subTest(name):
+                with self.assertRaises(ValueError):
+                    decode(body)
+
+    def test_rejects_oversized_records(self):
+        body = io.StringIO(json.dumps(record(source="x" * 200)))
+        with self.assertRaisesRegex(ValueError, "larger than"):
+            list(main.iter_json_values(body, chunk_size=16, max_value_size=64))
+
+
+class ParseRecordTest(unittest.TestCase):
+    def test_valid_record(self):
+        self.assertEqual(main.parse_record(RECORD), ROW)
+        self.assertEqual(main.parse_record(record(price="43000.5", timestamp=1704067200)), ROW)
+
+    def test_missing_field(self):
+        data = dict(RECORD)
+        del data["source"]
+        with self.assertRaises(KeyError):
+            main.parse_record(data)
+
+    def test_rejects_bad_values(self):
+        cases = {
+            "not an object": ["BTC"],
+            "null symbol": record(symbol=None),
+            "list symbol": record(symbol=["BTC"]),
+            "empty source": record(source=""),
+            "bool price": record(price=True),
+            "null price": record(price=None),
+            "nan price": record(price="nan"),
+            "infinite price": record(price="inf"),
+            "text price": record(price="cheap"),
+            "unparseable timestamp": record(timestamp="yesterday"),
+            "timestamp past int64": record(timestamp=1e30),
+            "huge integer timestamp": record(timestamp=99999999999999999999),
+        }
+        for name, data in cases.items():
+            with self.subTest(name):
+                with self.assertRaises(ValueError):
+                    main.parse_record(data)
+
+
+if __name__ == "__main__":
+    unittest.main()
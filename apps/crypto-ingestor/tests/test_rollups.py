@@ -0,0 +1,87 @@
+import random
+import unittest
+
+import db
+import rollups
+from tests.test_db import connect
+
+MINUTE = 60 * 1000
+DAY = 24 * 60 * MINUTE
+
+
+def all_rollups(conn):
+    return conn.execute("SELECT * FROM price_rollups ORDER BY symbol, interval, bucket").fetchall()
+
+
+def insert(conn, rows, raw_since=None):
+    with conn:
+        conn.executemany(db.UPSERT_SQL, rows)
+        rollups.update_rollups(conn, [(symbol, timestamp) for symbol, _, timestamp, _ in rows], raw_since)
+
+
+class UpdateRollupsTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = connect(self)
+        db.migrate(self.conn)
+        db.ensure_unique_index(self.conn)
+
+    def test_incremental_updates_match_a_rebuild(self):
+        rng = random.Random(7)
+        start = 1704067200000
+        batches = [
+            [
+                (rng.choice(["BTC", "ETH"]), round(rng.uniform(90, 110), 2),
+                 start + rng.randrange(2 * DAY) // 1000 * 1000, "binance")
+                for _ in range(200)
+            ]
+            for _ in range(10)
+        ]
+        for batch in batches:
+            insert(self.conn, batch)
+        incremental = all_rollups(self.conn)
+
+        with self.conn:
+            self.conn.execute("DELETE FROM price_rollups")
+            rollups.rebuild_rollups(self.conn)
+
+        self.assertEqual(len(incremental), len(all_rollups(self.conn)))
+        for got, want in zip(incremental, all_rollups(self.conn)):
+            # price_sum is summed in a different order
+            self.assertEqual(got[:7], want[:7])
+            self.assertAlmostEqual(got[7], want[7], places=6)
+            self.assertEqual(got[8:], want[8:])
+
+    def test_ohlc_of_one_minute(self):
+        insert(self.conn, [
+            ("BTC", 102.0, MINUTE + 30000, "binance"),
+            ("BTC", 100.0, MINUTE + 1000, "binance"),
+            ("BTC", 99.0, MINUTE + 59000, "binance"),
+            ("BTC", 105.0, MINUTE + 40000, "binance"),
+        ])
+        row = self.conn.execute(
+            "SELECT open, high, low, close, price_sum, count, first_ts, last_ts FROM price_rollups "
+            "WHERE symbol = 'BTC' AND interval = '1m'"
+        ).fetchone()
+        self.assertEqual(row, (100.0, 105.0, 99.0, 99.0, 406.0, 4, MINUTE + 1000, MINUTE + 59000))
+
+    def test_a_late_point_before_raw_since_keeps_the_existing_bucket(self):
+        insert(self.conn, [("BTC", 100.0, MINUTE, "binance"), ("BTC", 110.0, MINUTE + 1000, "binance")])
+        with self.conn:
+            self.conn.execute("DELETE FROM crypto_prices")
+
+        insert(self.conn, [("BTC", 200.0, MINUTE + 2000, "binance"), ("BTC", 50.0, 5 * MINUTE, "binance")],
+               raw_since=10 * MINUTE)
+
+        minutes = self.conn.execute(
+            "SELECT bucket, count, price_sum FROM price_rollups WHERE interval = '1m' ORDER BY bucket"
+        ).fetchall()
+        # The pruned minute keeps its totals; the missing one is filled in
+        self.assertEqual(minutes, [(MINUTE, 2, 210.0), (5 * MINUTE, 1, 50.0)])
+        self.assertEqual(
+            self.conn.execute("SELECT count, price_sum FROM price_rollups WHERE interval = '1d'").fetchone(),
+            (3, 260.0),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+
+import segment
+
+ROWS = [
+    ("BTC", 43000.5, 1704067200000, "binance"),
+    ("ETH", 2300.25, 1704067201000, "binance"),
+    ("BTC", 43001.0, 1704067202000, "kraken"),
+    ("ÉTH", -1.5, -2**63, "s" * 255),
+]
+
+
+class SegmentTest(unittest.TestCase):
+    def test_round_trip(self):
+        self.assertEqual(list(segment.decode(segment.encode(ROWS))), ROWS)
+        self.assertEqual(list(segment.decode(segment.encode([]))), [])
+
+    def test_write_and_read_a_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "backfill" + segment.SUFFIX)
+            segment.write_segment(path, ROWS)
+            self.assertEqual(os.listdir(tmp), ["backfill" + segment.SUFFIX])
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(len(segment.MAGIC)), segment.MAGIC)
+                self.assertEqual(list(segment.read_segment(f)), ROWS)
+
+    def test_empty_file(self):
+        with tempfile.TemporaryFile() as f:
+            with self.assertRaisesRegex(ValueError, "empty segment"):
+                list(segment.read_segment(f))
+
+    def test_corrupt_segments_raise_value_error(self):
+        data = segment.encode(ROWS)
+        header_size = segment.HEADER.unpack_from(data)[3]
+        bad_index = bytearray(data)
+        # Symbol index of the first record past the two symbols in the table
+        segment.RECORD.pack_into(bad_index, header_size, 0, 1.0, 7, 0)
+        cases = {
+            "truncated header": data[:10],
+            "wrong magic": b"XXXX" + data[4:],
+            "truncated records": data[:-1],
+            "trailing bytes": data + b"\0",
+            "bad symbol index": bytes(bad_index),
+        }
+        for name, broken in cases.items():
+            with self.subTest(name):
+                with self.assertRaises(ValueError):
+                    list(segment.decode(broken))
+
+    def test_names_longer_than_255_bytes_are_rejected(self):
+        with self.assertRaises(ValueError):
+            segment.encode([("BTC", 1.0, 0, "s" * 256)])
+
+
+if __name__ == "__main__":
+    unittest.main()
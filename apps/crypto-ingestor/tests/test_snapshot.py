@@ -0,0 +1,82 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import db
+import snapshot
+
+
+class PublishAllTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db_path = os.path.join(tmp.name, "crypto.db")
+        self.shard_dir = os.path.join(tmp.name, "shards")
+        self.snapshot_dir = os.path.join(tmp.name, "snapshot")
+        os.makedirs(self.shard_dir)
+        self.conn = db.connect(self.db_path)
+        self.addCleanup(self.conn.close)
+        db.migrate(self.conn)
+        self.tracker = snapshot.ChangeTracker()
+        self.addCleanup(self.tracker.close)
+
+    def publish(self):
+        files, _, _ = snapshot.publish_all(
+            self.db_path, self.shard_dir, self.snapshot_dir, pause=0, tracker=self.tracker
+        )
+        return files
+
+    def insert(self, conn, price):
+        with conn:
+            conn.execute(db.UPSERT_SQL, ("BTC", price, 60000, "binance"))
+
+    def snapshot_price(self):
+        path = os.path.join(self.snapshot_dir, "crypto.db")
+        with sqlite3.connect(f"file:{path}?immutable=1", uri=True) as conn:
+            return conn.execute("SELECT price FROM crypto_prices").fetchone()[0]
+
+    def test_unchanged_databases_are_not_copied_again(self):
+        db.ensure_unique_index(self.conn)
+        self.insert(self.conn, 100.0)
+        self.assertEqual(self.publish(), 1)
+        self.assertEqual(self.publish(), 0)
+
+        self.insert(self.conn, 101.0)
+        self.assertEqual(self.publish(), 1)
+        self.assertEqual(self.snapshot_price(), 101.0)
+        self.assertEqual(self.publish(), 0)
+
+        os.remove(os.path.join(self.snapshot_dir, "crypto.db"))
+        self.assertEqual(self.publish(), 1)
+
+    def test_shards_are_tracked_separately(self):
+        shard_path = os.path.join(self.shard_dir, "BTC.db")
+        shard = db.connect(shard_path)
+        db.migrate(shard)
+        self.assertEqual(self.publish(), 2)
+
+        db.ensure_unique_index(shard)
+        self.insert(shard, 100.0)
+        self.assertEqual(self.publish(), 1)
+
+        # Purged and recreated under the same name
+        shard.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(shard_path + suffix):
+                os.remove(shard_path + suffix)
+        self.assertEqual(self.publish(), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.snapshot_dir, "shards", "BTC.db")))
+        shard = db.connect(shard_path)
+        self.addCleanup(shard.close)
+        db.migrate(shard)
+        self.assertEqual(self.publish(), 1)
+
+    def test_without_a_tracker_everything_is_copied(self):
+        snapshot.publish_all(self.db_path, None, self.snapshot_dir, pause=0)
+        files, _, _ = snapshot.publish_all(self.db_path, None, self.snapshot_dir, pause=0)
+        self.assertEqual(files, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
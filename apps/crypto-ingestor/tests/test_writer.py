@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+
+import db
+import main
+from tests.test_db import connect
+
+ROWS = [("BTC", 100.0 + i, 1704067200000 + i * 1000, "binance") for i in range(5)]
+
+
+class BatchWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = connect(self)
+        db.migrate(self.conn)
+        db.ensure_unique_index(self.conn)
+        self.flushed = []
+        self.writer = main.BatchWriter(
+            self.conn, batch_size=3, flush_interval=60,
+            on_flush=lambda files, committed: self.flushed.append((files, committed)),
+        )
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def drop(self, name):
+        path = os.path.join(self.dir, name)
+        open(path, "w").close()
+        st = os.stat(path)
+        return path, (name, st.st_size, st.st_mtime_ns)
+
+    def stored(self):
+        return self.conn.execute("SELECT symbol, price, timestamp, source FROM crypto_prices ORDER BY id").fetchall()
+
+    def test_commits_in_batches_of_batch_size(self):
+        for row in ROWS:
+            self.writer.add(row)
+        self.assertEqual(self.stored(), ROWS[:3])
+        self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual(self.stored(), ROWS)
+
+    def test_a_file_is_acked_once_its_last_row_commits(self):
+        path, key = self.drop("a.json")
+        for row in ROWS[:2]:
+            self.writer.add(row, path)
+        self.writer.finish_file(main.FileDone(path, key, 2))
+        # Rows still pending: the file waits for the batch
+        self.assertTrue(os.path.exists(path))
+
+        self.writer.flush()
+
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(db.in_ledger(self.conn, key))
+        self.assertEqual(self.flushed, [({path}, True)])
+
+    def test_push_ack_resolves_on_commit(self):
+        ack = main.Ack(2)
+        self.writer.add(ROWS[0], ack=ack)
+        self.writer.add(ROWS[1], ack=ack)
+        self.assertFalse(ack.event.is_set())
+        self.writer.flush()
+        self.assertTrue(ack.wait(0))
+
+    def test_a_poison_file_is_quarantined_and_the_rest_commit(self):
+        good, good_key = self.drop("good.json")
+        bad, bad_key = self.drop("bad.json")
+        quarantined = []
+        original = main.quarantine
+        main.quarantine = lambda filepath, key, error, records: quarantined.append(filepath)
+        self.addCleanup(setattr, main, "quarantine", original)
+
+        self.writer.add(ROWS[0], good)
+        self.writer.add(("BTC", 1.0, 2**64, "binance"), bad)
+        self.writer.finish_file(main.FileDone(good, good_key, 1))
+        self.writer.finish_file(main.FileDone(bad, bad_key, 1))
+        self.writer.flush()
+
+        self.assertEqual(self.stored(), ROWS[:1])
+        self.assertEqual(quarantined, [bad])
+        self.assertFalse(os.path.exists(good))
+        self.assertTrue(db.in_ledger(self.conn, good_key))
+        self.assertFalse(db.in_ledger(self.conn, bad_key))
+
+
+if __name__ == "__main__":
+    unittest.main()
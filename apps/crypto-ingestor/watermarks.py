@@ -0,0 +1,133 @@
+import os
+import json
+import bisect
+import threading
+
+
+# What the database holds for each (symbol, source), so collectors can
+# backfill only what is missing instead of re-downloading whole windows.
+# Points of one key no more than gap_ms apart form a covered range; the
+# ranges are tracked for the last window_ms, and the newest timestamp ever
+# seen is the key's watermark. Published as:
+#
+#   {"updated_at": ms, "gap_ms": 120000, "window_start": ms,
+#    "symbols": {"BTC": {"binance-api": {
+#        "first": ms,            # start of the oldest tracked range (null if none)
+#        "watermark": ms,        # newest point
+#        "gaps": [[ms, ms]]      # no points strictly between the two timestamps
+#    }}}}
+#
+# Covered time is [first, watermark] minus the gaps.
+
+
+class Watermarks:
+    def __init__(self, gap_ms, window_ms):
+        self.gap_ms = gap_ms
+        self.window_ms = window_ms
+        self.watermarks = {}
+        self.starts = {}
+        self.ranges = {}
+        self.changed = False
+        self.lock = threading.Lock()
+
+    def update(self, rows, now_ms):
+        """Apply committed (symbol, price, timestamp, source) rows."""
+        cutoff = now_ms - self.window_ms
+        by_key = {}
+        for symbol, _, timestamp, source in rows:
+            by_key.setdefault((symbol, source), []).append(timestamp)
+        with self.lock:
+            for key, timestamps in by_key.items():
+                newest = max(timestamps)
+                if newest > self.watermarks.get(key, newest - 1):
+                    self.watermarks[key] = newest
+                starts = self.starts.setdefault(key, [])
+                ranges = self.ranges.setdefault(key, [])
+                for timestamp in sorted(timestamps):
+                    if timestamp >= cutoff:
+                        self._add(starts, ranges, timestamp)
+            self.changed = True
+
+    def _add(self, starts, ranges, timestamp):
+        i = bisect.bisect_right(starts, timestamp) - 1
+        if i >= 0 and timestamp <= ranges[i][1] + self.gap_ms:
+            ranges[i][1] = max(ranges[i][1], timestamp)
+        elif i + 1 < len(ranges) and ranges[i + 1][0] - timestamp <= self.gap_ms:
+            i += 1
+            ranges[i][0] = starts[i] = timestamp
+        else:
+            i += 1
+            starts.insert(i, timestamp)
+            ranges.insert(i, [timestamp, timestamp])
+        # The point may have closed the gap to the next range
+        if i + 1 < len(ranges) and ranges[i + 1][0] - ranges[i][1] <= self.gap_ms:
+            ranges[i][1] = max(ranges[i][1], ranges[i + 1][1])
+            del starts[i + 1], ranges[i + 1]
+
+    def load(self, conn, now_ms):
+        """Seed the ranges from the window's rows, one symbol at a time over its index."""
+        symbols = [row[0] for row in conn.execute("SELECT DISTINCT symbol FROM price_rollups WHERE interval = '1d'")]
+        for symbol in symbols:
+            cur = conn.execute("""
+                SELECT symbol, NULL, timestamp, source FROM crypto_prices
+                WHERE symbol = ? AND timestamp >= ? ORDER BY timestamp
+            """, (symbol, now_ms - self.window_ms))
+            while True:
+                rows = cur.fetchmany(10000)
+                if not rows:
+                    break
+                self.update(rows, now_ms)
+
+    def restore(self, path):
+        """Keep the watermarks of a previous run's file, for keys with nothing in the window."""
+        try:
+            with open(path) as f:
+                published = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self.lock:
+            for symbol, sources in published.get("symbols", {}).items():
+                for source, entry in sources.items():
+                    key = (symbol, source)
+                    if entry.get("watermark") is not None and key not in self.watermarks:
+                        self.watermarks[key] = entry["watermark"]
+
+    def forget(self, symbol):
+        with self.lock:
+            for key in [key for key in self.watermarks if key[0] == symbol]:
+                self.watermarks.pop(key, None)
+                self.starts.pop(key, None)
+                self.ranges.pop(key, None)
+            self.changed = True
+
+    def get(self, now_ms, symbol=None):
+        """The published document (see above), after dropping ranges older than the window."""
+        cutoff = now_ms - self.window_ms
+        symbols = {}
+        with self.lock:
+            for key, ranges in self.ranges.items():
+                keep = next((i for i, (_, end) in enumerate(ranges) if end >= cutoff), len(ranges))
+                if keep:
+                    del self.starts[key][:keep], ranges[:keep]
+            for (key_symbol, source), watermark in sorted(self.watermarks.items()):
+                if symbol is not None and key_symbol != symbol:
+                    continue
+                ranges = self.ranges.get((key_symbol, source), [])
+                symbols.setdefault(key_symbol, {})[source] = {
+                    "first": ranges[0][0] if ranges else None,
+                    "watermark": watermark,
+                    "gaps": [[a[1], b[0]] for a, b in zip(ranges, ranges[1:])],
+                }
+        return {"updated_at": now_ms, "gap_ms": self.gap_ms, "window_start": cutoff, "symbols": symbols}
+
+    def write(self, path, now_ms):
+        """Write get() to path through a temporary file, if anything changed since the last write."""
+        with self.lock:
+            if not self.changed:
+                return False
+            self.changed = False
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.get(now_ms), f, separators=(",", ":"))
+        os.replace(tmp, path)
+        return True
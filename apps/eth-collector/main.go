@@ -1,13 +1,16 @@
 package main
 
 import (
+	"encoding/binary"
 	"encoding/json"
 	"fmt"
 	"io"
 	"log"
+	"math"
 	"net/http"
 	"os"
 	"path/filepath"
+	"sort"
 	"strconv"
 	"strings"
 	"time"
@@ -74,6 +77,15 @@ var (
 		},
 		[]string{"service", "status"},
 	)
+
+	apiCallDuration = prometheus.NewHistogramVec(
+		prometheus.HistogramOpts{
+			Name:    "eth_collector_api_call_duration_seconds",
+			Help:    "API call latency to external services in seconds",
+			Buckets: []float64{.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10},
+		},
+		[]string{"service"},
+	)
 )
 
 func init() {
@@ -84,6 +96,7 @@ func init() {
 	prometheus.MustRegister(dataCollectionTotal)
 	prometheus.MustRegister(dataCollectionErrors)
 	prometheus.MustRegister(apiCallsTotal)
+	prometheus.MustRegister(apiCallDuration)
 
 	// Set service as up on startup
 	serviceUp.Set(1)
@@ -136,7 +149,9 @@ func (c *BinanceClient) GetPrice(symbol string) (float64, error) {
 	pair := fmt.Sprintf("%sUSDT", symbol)
 	url := fmt.Sprintf("%s/api/v3/ticker/price?symbol=%s", c.baseURL, pair)
 	
+	requestStart := time.Now()
 	resp, err := c.httpClient.Get(url)
+	apiCallDuration.WithLabelValues("binance").Observe(time.Since(requestStart).Seconds())
 	if err != nil {
 		apiCallsTotal.WithLabelValues("binance", "error").Inc()
 		return 0, err
@@ -181,7 +196,9 @@ func (c *BinanceClient) GetHistoricalPrices(symbol string, from, to time.Time) (
 	url := fmt.Sprintf("%s/api/v3/klines?symbol=%s&interval=1m&startTime=%d&endTime=%d&limit=500",
 		c.baseURL, pair, startTime, endTime)
 	
+	requestStart := time.Now()
 	resp, err := c.httpClient.Get(url)
+	apiCallDuration.WithLabelValues("binance").Observe(time.Since(requestStart).Seconds())
 	if err != nil {
 		apiCallsTotal.WithLabelValues("binance", "error").Inc()
 		return nil, err
@@ -238,25 +255,158 @@ func (c *BinanceClient) GetHistoricalPrices(symbol string, from, to time.Time) (
 	return prices, nil
 }
 
+// writeSegment stores points in the ingestor's binary segment format
+// (documented in apps/crypto-ingestor/segment.py): a header with the symbol
+// and source tables, then one 20-byte record per point. The file is renamed
+// into place so the ingestor never picks up a partial segment.
+func writeSegment(filename string, points []PriceData) error {
+	var names [2][]string // symbols, sources
+	ids := [2]map[string]uint16{{}, {}}
+	id := func(table int, name string) uint16 {
+		if i, ok := ids[table][name]; ok {
+			return i
+		}
+		ids[table][name] = uint16(len(names[table]))
+		names[table] = append(names[table], name)
+		return ids[table][name]
+	}
+
+	records := make([]byte, 0, 20*len(points))
+	for _, p := range points {
+		records = binary.LittleEndian.AppendUint64(records, uint64(p.Timestamp.UnixMilli()))
+		records = binary.LittleEndian.AppendUint64(records, math.Float64bits(p.Price))
+		records = binary.LittleEndian.AppendUint16(records, id(0, p.Symbol))
+		records = binary.LittleEndian.AppendUint16(records, id(1, p.Source))
+	}
+
+	var tables []byte
+	for _, table := range names {
+		for _, name := range table {
+			tables = append(tables, byte(len(name)))
+			tables = append(tables, name...)
+		}
+	}
+
+	data := []byte("CPS1")
+	data = binary.LittleEndian.AppendUint16(data, 1) // format version
+	data = binary.LittleEndian.AppendUint16(data, 0) // reserved
+	data = binary.LittleEndian.AppendUint32(data, uint32(20+len(tables)))
+	data = binary.LittleEndian.AppendUint32(data, uint32(len(points)))
+	data = binary.LittleEndian.AppendUint16(data, uint16(len(names[0])))
+	data = binary.LittleEndian.AppendUint16(data, uint16(len(names[1])))
+	data = append(append(data, tables...), records...)
+
+	tmp := filename + ".tmp"
+	if err := os.WriteFile(tmp, data, 0644); err != nil {
+		return err
+	}
+	return os.Rename(tmp, filename)
+}
+
+// The ingestor publishes what the database already holds per (symbol,
+// source) in WATERMARKS_PATH (format in apps/crypto-ingestor/watermarks.py).
+// A backfill only downloads the parts of its window that no source covers.
+type sourceCoverage struct {
+	First     *int64     `json:"first"`
+	Watermark int64      `json:"watermark"`
+	Gaps      [][2]int64 `json:"gaps"`
+}
+
+type watermarkIndex struct {
+	Symbols map[string]map[string]sourceCoverage `json:"symbols"`
+}
+
+// klineLimit is the most 1m klines Binance returns per request
+const klineLimit = 500
+
+// missingRanges returns the parts of [from, to) not covered for coin, or
+// ok=false when the watermark file cannot be read. Pieces shorter than one
+// kline are ignored.
+func missingRanges(path, coin string, from, to time.Time) (missing [][2]time.Time, ok bool) {
+	data, err := os.ReadFile(path)
+	if err != nil {
+		return nil, false
+	}
+	var index watermarkIndex
+	if err := json.Unmarshal(data, &index); err != nil {
+		log.Printf("Ignoring unreadable %s: %v", path, err)
+		return nil, false
+	}
+
+	var covered [][2]int64
+	for _, c := range index.Symbols[coin] {
+		if c.First == nil {
+			continue
+		}
+		start := *c.First
+		for _, gap := range c.Gaps {
+			covered = append(covered, [2]int64{start, gap[0]})
+			start = gap[1]
+		}
+		covered = append(covered, [2]int64{start, c.Watermark})
+	}
+	sort.Slice(covered, func(i, j int) bool { return covered[i][0] < covered[j][0] })
+
+	cursor, end := from.UnixMilli(), to.UnixMilli()
+	addMissing := func(a, b int64) {
+		if b-a >= time.Minute.Milliseconds() {
+			missing = append(missing, [2]time.Time{time.UnixMilli(a), time.UnixMilli(b)})
+		}
+	}
+	for _, r := range covered {
+		if cursor >= end {
+			break
+		}
+		if r[0] > cursor {
+			addMissing(cursor, min(r[0], end))
+		}
+		cursor = max(cursor, r[1])
+	}
+	if cursor < end {
+		addMissing(cursor, end)
+	}
+	return missing, true
+}
+
 func backfillHistoricalData(client *BinanceClient, coin string) error {
 
-	pattern := filepath.Join("/data/raw", fmt.Sprintf("%s_*.json", coin))
-	files, _ := filepath.Glob(pattern)
-	if len(files) > 0 {
-		log.Printf("Historical data already exists (%d files), skipping backfill", len(files))
+	to := time.Now()
+	from := to.Add(-backfillWindow())
+
+	missing, indexed := missingRanges(watermarksPath(), coin, from, to)
+	if !indexed {
+		// No index from the ingestor yet: fall back to the old heuristic
+		pattern := filepath.Join("/data/raw", fmt.Sprintf("%s_*.json", coin))
+		files, _ := filepath.Glob(pattern)
+		segments, _ := filepath.Glob(filepath.Join("/data/raw", fmt.Sprintf("%s_*.cps", coin)))
+		files = append(files, segments...)
+		if len(files) > 0 {
+			log.Printf("Historical data already exists (%d files), skipping backfill", len(files))
+			return nil
+		}
+		missing = [][2]time.Time{{from, to}}
+	}
+	if len(missing) == 0 {
+		log.Printf("Database already covers the last %s, skipping backfill", backfillWindow())
 		return nil
 	}
 
-	log.Println("Backfilling 5 minutes of historical data from Binance...")
-	
+	log.Printf("Backfilling %d missing range(s) of the last %s from Binance...", len(missing), backfillWindow())
 
-	to := time.Now()
-	from := to.Add(-5 * time.Minute)
-	
-	historicalPrices, err := client.GetHistoricalPrices(coin, from, to)
-	if err != nil {
-		log.Printf("Failed to fetch historical data: %v", err)
-		return err
+	var historicalPrices []PriceData
+	for _, r := range missing {
+		for start := r[0]; start.Before(r[1]); start = start.Add(klineLimit * time.Minute) {
+			end := start.Add(klineLimit * time.Minute)
+			if end.After(r[1]) {
+				end = r[1]
+			}
+			prices, err := client.GetHistoricalPrices(coin, start, end)
+			if err != nil {
+				log.Printf("Failed to fetch historical data: %v", err)
+				return err
+			}
+			historicalPrices = append(historicalPrices, prices...)
+		}
 	}
 
 	if len(historicalPrices) == 0 {
@@ -265,27 +415,37 @@ func backfillHistoricalData(client *BinanceClient, coin string) error {
 	}
 
 
-	for _, priceData := range historicalPrices {
-		priceData.Symbol = coin
-		priceData.Source = "binance-historical"
-		
-		filename := fmt.Sprintf("/data/raw/%s_%d.json", coin, priceData.Timestamp.Unix())
-		data, err := json.MarshalIndent(priceData, "", "  ")
-		if err != nil {
-			log.Printf("Error marshaling data: %v", err)
-			continue
-		}
+	for i := range historicalPrices {
+		historicalPrices[i].Symbol = coin
+		historicalPrices[i].Source = "binance-historical"
+	}
 
-		if err := os.WriteFile(filename, data, 0644); err != nil {
-			log.Printf("Error writing file %s: %v", filename, err)
-			continue
-		}
+	// One segment file for the whole backfill instead of a JSON file per kline
+	filename := fmt.Sprintf("/data/raw/%s_%d.cps", coin, to.Unix())
+	if err := writeSegment(filename, historicalPrices); err != nil {
+		log.Printf("Error writing file %s: %v", filename, err)
+		return err
 	}
 
 	log.Printf("Backfilled %d historical data points from Binance", len(historicalPrices))
 	return nil
 }
 
+// backfillWindow is how far back a backfill looks, BACKFILL_MINUTES (default 5)
+func backfillWindow() time.Duration {
+	if minutes, err := strconv.Atoi(os.Getenv("BACKFILL_MINUTES")); err == nil && minutes > 0 {
+		return time.Duration(minutes) * time.Minute
+	}
+	return 5 * time.Minute
+}
+
+func watermarksPath() string {
+	if path := os.Getenv("WATERMARKS_PATH"); path != "" {
+		return path
+	}
+	return "/data/watermarks.json"
+}
+
 func main() {
 	coin := strings.ToUpper(os.Getenv("COIN"))
 	if coin == "" {
@@ -0,0 +1,86 @@
+import os
+import json
+import hashlib
+import threading
+
+
+def sha256(data):
+    if isinstance(data, str):
+        data = data.encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_sha256(path):
+    try:
+        with open(path, "rb") as f:
+            return sha256(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def tree_sha256(directory):
+    """Hash every file under directory (relative paths and contents), in sorted order."""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            digest.update(os.path.relpath(path, directory).encode() + b"\0")
+            with open(path, "rb") as f:
+                digest.update(f.read())
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class BuildCache:
+    """Remembers what ops-cli last rendered, in .ops-cli/cache.json.
+
+    Rendered files are keyed on template source plus context, and the hash of
+    what was written is kept next to the key: a file is skipped only while
+    both match, so a hand-edited or deleted output is rendered again (drift
+    repair).
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.path = os.path.join(base_dir, ".ops-cli", "cache.json")
+        self.lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                self.data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.data = {}
+        self.data.setdefault("files", {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock:
+            content = json.dumps(self.data, indent=2, sort_keys=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(content)
+        os.replace(tmp, self.path)
+
+    def write_file(self, output_path, key, render):
+        """Write render() to output_path unless key and the file on disk are unchanged.
+
+        Returns True if the file was written.
+        """
+        relpath = os.path.relpath(output_path, self.base_dir)
+        entry = self.data["files"].get(relpath)
+        if entry and entry["key"] == key and file_sha256(output_path) == entry["output"]:
+            return False
+        content = render()
+        with open(output_path, "w") as f:
+            f.write(content)
+        with self.lock:
+            self.data["files"][relpath] = {"key": key, "output": sha256(content)}
+        return True
+
+    def forget(self, paths):
+        """Drop entries for removed outputs: the given files and anything below them."""
+        prefixes = [os.path.relpath(path, self.base_dir) for path in paths]
+        with self.lock:
+            files = self.data["files"]
+            for path in [p for p in files if any(p == pre or p.startswith(pre + os.sep) for pre in prefixes)]:
+                del files[path]
@@ -1,14 +1,15 @@
 import os
 import subprocess
 import time
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, StrictUndefined
 import requests
 import json
+from commands import kube
+from commands.dag import Step, run_steps
+from commands.cache import BuildCache, sha256, tree_sha256
 
 def ensure_grafana_token(project_root):
     """Ensure a valid Grafana service account token exists for Terraform"""
-    print(f"\nStep 10a/10: Verifying Grafana authorization...")
-    
     tfvars_path = os.path.join(project_root, "terraform", "grafana", "terraform.tfvars")
     token = None
     
@@ -49,39 +50,36 @@ def ensure_grafana_token(project_root):
     print("   🔄 Generating new Grafana token...")
     try:
         # Get admin credentials
-        user_cmd = "kubectl get secret -n monitoring grafana-admin -o jsonpath='{.data.admin-user}' | base64 -d"
-        pass_cmd = "kubectl get secret -n monitoring grafana-admin -o jsonpath='{.data.admin-password}' | base64 -d"
-        
-        admin_user = subprocess.run(user_cmd, shell=True, capture_output=True, text=True).stdout.strip()
-        admin_pass = subprocess.run(pass_cmd, shell=True, capture_output=True, text=True).stdout.strip()
-        
+        kube_client = kube.client()
+        admin_user = kube_client.secret_value("monitoring", "grafana-admin", "admin-user")
+        admin_pass = kube_client.secret_value("monitoring", "grafana-admin", "admin-password")
+
         if not admin_user or not admin_pass:
             print("   ❌ Could not retrieve Grafana admin credentials")
             return False
 
+        # One keep-alive session for the three Grafana API calls
+        grafana = requests.Session()
+        grafana.auth = (admin_user, admin_pass)
+
         # Create Service Account (idempotent)
-        sa_payload = '{"name":"terraform-provisioner", "role":"Admin"}'
-        create_sa_cmd = f"curl -s -X POST -H 'Content-Type: application/json' -u {admin_user}:{admin_pass} http://localhost:3000/api/serviceaccounts -d '{sa_payload}'"
-        subprocess.run(create_sa_cmd, shell=True, capture_output=True)
+        grafana.post("http://localhost:3000/api/serviceaccounts",
+                     json={"name": "terraform-provisioner", "role": "Admin"}, timeout=5)
 
         # Get Service Account ID
-        get_sa_cmd = f"curl -s -u {admin_user}:{admin_pass} http://localhost:3000/api/serviceaccounts/search"
-        sa_list = subprocess.run(get_sa_cmd, shell=True, capture_output=True, text=True).stdout
-        
-        sas_response = json.loads(sa_list)
+        sas_response = grafana.get("http://localhost:3000/api/serviceaccounts/search", timeout=5).json()
         sas = sas_response.get('serviceAccounts', [])
         sa_id = next((sa['id'] for sa in sas if sa['name'] == 'terraform-provisioner'), None)
-        
+
         if not sa_id:
             print("   ❌ Could not find terraform-provisioner service account")
             return False
 
         # Create Token
-        token_payload = '{"name":"terraform-token-' + str(int(time.time())) + '"}'
-        create_token_cmd = f"curl -s -X POST -H 'Content-Type: application/json' -u {admin_user}:{admin_pass} http://localhost:3000/api/serviceaccounts/{sa_id}/tokens -d '{token_payload}'"
-        token_resp = subprocess.run(create_token_cmd, shell=True, capture_output=True, text=True).stdout
-        
-        new_token = json.loads(token_resp).get('key')
+        token_resp = grafana.post(f"http://localhost:3000/api/serviceaccounts/{sa_id}/tokens",
+                                  json={"name": f"terraform-token-{int(time.time())}"}, timeout=5)
+
+        new_token = token_resp.json().get('key')
         
         if new_token:
             # Save to tfvars
@@ -108,201 +106,293 @@ def run_command(cmd, cwd=None, check=True):
     return result.stdout
 
 def create_service_command(name, coin, service_type):
+    create_services_command([(name, coin, service_type)])
+
+def create_services_command(services):
+    """Provision one or more (name, coin, type) services in a single pass.
+
+    Images build and import concurrently and every file is rendered up front;
+    the batch then shares one git commit, one ArgoCD refresh, one terraform
+    apply and one frontend restart.
+    """
+    names = [name for name, _, _ in services]
     print(f"\n{'='*60}")
-    print(f"IDP: Creating {name} ({service_type}) for {coin}")
-    print(f"{'='*60}\n")
+    if len(services) == 1:
+        name, coin, service_type = services[0]
+        print(f"IDP: Creating {name} ({service_type}) for {coin}")
+    else:
+        print(f"IDP: Creating {len(services)} services: {', '.join(names)}")
+    print(f"{'='*60}")
 
     # Paths
     base_dir = os.getcwd()
     templates_dir = os.path.join(base_dir, "ops-cli", "templates")
-    output_manifests_dir = os.path.join(base_dir, "gitops", "manifests", name)
     output_apps_dir = os.path.join(base_dir, "gitops", "apps")
-    output_code_dir = os.path.join(base_dir, "apps", name)
+    terraform_dir = os.path.join(base_dir, "terraform", "grafana")
     namespace = "default"  # All collectors now run in default namespace
 
-    # Context for templates
-    context = {
-        "name": name,
-        "coin": coin.upper(),
-        "type": service_type,
-        "image": f"diegohnunes/{name}:v2.0",
-        "namespace": namespace
-    }
-
-    # Jinja2 Setup
-    env = Environment(loader=FileSystemLoader(templates_dir))
-
-
-    print("Step 1/10: Generating application code...")
-    os.makedirs(output_code_dir, exist_ok=True)
-    generate_file(env, "main.go.j2", output_code_dir, "main.go", context)
-    generate_file(env, "go.mod.j2", output_code_dir, "go.mod", context)
-    
-
-    dockerfile_src = os.path.join(templates_dir, "Dockerfile")
-    dockerfile_dst = os.path.join(output_code_dir, "Dockerfile")
-    with open(dockerfile_src, 'r') as src, open(dockerfile_dst, 'w') as dst:
-        dst.write(src.read())
-    print(f"   Created Dockerfile")
-
-
-
-    print("\nStep 2/10: Building Docker image...")
-    run_command(f"docker build -t diegohnunes/{name}:v2.0 apps/{name}", cwd=base_dir)
-    print(f"   Image built: diegohnunes/{name}:v2.0")
-
-
-    print("\nStep 3/10: Importing image to k3d...")
-    run_command(f"k3d image import diegohnunes/{name}:v2.0 -c devlab", cwd=base_dir)
-    print(f"   Image imported to k3d")
-
-
-    print(f"\nStep 4/10: Skipping namespace/PV creation (using shared default namespace)...")
-    print(f"   All services use shared crypto-shared-storage-v3 PVC in {namespace} namespace")
-
-
-    print("\nStep 5/10: Generating Kubernetes manifests...")
-    os.makedirs(output_manifests_dir, exist_ok=True)
-    generate_file(env, "deployment.yaml.j2", output_manifests_dir, "deployment.yaml", context)
-    generate_file(env, "service.yaml.j2", output_manifests_dir, "service.yaml", context)
-    generate_file(env, "configmap.yaml.j2", output_manifests_dir, "configmap.yaml", context)
-
-
-    print("\nStep 6/10: Generating ArgoCD application...")
-    os.makedirs(output_apps_dir, exist_ok=True)
-    generate_file(env, "argocd-app.yaml.j2", output_apps_dir, f"{name}.yaml", context)
-
-
-    print("\nStep 7/10: Committing to Git...")
-    run_command("git add .", cwd=base_dir)
-    run_command(f'git commit -m "feat(idp): add {name} service for {coin}"', cwd=base_dir, check=False)
-    run_command("git push origin main", cwd=base_dir)
-    print(f"   Changes pushed to Git")
-
-
-    print("\nStep 8/10: Deploying to Kubernetes via ArgoCD...")
-    run_command(f"kubectl apply -f gitops/apps/{name}.yaml", cwd=base_dir)
-    time.sleep(5) # Wait a bit for ArgoCD to detect the app
-    run_command(f"kubectl -n argocd annotate application {name} argocd.argoproj.io/refresh=hard --overwrite", cwd=base_dir)
-    print(f"   ArgoCD application deployed")
-
-
-    print(f"\nStep 9/10: Waiting for pod to be ready...")
-    print(f"   Timeout: 120 seconds")
-    try:
-        # First wait for deployment to be created by ArgoCD
-        print(f"   Waiting for deployment {name} to be created...")
-        for _ in range(30):
-            check_deploy = run_command(f"kubectl get deployment -n {namespace} {name}", check=False)
-            if "NotFound" not in check_deploy and "not found" not in check_deploy and name in check_deploy:
-                print(f"   Deployment created")
-                break
-            time.sleep(2)
+    # Jinja2 Setup; an undefined name (e.g. Go's {{...}} composite literals
+    # outside a raw block) fails the render instead of printing "Undefined"
+    env = Environment(loader=FileSystemLoader(templates_dir), undefined=StrictUndefined)
+    # Unchanged outputs are not rewritten and unchanged images are not rebuilt
+    cache = BuildCache(base_dir)
+
+    # Outcomes of the non-fatal Grafana steps, read by terraform_apply
+    grafana = {"token": False, "init": False}
+
+    def service_steps(name, coin, service_type):
+        image = f"diegohnunes/{name}:v2.0"
+        output_manifests_dir = os.path.join(base_dir, "gitops", "manifests", name)
+        output_code_dir = os.path.join(base_dir, "apps", name)
+
+        # Context for templates
+        context = {
+            "name": name,
+            "coin": coin.upper(),
+            "type": service_type,
+            "image": f"diegohnunes/{name}:v2.0",
+            "namespace": namespace
+        }
+
+        def generate_code():
+            os.makedirs(output_code_dir, exist_ok=True)
+            generate_file(env, "main.go.j2", output_code_dir, "main.go", context, cache)
+            generate_file(env, "go.mod.j2", output_code_dir, "go.mod", context, cache)
+
+            dockerfile_src = os.path.join(templates_dir, "Dockerfile")
+            dockerfile_dst = os.path.join(output_code_dir, "Dockerfile")
+            with open(dockerfile_src, 'r') as src:
+                dockerfile = src.read()
+            if cache.write_file(dockerfile_dst, sha256(dockerfile), lambda: dockerfile):
+                print(f"   Created Dockerfile")
+            else:
+                print(f"   Unchanged Dockerfile")
+
+        def build_image():
+            # The image is labelled with the hash of its build context, so an
+            # existing image built from identical inputs is reused as is
+            inputs = tree_sha256(output_code_dir)
+            built = subprocess.run(
+                ["docker", "image", "inspect", "--format", '{{ index .Config.Labels "ops-cli.inputs" }}', image],
+                capture_output=True, text=True,
+            ).stdout.strip()
+            if built == inputs:
+                print(f"   Image up to date: {image} (inputs {inputs[:12]})")
+                return
+            run_command(f"docker build --label ops-cli.inputs={inputs} -t {image} apps/{name}", cwd=base_dir)
+            print(f"   Image built: {image}")
+
+        def import_image():
+            # Skip the import when the cluster node already has this exact image
+            image_id = subprocess.run(
+                ["docker", "image", "inspect", "--format", "{{.Id}}", image], capture_output=True, text=True,
+            ).stdout.strip()
+            imported = subprocess.run(
+                ["docker", "exec", "k3d-devlab-server-0", "crictl", "images", "-q", f"docker.io/{image}"],
+                capture_output=True, text=True,
+            ).stdout.split()
+            if image_id and image_id in imported:
+                print(f"   Image already in k3d: {image}")
+                return
+            run_command(f"k3d image import {image} -c devlab", cwd=base_dir)
+            print(f"   Image imported to k3d")
+
+        def render_manifests():
+            # No namespace/PV creation: all services use the shared
+            # crypto-shared-storage-v3 PVC in the default namespace
+            os.makedirs(output_manifests_dir, exist_ok=True)
+            generate_file(env, "deployment.yaml.j2", output_manifests_dir, "deployment.yaml", context, cache)
+            generate_file(env, "service.yaml.j2", output_manifests_dir, "service.yaml", context, cache)
+            generate_file(env, "configmap.yaml.j2", output_manifests_dir, "configmap.yaml", context, cache)
+            os.makedirs(output_apps_dir, exist_ok=True)
+            generate_file(env, "argocd-app.yaml.j2", output_apps_dir, f"{name}.yaml", context, cache)
+            generate_file(env, "dashboard.tf.j2", terraform_dir, f"{name}.tf", context, cache)
+
+        def wait_ready():
+            print(f"   Timeout: 120 seconds")
+            try:
+                # Watches instead of polling: each returns as soon as the
+                # API server reports the change
+                kube_client = kube.client()
+                print(f"   Waiting for deployment {name} to be created...")
+                if kube_client.wait_for_object(kube.DEPLOYMENTS.format(namespace=namespace), name, timeout=60):
+                    print(f"   Deployment created")
+                else:
+                    print(f"   Warning: Deployment not found after 60s")
+
+                # Then wait for pod
+                pod = kube_client.wait_for_ready_pod(namespace, f"app={name}", timeout=120)
+                if pod is None:
+                    raise Exception(f"No ready pod for app={name} after 120s")
+                print(f"   Pod is ready!")
+
+                print(f"\n   Latest logs:")
+                logs = kube_client.pod_logs(namespace, pod["metadata"]["name"], tail=10)
+                for line in logs.split('\n')[:10]:
+                    if line:
+                        print(f"   {line}")
+            except Exception:
+                print(f"   Pod took longer than expected, but deployment is in progress")
+                print(f"   Check status with: kubectl get pods -n {namespace}")
+
+        return [
+            Step(f"generate_code[{name}]", f"Generating application code for {name}...", generate_code),
+            Step(f"build_image[{name}]", f"Building Docker image for {name}...", build_image, [f"generate_code[{name}]"]),
+            Step(f"import_image[{name}]", f"Importing {name} image to k3d...", import_image, [f"build_image[{name}]"]),
+            Step(f"render[{name}]", f"Generating manifests, ArgoCD app and dashboard for {name}...", render_manifests),
+            Step(f"wait_ready[{name}]", f"Waiting for {name} pod to be ready...", wait_ready, ["deploy"]),
+        ]
+
+    def check_grafana_token():
+        grafana["token"] = ensure_grafana_token(base_dir)
+        if not grafana["token"]:
+            print("   ⚠️  Dashboard creation will be skipped (Authorization failed)")
+
+    def git_commit():
+        if len(services) == 1:
+            name, coin, _ = services[0]
+            message = f"feat(idp): add {name} service for {coin}"
         else:
-            print(f"   Warning: Deployment not found after 60s")
-
-        # Then wait for pod
-        run_command(f"kubectl wait --for=condition=Ready pod -l app={name} -n {namespace} --timeout=120s", cwd=base_dir)
-        print(f"   Pod is ready!")
-        
-
-        print(f"\nLatest logs:")
-        logs = run_command(f"kubectl logs -n {namespace} -l app={name} --tail=10", cwd=base_dir, check=False)
-        for line in logs.split('\n')[:10]:
-            if line:
-                print(f"   {line}")
-    except:
-        print(f"   Pod took longer than expected, but deployment is in progress")
-        print(f"   Check status with: kubectl get pods -n {namespace}")
-
-
-
-
-    # Step 10/10: Generate and apply Terraform dashboard
-    print("\nStep 10/10: Creating Grafana dashboard with Terraform...")
+            message = f"feat(idp): add {', '.join(names)} services"
+        run_command("git add .", cwd=base_dir)
+        run_command(f'git commit -m "{message}"', cwd=base_dir, check=False)
+        run_command("git push origin main", cwd=base_dir)
+        print(f"   Changes pushed to Git")
+
+    def deploy():
+        kube_client = kube.client()
+        applications = kube.APPLICATIONS.format(namespace="argocd")
+        for name in names:
+            with open(os.path.join(output_apps_dir, f"{name}.yaml")) as f:
+                kube_client.apply(f"{applications}/{name}", f.read())
+            print(f"   Applied gitops/apps/{name}.yaml")
+        # Refresh once ArgoCD has picked the applications up, instead of a fixed sleep
+        deadline = time.monotonic() + 30
+        for name in names:
+            reconciled = kube_client.wait_for_object(
+                applications, name, max(1, deadline - time.monotonic()),
+                predicate=lambda app: app.get("status", {}).get("reconciledAt"),
+            )
+            if not reconciled:
+                print(f"   Warning: ArgoCD has not reconciled {name} after 30s, refreshing anyway")
+        for name in names:
+            kube_client.annotate(applications, name, {"argocd.argoproj.io/refresh": "hard"})
+        print(f"   ArgoCD applications deployed")
+
+    def terraform_init():
+        result = subprocess.run(["terraform", "init"], cwd=terraform_dir, capture_output=True, text=True)
+        grafana["init"] = result.returncode == 0
+        if not grafana["init"]:
+            print(f"   ❌ Terraform init failed: {result.stderr}")
 
-    # Ensure valid token before proceeding
-    if not ensure_grafana_token(base_dir):
-        print("   ⚠️  Skipping dashboard creation (Authorization failed)")
-    else:
-        terraform_dir = os.path.join(base_dir, "terraform", "grafana")
-        # os.makedirs(terraform_dir, exist_ok=True) - Not needed for root dir
+    def terraform_apply():
+        if not grafana["token"]:
+            print("   ⚠️  Skipping dashboard creation (Authorization failed)")
+            return
+        if not grafana["init"]:
+            print(f"   ⚠️  Dashboard creation skipped (terraform init failed).")
+            print(f"   ℹ️  Service is operational")
+            print(f"   ℹ️  Create dashboard manually later if needed")
+            return
 
-        # Generate Terraform file from template
-        dashboard_tf_path = os.path.join(terraform_dir, f"{name}.tf")
-        generate_file(env, "dashboard.tf.j2", terraform_dir, f"{name}.tf", context)
+        print("   Applying Terraform configuration...")
+        # Resource name in template uses underscores (e.g. btc_collector_apm)
+        # but name variable has hyphens (e.g. btc-collector)
+        targets = [f"-target=grafana_dashboard.{name.replace('-', '_')}_apm" for name in names]
 
-        # Apply Terraform
-        print("   Initializing Terraform...")
         result = subprocess.run(
-            ["terraform", "init"],
-            cwd=os.path.join(base_dir, "terraform", "grafana"),
+            ["terraform", "apply", "-auto-approve"] + targets,
+            cwd=terraform_dir,
             capture_output=True,
             text=True,
         )
-        if result.returncode != 0:
-            print(f"   ❌ Terraform init failed: {result.stderr}")
-            print(f"   ⚠️  Dashboard creation skipped.")
-            print(f"   ℹ️  Service is operational")
-            print(f"   ℹ️  Create dashboard manually later if needed")
-        else:
-            print("   Applying Terraform configuration...")
-            # Resource name in template uses underscores (e.g. btc_collector_apm)
-            # but name variable has hyphens (e.g. btc-collector)
-            tf_resource_name = f"grafana_dashboard.{name.replace('-', '_')}_apm"
-            
-            result = subprocess.run(
-                ["terraform", "apply", "-auto-approve", f"-target={tf_resource_name}"],
-                cwd=os.path.join(base_dir, "terraform", "grafana"),
-                capture_output=True,
-                text=True,
-            )
 
-            if result.returncode != 0:
-                if "Connection refused" in result.stderr:
-                     print(f"   ⚠️  Grafana not accessible on localhost:3000")
-                     print(f"   ℹ️  Dashboard config created but not applied")
-                     print(f"   ℹ️  Run manually: cd terraform/grafana && terraform apply")
-                else:
-                     print(f"   ⚠️  Dashboard creation skipped: {result.stderr.splitlines()[0] if result.stderr else 'Unknown error'}")
-                     print(f"   ℹ️  Service is operational")
-                     print(f"   ℹ️  Create dashboard manually later if needed")
+        if result.returncode != 0:
+            if "Connection refused" in result.stderr:
+                 print(f"   ⚠️  Grafana not accessible on localhost:3000")
+                 print(f"   ℹ️  Dashboard config created but not applied")
+                 print(f"   ℹ️  Run manually: cd terraform/grafana && terraform apply")
             else:
+                 print(f"   ⚠️  Dashboard creation skipped: {result.stderr.splitlines()[0] if result.stderr else 'Unknown error'}")
+                 print(f"   ℹ️  Service is operational")
+                 print(f"   ℹ️  Create dashboard manually later if needed")
+        else:
+            for name in names:
                 print(f"   ✅ Grafana dashboard created: {name}-apm")
 
+    def restart_frontend():
+        kube.client().rollout_restart(namespace, "crypto-frontend")
+        print("   Frontend restarted (SQLite cache will be refreshed)")
+
+    # Independent steps run side by side: image builds overlap with each
+    # other, with rendering and with the Grafana token check, and terraform
+    # init overlaps with the rollout. terraform init waits for the commit so
+    # its .terraform/ directory is never swept up by "git add ."
+    steps = []
+    for name, coin, service_type in services:
+        steps.extend(service_steps(name, coin, service_type))
+    steps += [
+        Step("grafana_token", "Verifying Grafana authorization...", check_grafana_token),
+        Step("git_commit", "Committing to Git...", git_commit,
+             [f"{kind}[{name}]" for name in names for kind in ("generate_code", "render")]),
+        Step("deploy", "Deploying to Kubernetes via ArgoCD...", deploy,
+             ["git_commit"] + [f"import_image[{name}]" for name in names]),
+        Step("terraform_init", "Initializing Terraform...", terraform_init, ["git_commit"]),
+        Step("terraform_apply", "Creating Grafana dashboards with Terraform...", terraform_apply,
+             ["terraform_init", "grafana_token"] + [f"render[{name}]" for name in names]),
+        Step("restart_frontend", "Restarting frontend to refresh cache...", restart_frontend,
+             [f"wait_ready[{name}]" for name in names]),
+    ]
+    try:
+        failed = run_steps(steps)
+    finally:
+        cache.save()
+    if failed:
+        raise Exception(f"Provisioning failed at: {', '.join(failed)}")
+
+    for name, coin, service_type in services:
+        print(f"\n{'='*60}")
+        print(f"IDP: Service {name} created successfully!")
+        print(f"{'='*60}")
+        print(f"\nSummary:")
+        print(f"   • Application: {name}")
+        print(f"   • Coin: {coin}")
+        print(f"   • Namespace: {namespace}")
+        print(f"   • Image: diegohnunes/{name}:v2.0")
+        print(f"   • Code: apps/{name}/main.go")
+        print(f"   • Manifests: gitops/manifests/{name}/")
+        print(f"   • ArgoCD: gitops/apps/{name}.yaml")
+        print(f"   • Dashboard: http://localhost:3000/d/{name}-apm")
 
-    # Step 11/11: Restart frontend to ensure new data is visible
-    print("\nStep 11/11: Restarting frontend to refresh cache...")
-    run_command(f"kubectl rollout restart deployment/crypto-frontend -n {namespace}")
-    print("   Frontend restarted (SQLite cache will be refreshed)")
-
-    print(f"\n{'='*60}")
-    print(f"IDP: Service {name} created successfully!")
-    print(f"{'='*60}")
-    print(f"\nSummary:")
-    print(f"   • Application: {name}")
-    print(f"   • Coin: {coin}")
-    print(f"   • Namespace: {namespace}")
-    print(f"   • Image: diegohnunes/{name}:v2.0")
-    print(f"   • Code: apps/{name}/main.go")
-    print(f"   • Manifests: gitops/manifests/{name}/")
-    print(f"   • ArgoCD: gitops/apps/{name}.yaml")
-    print(f"   • Dashboard: http://localhost:3000/d/{name}-apm")
-    
     print(f"\nUseful commands:")
     print(f"   kubectl get pods -n {namespace}")
-    print(f"   kubectl logs -n {namespace} -l app={name} -f")
+    for name in names:
+        print(f"   kubectl logs -n {namespace} -l app={name} -f")
     print(f"   curl http://localhost:4000/api/prices")
-    
+
     print(f"\nTo remove:")
-    print(f"   python ops-cli/main.py rm-service {name} {coin} {service_type}")
+    if len(services) == 1:
+        name, coin, service_type = services[0]
+        print(f"   python ops-cli/main.py rm-service {name} {coin} {service_type}")
+    else:
+        print(f"   python ops-cli/main.py rm-services " + " ".join(f"{n}:{c}:{t}" for n, c, t in services))
     print("")
 
-def generate_file(env, template_name, output_dir, output_filename, context):
+def generate_file(env, template_name, output_dir, output_filename, context, cache=None):
     template = env.get_template(template_name)
-    content = template.render(context)
     output_path = os.path.join(output_dir, output_filename)
-    
+
+    if cache is not None:
+        # Keyed on the template source and the context it is rendered with
+        source = env.loader.get_source(env, template_name)[0]
+        key = sha256(source + json.dumps(context, sort_keys=True))
+        if cache.write_file(output_path, key, lambda: template.render(context)):
+            print(f"   Created {output_filename}")
+        else:
+            print(f"   Unchanged {output_filename}")
+        return
+
+    content = template.render(context)
     with open(output_path, "w") as f:
         f.write(content)
     print(f"   Created {output_filename}")
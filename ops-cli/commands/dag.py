@@ -0,0 +1,134 @@
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class Step:
+    """A unit of work that may start once every step in `deps` has succeeded."""
+
+    def __init__(self, name, title, func, deps=()):
+        self.name = name
+        self.title = title
+        self.func = func
+        self.deps = tuple(deps)
+
+
+class StepOutput:
+    """Collects print() output per step thread so concurrent steps don't interleave.
+
+    Each step's output is written out in one piece when the step finishes.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffers = {}
+
+    def write(self, text):
+        buffer = self.buffers.get(threading.get_ident())
+        if buffer is None:
+            return self.stream.write(text)
+        buffer.append(text)
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def take(self, ident):
+        return "".join(self.buffers.pop(ident, []))
+
+
+def run_steps(steps, max_workers=4):
+    """Run steps concurrently in dependency order.
+
+    A step whose dependency failed (or was skipped) is skipped. Prints each
+    step's output as it completes and a timing table at the end. Returns the
+    names of the steps that failed or were skipped.
+    """
+    by_name = {step.name: step for step in steps}
+    for step in steps:
+        missing = [dep for dep in step.deps if dep not in by_name]
+        if missing:
+            raise ValueError(f"Step {step.name} depends on unknown steps: {', '.join(missing)}")
+
+    status = {}
+    timings = {}
+    pending = list(steps)
+    running = {}
+    output = StepOutput(sys.stdout)
+    started = time.monotonic()
+
+    def execute(step):
+        ident = threading.get_ident()
+        output.buffers[ident] = []
+        began = time.monotonic()
+        error = None
+        try:
+            step.func()
+        except Exception as e:
+            error = e
+        return output.take(ident), error, time.monotonic() - began
+
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while pending or running:
+                for step in list(pending):
+                    if any(status.get(dep) in ("failed", "skipped") for dep in step.deps):
+                        pending.remove(step)
+                        status[step.name] = "skipped"
+                        output.stream.write(f"\n{step.title}\n   ⏭️  Skipped (a step it depends on did not succeed)\n")
+                    elif all(status.get(dep) == "ok" for dep in step.deps):
+                        pending.remove(step)
+                        running[pool.submit(execute, step)] = step
+                if not running:
+                    if pending:
+                        raise ValueError(f"Dependency cycle among steps: {', '.join(s.name for s in pending)}")
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    text, error, elapsed = future.result()
+                    timings[step.name] = elapsed
+                    output.stream.write(f"\n{step.title}\n{text}")
+                    if error is None:
+                        status[step.name] = "ok"
+                    else:
+                        status[step.name] = "failed"
+                        output.stream.write(f"   ❌ {error}\n")
+                    output.stream.flush()
+    finally:
+        sys.stdout = output.stream
+
+    print_timings(steps, status, timings, time.monotonic() - started)
+    return [step.name for step in steps if status[step.name] != "ok"]
+
+
+def print_timings(steps, status, timings, total):
+    print("\nStep timings:")
+    width = max([len(step.name) for step in steps] + [len("total (wall clock)")])
+    for step in steps:
+        elapsed = timings.get(step.name)
+        duration = f"{elapsed:7.1f}s" if elapsed is not None else "       -"
+        print(f"   {step.name:<{width}}  {duration}  {status[step.name]}")
+    print(f"   {'total (wall clock)':<{width}}  {total:7.1f}s  (steps summed: {sum(timings.values()):.1f}s)")
+
+
+def wait_for(check, timeout, initial=0.5, maximum=5.0, factor=2.0):
+    """Call check() until it returns a truthy value, backing off between tries.
+
+    Starts polling after `initial` seconds and doubles the delay up to
+    `maximum`, so a condition that is met quickly is noticed quickly. Returns
+    the value check() returned, or None once `timeout` seconds have passed.
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial
+    while True:
+        result = check()
+        if result:
+            return result
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(delay, remaining))
+        delay = min(delay * factor, maximum)
@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import atexit
+import base64
+import shutil
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+APPLICATIONS = "/apis/argoproj.io/v1alpha1/namespaces/{namespace}/applications"
+DEPLOYMENTS = "/apis/apps/v1/namespaces/{namespace}/deployments"
+SERVICES = "/api/v1/namespaces/{namespace}/services"
+CONFIGMAPS = "/api/v1/namespaces/{namespace}/configmaps"
+SECRETS = "/api/v1/namespaces/{namespace}/secrets"
+PODS = "/api/v1/namespaces/{namespace}/pods"
+
+
+class KubeError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class KubeClient:
+    """Kubernetes API client on one keep-alive requests.Session.
+
+    Every call reuses the pooled TLS connection instead of spawning kubectl,
+    which re-reads the kubeconfig and handshakes each time. `server` can be
+    any base URL, e.g. a local fake API server.
+    """
+
+    def __init__(self, server, verify=True, cert=None, token=None, session=None):
+        self.server = server.rstrip("/")
+        self.session = session or requests.Session()
+        # Steps run on several threads; let each keep its own connection
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=8))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=8))
+        self.session.verify = verify
+        self.session.cert = cert
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+    @classmethod
+    def from_kubeconfig(cls, context=None):
+        """Build a client for the current kubeconfig context.
+
+        kubectl resolves the kubeconfig once (merging KUBECONFIG files and
+        flattening credentials); everything after that is plain HTTPS.
+        """
+        cmd = ["kubectl", "config", "view", "--raw", "--minify", "--flatten", "-o", "json"]
+        if context:
+            cmd += ["--context", context]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise KubeError(None, f"cannot read kubeconfig: {result.stderr.strip()}")
+        config = json.loads(result.stdout)
+        cluster = config["clusters"][0]["cluster"]
+        user = config["users"][0].get("user", {})
+        if "exec" in user or "auth-provider" in user:
+            raise KubeError(None, "exec/auth-provider kubeconfig credentials are not supported")
+
+        # requests wants certificates as files
+        certs_dir = tempfile.mkdtemp(prefix="ops-cli-kube-")
+        atexit.register(shutil.rmtree, certs_dir, True)
+
+        def materialize(data, filename):
+            path = os.path.join(certs_dir, filename)
+            with open(path, "wb") as f:
+                f.write(base64.b64decode(data))
+            return path
+
+        if cluster.get("insecure-skip-tls-verify"):
+            verify = False
+        elif "certificate-authority-data" in cluster:
+            verify = materialize(cluster["certificate-authority-data"], "ca.crt")
+        else:
+            verify = True
+        cert = None
+        if "client-certificate-data" in user:
+            cert = (materialize(user["client-certificate-data"], "client.crt"),
+                    materialize(user["client-key-data"], "client.key"))
+        return cls(cluster["server"], verify=verify, cert=cert, token=user.get("token"))
+
+    def request(self, method, path, missing_ok=False, **kwargs):
+        kwargs.setdefault("timeout", 30)
+        response = self.session.request(method, self.server + path, **kwargs)
+        if response.status_code == 404 and missing_ok:
+            return None
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("message", response.text)
+            except ValueError:
+                message = response.text
+            raise KubeError(response.status_code, message)
+        if response.headers.get("Content-Type", "").startswith("application/json"):
+            return response.json()
+        return response.text
+
+    def get(self, path, missing_ok=False, **params):
+        return self.request("GET", path, missing_ok=missing_ok, params=params or None)
+
+    def merge_patch(self, path, body, missing_ok=False):
+        return self.request("PATCH", path, missing_ok=missing_ok, data=json.dumps(body),
+                            headers={"Content-Type": "application/merge-patch+json"})
+
+    def apply(self, path, manifest, field_manager="ops-cli"):
+        """Server-side apply of a YAML or JSON manifest (kubectl apply --server-side)."""
+        return self.request("PATCH", path, data=manifest,
+                            params={"fieldManager": field_manager, "force": "true"},
+                            headers={"Content-Type": "application/apply-patch+yaml"})
+
+    def delete(self, path, missing_ok=True, grace_period=None):
+        params = {"gracePeriodSeconds": grace_period} if grace_period is not None else None
+        return self.request("DELETE", path, missing_ok=missing_ok, params=params)
+
+    def watch(self, path, timeout, **params):
+        """Yield (event type, object) from a watch on a collection until timeout."""
+        params.update(watch="1", timeoutSeconds=max(1, int(timeout)), allowWatchBookmarks="false")
+        with self.session.get(self.server + path, params=params, stream=True, timeout=(10, timeout + 10)) as response:
+            if response.status_code >= 400:
+                raise KubeError(response.status_code, response.text)
+            for line in response.iter_lines():
+                if line:
+                    event = json.loads(line)
+                    yield event["type"], event["object"]
+
+    def wait_until(self, path, predicate, timeout, **params):
+        """List path, then watch it until predicate(items) returns a truthy value.
+
+        predicate gets the current objects keyed by name after every change.
+        Returns its result, or None when timeout passes first.
+        """
+        deadline = time.monotonic() + timeout
+        listing = self.get(path, **params)
+        items = {item["metadata"]["name"]: item for item in listing.get("items", [])}
+        version = listing["metadata"].get("resourceVersion")
+        result = predicate(items)
+        while not result:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                for kind, obj in self.watch(path, remaining, resourceVersion=version, **params):
+                    if kind == "ERROR":
+                        # e.g. 410 Gone: our resourceVersion expired, relist
+                        break
+                    version = obj["metadata"].get("resourceVersion", version)
+                    if kind == "DELETED":
+                        items.pop(obj["metadata"]["name"], None)
+                    else:
+                        items[obj["metadata"]["name"]] = obj
+                    result = predicate(items)
+                    if result:
+                        return result
+            except requests.RequestException:
+                pass
+            listing = self.get(path, **params)
+            items = {item["metadata"]["name"]: item for item in listing.get("items", [])}
+            version = listing["metadata"].get("resourceVersion")
+            result = predicate(items)
+        return result
+
+    # Operations used by the ops-cli commands
+
+    def wait_for_object(self, collection, name, timeout, predicate=None):
+        """Wait until object `name` exists in collection (and predicate(obj) holds)."""
+        def ready(items):
+            obj = items.get(name)
+            return obj if obj is not None and (predicate is None or predicate(obj)) else None
+        return self.wait_until(collection, ready, timeout, fieldSelector=f"metadata.name={name}")
+
+    def wait_for_ready_pod(self, namespace, selector, timeout):
+        """Wait until a pod matching the label selector reports Ready; returns the pod."""
+        def ready(items):
+            for pod in items.values():
+                for condition in pod.get("status", {}).get("conditions", []):
+                    if condition["type"] == "Ready" and condition["status"] == "True":
+                        return pod
+            return None
+        return self.wait_until(PODS.format(namespace=namespace), ready, timeout, labelSelector=selector)
+
+    def pod_logs(self, namespace, pod, tail=10):
+        return self.get(f"{PODS.format(namespace=namespace)}/{pod}/log", tailLines=tail)
+
+    def list_pods(self, namespace, selector):
+        return self.get(PODS.format(namespace=namespace), labelSelector=selector).get("items", [])
+
+    def secret_value(self, namespace, name, key):
+        secret = self.get(f"{SECRETS.format(namespace=namespace)}/{name}", missing_ok=True)
+        if not secret or key not in secret.get("data", {}):
+            return None
+        return base64.b64decode(secret["data"][key]).decode()
+
+    def rollout_restart(self, namespace, deployment):
+        """What `kubectl rollout restart` does: bump a pod template annotation."""
+        restarted_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return self.merge_patch(f"{DEPLOYMENTS.format(namespace=namespace)}/{deployment}", {
+            "spec": {"template": {"metadata": {"annotations": {"kubectl.kubernetes.io/restartedAt": restarted_at}}}}
+        })
+
+    def annotate(self, collection, name, annotations, missing_ok=False):
+        return self.merge_patch(f"{collection}/{name}", {"metadata": {"annotations": annotations}}, missing_ok)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def client():
+    """The process-wide KubeClient, created from the kubeconfig on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = KubeClient.from_kubeconfig()
+        return _client
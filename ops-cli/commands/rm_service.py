@@ -1,5 +1,16 @@
 import os
+import shutil
 import subprocess
+from commands import kube
+from commands.cache import BuildCache
+from commands.dag import wait_for
+
+# Admin API of the ingestor, through the API server's service proxy. The
+# proxy authenticates this client with the Authorization header and does not
+# forward it, so the ingestor's token travels in X-Admin-Token instead.
+INGESTOR_ADMIN = f"{kube.SERVICES.format(namespace='default')}/crypto-ingestor:http/proxy/admin"
+ADMIN_SECRET = ("default", "crypto-ingestor-admin", "token")
+PURGE_TIMEOUT = 600
 
 def run_command(cmd, cwd=None, check=True):
     """Execute shell command"""
@@ -13,121 +24,156 @@ def run_command(cmd, cwd=None, check=True):
             print(f"   Command failed (ignoring): {result.stderr.strip()}")
     return result.stdout
 
+def api_call(method, *args, **kwargs):
+    """Call a KubeClient method, logging and ignoring failures like run_command(check=False)"""
+    print(f"   API: {method.__name__} {args[0]}")
+    try:
+        return method(*args, **kwargs)
+    except (kube.KubeError, kube.requests.RequestException) as e:
+        print(f"   Request failed (ignoring): {e}")
+        return None
+
+def admin_headers(kube_client):
+    """X-Admin-Token header for the ingestor, from INGESTOR_ADMIN_TOKEN or its Secret; None if neither is set"""
+    token = os.environ.get("INGESTOR_ADMIN_TOKEN")
+    if not token:
+        try:
+            token = kube_client.secret_value(*ADMIN_SECRET)
+        except (kube.KubeError, kube.requests.RequestException) as e:
+            print(f"   Could not read secret {ADMIN_SECRET[1]}: {e}")
+    return {"X-Admin-Token": token} if token else None
+
 def rm_service_command(name, coin, service_type):
+    rm_services_command([(name, coin, service_type)])
+
+def rm_services_command(services):
+    """Remove one or more (name, coin, type) services.
+
+    Each step covers the whole batch, so removing several services still
+    takes one removal commit, one database cleanup, one frontend restart,
+    one terraform destroy and one dashboard commit.
+    """
+    names = [name for name, _, _ in services]
+    symbols = [coin.upper() for _, coin, _ in services]
     print(f"\n{'='*60}")
-    print(f"IDP: Removing {name} ({service_type}) for {coin}")
+    if len(services) == 1:
+        name, coin, service_type = services[0]
+        print(f"IDP: Removing {name} ({service_type}) for {coin}")
+    else:
+        print(f"IDP: Removing {len(services)} services: {', '.join(names)}")
     print(f"{'='*60}\n")
 
     base_dir = os.getcwd()
     namespace = "default"  # All services now run in default namespace
+    kube_client = kube.client()
+    applications = kube.APPLICATIONS.format(namespace="argocd")
 
 
     # Step 1: Suspend Sync
     print("Step 1/11: Suspending ArgoCD auto-sync...")
-    run_command(f"kubectl patch application {name} -n argocd --type=merge -p '{{\"spec\":{{\"syncPolicy\":null}}}}'", check=False)
+    for name in names:
+        api_call(kube_client.merge_patch, f"{applications}/{name}", {"spec": {"syncPolicy": None}}, missing_ok=True)
     print(f"   ArgoCD auto-sync suspended")
 
     # Step 2: Delete Files & Commit (CRITICAL: Do this before deleting App to prevent recreation by App of Apps)
     print(f"\nStep 2/11: Removing files from Git (to prevent recreation)...")
-    
-    # Delete ArgoCD app file
-    argocd_file = os.path.join(base_dir, "gitops", "apps", f"{name}.yaml")
-    if os.path.exists(argocd_file):
-        os.remove(argocd_file)
-        print(f"   Deleted: gitops/apps/{name}.yaml")
-    
-    # Delete manifests
-    manifests_dir = os.path.join(base_dir, "gitops", "manifests", name)
-    if os.path.exists(manifests_dir):
-        import shutil
-        shutil.rmtree(manifests_dir)
-        print(f"   Deleted: gitops/manifests/{name}/")
-        
-    # Delete app code
-    app_dir = os.path.join(base_dir, "apps", name)
-    if os.path.exists(app_dir):
-        import shutil
-        shutil.rmtree(app_dir)
-        print(f"   Deleted: apps/{name}/")
+
+    for name in names:
+        # Delete ArgoCD app file
+        argocd_file = os.path.join(base_dir, "gitops", "apps", f"{name}.yaml")
+        if os.path.exists(argocd_file):
+            os.remove(argocd_file)
+            print(f"   Deleted: gitops/apps/{name}.yaml")
+
+        # Delete manifests
+        manifests_dir = os.path.join(base_dir, "gitops", "manifests", name)
+        if os.path.exists(manifests_dir):
+            shutil.rmtree(manifests_dir)
+            print(f"   Deleted: gitops/manifests/{name}/")
+
+        # Delete app code
+        app_dir = os.path.join(base_dir, "apps", name)
+        if os.path.exists(app_dir):
+            shutil.rmtree(app_dir)
+            print(f"   Deleted: apps/{name}/")
+
+    # Forget them in the render cache so a later create-service renders afresh
+    cache = BuildCache(base_dir)
+    cache.forget([os.path.join(base_dir, "gitops", "apps", f"{name}.yaml") for name in names]
+                 + [os.path.join(base_dir, "gitops", "manifests", name) for name in names]
+                 + [os.path.join(base_dir, "apps", name) for name in names]
+                 + [os.path.join(base_dir, "terraform", "grafana", f"{name}.tf") for name in names])
+    cache.save()
 
     # Commit and Push
     print(f"   Committing removal to Git...")
     run_command("git add .", cwd=base_dir)
-    run_command(f'git commit -m "feat(idp): remove {name} service"', cwd=base_dir, check=False)
+    run_command(f'git commit -m "feat(idp): remove {", ".join(names)} service{"s" if len(names) > 1 else ""}"', cwd=base_dir, check=False)
     run_command("git push origin main", cwd=base_dir)
     print(f"   ✅ Changes pushed to Git (App of Apps will now prune it)")
 
     # Step 3: Delete ArgoCD App (Manual)
     print("\nStep 3/11: Deleting ArgoCD application...")
-    run_command(f"kubectl delete application -n argocd {name} --wait=false", check=False)
+    for name in names:
+        api_call(kube_client.delete, f"{applications}/{name}")
     print(f"   ArgoCD application deletion triggered")
 
     # Step 4: Delete K8s Resources
     print(f"\nStep 4/11: Deleting Kubernetes resources in {namespace}...")
-    run_command(f"kubectl delete deployment {name} -n {namespace} --wait=false", check=False)
-    run_command(f"kubectl delete service {name} -n {namespace} --wait=false", check=False)
-    run_command(f"kubectl delete configmap {name}-config -n {namespace} --wait=false", check=False)
+    for name in names:
+        api_call(kube_client.delete, f"{kube.DEPLOYMENTS.format(namespace=namespace)}/{name}")
+        api_call(kube_client.delete, f"{kube.SERVICES.format(namespace=namespace)}/{name}")
+        api_call(kube_client.delete, f"{kube.CONFIGMAPS.format(namespace=namespace)}/{name}-config")
     print(f"   Kubernetes resources deletion triggered")
 
     # Step 5: Clean DB
     print(f"\nStep 5/11: Cleaning database records...")
-    # Clean up database entries for this coin
-    cleanup_script = f"""import sqlite3
-import os
+    # The ingestor purges each symbol in small chunks between ingest batches
+    # (POST /admin/purge/<SYMBOL>); reach it through the API server's service proxy
+    headers = admin_headers(kube_client)
+    if headers is None:
+        print(f"   No ingestor admin token (set INGESTOR_ADMIN_TOKEN or create secret {ADMIN_SECRET[1]}), "
+              f"skipping database cleanup")
+        purges = {}
+    else:
+        purges = {symbol: api_call(kube_client.request, "POST", f"{INGESTOR_ADMIN}/purge/{symbol}", headers=headers)
+                  for symbol in symbols}
+    queued = [symbol for symbol, job in purges.items() if job]
+    if headers is not None and not queued:
+        print(f"   Ingestor not reachable (skipping database cleanup)")
 
-db_path = '/data/crypto.db'
-if os.path.exists(db_path):
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM crypto_prices WHERE symbol = ?", ('{coin.upper()}',))
-    deleted = cur.rowcount
-    conn.commit()
-    conn.close()
-    print(f"Deleted {{deleted}} records for {coin.upper()}")
-else:
-    print("Database not found")
-"""
-    
-    # Write cleanup script to temp file
-    import tempfile
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-        f.write(cleanup_script)
-        temp_script = f.name
-    
-    try:
-        # Get ingestor pod name
-        pod_result = run_command(
-            "kubectl get pod -n default -l app=crypto-ingestor -o jsonpath='{.items[0].metadata.name}'",
-            check=False
-        )
-        
-        if pod_result and 'crypto-ingestor' in pod_result:
-            pod_name = pod_result.strip().strip("'")
-            
-            # Copy script to pod
-            run_command(f"kubectl cp {temp_script} default/{pod_name}:/tmp/cleanup.py", check=False)
-            
-            # Execute script
-            result = run_command(
-                f"kubectl exec -n default {pod_name} -- python3 /tmp/cleanup.py",
-                check=False
-            )
-            
-            if "Deleted" in result:
-                print(f"   {result.strip()}")
-            else:
-                print(f"   Database cleanup completed")
+    def purged():
+        try:
+            jobs = kube_client.request("GET", f"{INGESTOR_ADMIN}/purge", headers=headers)
+        except (kube.KubeError, kube.requests.RequestException):
+            return None  # e.g. the ingestor is restarting; poll again
+        finished = True
+        for symbol in queued:
+            job = jobs.get(symbol)
+            if job is None:
+                # Ingestor restarted and lost the job; queue it again
+                api_call(kube_client.request, "POST", f"{INGESTOR_ADMIN}/purge/{symbol}", headers=headers)
+                finished = False
+            elif job["state"] not in ("done", "failed"):
+                print(f"   {symbol}: {job['deleted']}/{job['total'] or '?'} rows ({job['progress']:.0%})")
+                finished = False
+        return jobs if finished else None
+
+    if queued:
+        jobs = wait_for(purged, PURGE_TIMEOUT, initial=0.2, maximum=2.0)
+        if jobs is None:
+            print(f"   Purge still running after {PURGE_TIMEOUT}s; the ingestor will finish it in the background")
         else:
-            print(f"   Ingestor pod not found (skipping database cleanup)")
-    finally:
-        # Clean up temp file
-        import os as os_module
-        if os_module.path.exists(temp_script):
-            os_module.remove(temp_script)
+            for symbol in queued:
+                job = jobs[symbol]
+                if job["state"] == "done":
+                    print(f"   Deleted {job['deleted']} records and {job['rollups_deleted']} rollups for {symbol}")
+                else:
+                    print(f"   Purge of {symbol} failed: {job['error']}")
 
     # Step 6: Restart Frontend
     print(f"\nStep 6/11: Restarting frontend to refresh cache...")
-    run_command("kubectl rollout restart deployment/crypto-frontend -n default", check=False)
+    api_call(kube_client.rollout_restart, "default", "crypto-frontend")
     print(f"   Frontend restarted (SQLite cache will be refreshed)")
 
     # Step 7-8: Skipped (Files already deleted in Step 2)
@@ -135,78 +181,81 @@ else:
     print(f"\nStep 8/11: Files already deleted (Skipped)")
 
     # Step 9: Terraform Destroy
-    print(f"\nStep 9/11: Destroying Grafana dashboard via Terraform...")
-    tf_file = os.path.join(base_dir, "terraform", "grafana", f"{name}.tf")
-    
-    if os.path.exists(tf_file):
-        # Run terraform destroy for this specific dashboard
-        terraform_dir = os.path.join(base_dir, "terraform", "grafana")
-        resource_name = f"grafana_dashboard.{name.replace('-', '_')}_apm"
-        
+    print(f"\nStep 9/11: Destroying Grafana dashboards via Terraform...")
+    terraform_dir = os.path.join(base_dir, "terraform", "grafana")
+    tf_names = [name for name in names if os.path.exists(os.path.join(terraform_dir, f"{name}.tf"))]
+
+    if tf_names:
+        # One targeted destroy for every dashboard in the batch
+        targets = " ".join(f"-target=grafana_dashboard.{name.replace('-', '_')}_apm" for name in tf_names)
+
         try:
             destroy_output = run_command(
-                f"cd {terraform_dir} && terraform destroy -auto-approve -target={resource_name}",
+                f"cd {terraform_dir} && terraform destroy -auto-approve {targets}",
                 check=False
             )
-            
+
             if "Destroy complete!" in destroy_output or "destroyed" in destroy_output.lower():
-                print(f"   ✅ Grafana dashboard destroyed: {name}")
+                print(f"   ✅ Grafana dashboards destroyed: {', '.join(tf_names)}")
             else:
                 print(f"   ⚠️  Dashboard destroy completed (check Grafana to confirm)")
-                
+
         except Exception as e:
             print(f"   ⚠️  Terraform destroy failed (dashboard may not exist): {e}")
-        
-        # Delete the .tf file after destroying
-        os.remove(tf_file)
-        print(f"   Deleted: terraform/grafana/{name}.tf")
+
+        # Delete the .tf files after destroying
+        for name in tf_names:
+            os.remove(os.path.join(terraform_dir, f"{name}.tf"))
+            print(f"   Deleted: terraform/grafana/{name}.tf")
     else:
         print(f"   No Terraform file found (skipping destroy)")
-    
+
     # Also check legacy path
-    tf_legacy = os.path.join(base_dir, "terraform", "grafana", "dashboards", f"{name}.tf")
-    if os.path.exists(tf_legacy):
-        os.remove(tf_legacy)
-        print(f"   Deleted: terraform/grafana/dashboards/{name}.tf")
+    for name in names:
+        tf_legacy = os.path.join(terraform_dir, "dashboards", f"{name}.tf")
+        if os.path.exists(tf_legacy):
+            os.remove(tf_legacy)
+            print(f"   Deleted: terraform/grafana/dashboards/{name}.tf")
 
     # Step 10: Commit Terraform changes
     print(f"\nStep 10/11: Committing Terraform changes to Git...")
     run_command("git add .", cwd=base_dir)
-    run_command(f'git commit -m "feat(idp): remove {name} dashboard"', cwd=base_dir, check=False)
+    run_command(f'git commit -m "feat(idp): remove {", ".join(names)} dashboard{"s" if len(names) > 1 else ""}"', cwd=base_dir, check=False)
     run_command("git push origin main", cwd=base_dir)
     print(f"   Changes pushed to Git")
 
 
     print(f"\nStep 11/11: Post-removal verification...")
     print(f"   Ensuring no resources were recreated by race conditions...")
-    
-    # Verify deployment is gone
-    check_deploy = run_command(f"kubectl get deployment {name} -n {namespace}", check=False)
-    if name in check_deploy and "NotFound" not in check_deploy:
-        print(f"   ⚠️  Deployment {name} reappeared! Deleting again...")
-        run_command(f"kubectl delete deployment {name} -n {namespace} --force --grace-period=0", check=False)
-
-    # Verify ArgoCD App
-    check_app = run_command(f"kubectl get application -n argocd {name}", check=False)
-    if name in check_app and "NotFound" not in check_app:
-        print(f"   ⚠️  ArgoCD app {name} reappeared! Deleting again...")
-        run_command(f"kubectl delete application -n argocd {name} --force --grace-period=0", check=False)
-        
+
+    for name in names:
+        # Verify deployment is gone
+        deployment = f"{kube.DEPLOYMENTS.format(namespace=namespace)}/{name}"
+        if api_call(kube_client.get, deployment, missing_ok=True):
+            print(f"   ⚠️  Deployment {name} reappeared! Deleting again...")
+            api_call(kube_client.delete, deployment, grace_period=0)
+
+        # Verify ArgoCD App
+        if api_call(kube_client.get, f"{applications}/{name}", missing_ok=True):
+            print(f"   ⚠️  ArgoCD app {name} reappeared! Deleting again...")
+            api_call(kube_client.delete, f"{applications}/{name}", grace_period=0)
+
     print(f"   Verification complete.")
 
 
-    print(f"\n{'='*60}")
-    print(f"IDP: Service {name} removed successfully!")
-    print(f"{'='*60}")
-    print(f"\nWhat was deleted:")
-    print(f"   • ArgoCD Application: {name}")
-    print(f"   • Kubernetes Deployment: {name} (namespace: {namespace})")
-    print(f"   • Database Records: {coin.upper()} cryptocurrency data")
-    print(f"   • Grafana Dashboard: {name}-apm")
-    print(f"   • Application Code: apps/{name}/")
-    print(f"   • Manifests: gitops/manifests/{name}/")
-    print(f"   • ArgoCD Config: gitops/apps/{name}.yaml")
-    print(f"   • Terraform Config: terraform/grafana/{name}.tf")
+    for name, coin, service_type in services:
+        print(f"\n{'='*60}")
+        print(f"IDP: Service {name} removed successfully!")
+        print(f"{'='*60}")
+        print(f"\nWhat was deleted:")
+        print(f"   • ArgoCD Application: {name}")
+        print(f"   • Kubernetes Deployment: {name} (namespace: {namespace})")
+        print(f"   • Database Records: {coin.upper()} cryptocurrency data")
+        print(f"   • Grafana Dashboard: {name}-apm")
+        print(f"   • Application Code: apps/{name}/")
+        print(f"   • Manifests: gitops/manifests/{name}/")
+        print(f"   • ArgoCD Config: gitops/apps/{name}.yaml")
+        print(f"   • Terraform Config: terraform/grafana/{name}.tf")
     print(f"\n📊 Frontend restarted to refresh cryptocurrency list")
     print(f"\nAll clean!")
     print("")
@@ -0,0 +1,213 @@
+import os
+import re
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from commands import kube
+
+# Every service is scraped at once through the API server's service proxy;
+# a service that does not answer within the timeout shows as down instead of
+# holding up the table.
+NAMESPACE = "default"
+SCRAPE_TIMEOUT = (0.25, 0.5)  # connect, read
+SCRAPED_TYPES = ("collector", "ingestor")
+QUANTILES = (0.5, 0.9, 0.99)
+
+SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)')
+LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def manifest_label(path, label):
+    """First `label: value` in a manifest, e.g. a Deployment's type or coin label."""
+    try:
+        with open(path) as f:
+            match = re.search(rf'^\s+{label}:\s*"?([^"\s]+)"?\s*$', f.read(), re.MULTILINE)
+    except FileNotFoundError:
+        return None
+    return match.group(1) if match else None
+
+
+def discover_services(base_dir):
+    """(name, type, coin) of every ArgoCD app in gitops/apps with a collector or ingestor Deployment."""
+    apps_dir = os.path.join(base_dir, "gitops", "apps")
+    services = []
+    for filename in sorted(os.listdir(apps_dir)):
+        if not filename.endswith(".yaml"):
+            continue
+        name = filename[:-len(".yaml")]
+        deployment = os.path.join(base_dir, "gitops", "manifests", name, "deployment.yaml")
+        service_type = manifest_label(deployment, "type")
+        if service_type in SCRAPED_TYPES:
+            services.append((name, service_type, manifest_label(deployment, "coin")))
+    return services
+
+
+def parse_metrics(text):
+    """Prometheus text format -> {metric name: [(labels, value), ...]}."""
+    samples = {}
+    for line in text.splitlines():
+        match = SAMPLE_RE.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        try:
+            value = float(value)
+        except ValueError:
+            continue
+        samples.setdefault(name, []).append((dict(LABEL_RE.findall(labels or "")), value))
+    return samples
+
+
+def metric_sum(samples, name):
+    return sum(value for _, value in samples.get(name, []))
+
+
+def histogram_quantile(samples, name, q):
+    """q-quantile of histogram `name` (all label sets merged), interpolated like PromQL."""
+    buckets = {}
+    for labels, value in samples.get(f"{name}_bucket", []):
+        le = float(labels.get("le", "nan"))
+        buckets[le] = buckets.get(le, 0.0) + value
+    bounds = sorted(buckets)
+    if not bounds or buckets[bounds[-1]] == 0:
+        return None
+    rank = q * buckets[bounds[-1]]
+    lower, below = 0.0, 0.0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if bound == float("inf"):
+                return lower
+            return lower + (bound - lower) * (rank - below) / (count - below) if count > below else bound
+        lower, below = bound, count
+    return lower
+
+
+def collector_status(samples, name, now):
+    prefix = name.replace("-", "_")
+    collected = metric_sum(samples, f"{prefix}_data_collection_total")
+    errors = metric_sum(samples, f"{prefix}_data_collection_errors_total")
+    # Rates are averages since the collector started; Go's client exposes its start time
+    started = metric_sum(samples, "process_start_time_seconds")
+    minutes = (now - started) / 60 if started else None
+    return {
+        "collected_per_min": collected / minutes if minutes else None,
+        "errors_per_min": errors / minutes if minutes else None,
+        "error_ratio": errors / (collected + errors) if collected + errors else None,
+        "api_latency": {
+            f"p{int(q * 100)}": histogram_quantile(samples, f"{prefix}_api_call_duration_seconds", q)
+            for q in QUANTILES
+        },
+    }
+
+
+def scrape(kube_client, service):
+    """Fetch one service's /metrics (collectors) or /health (ingestor); never raises."""
+    name, service_type, coin = service
+    path = f"{kube.SERVICES.format(namespace=NAMESPACE)}/{name}:http/proxy"
+    path += "/health" if service_type == "ingestor" else "/metrics"
+    started = time.monotonic()
+    result = {"name": name, "type": service_type, "coin": coin}
+    try:
+        body = kube_client.request("GET", path, timeout=SCRAPE_TIMEOUT)
+    except kube.requests.Timeout:
+        return dict(result, up=False, error="timed out", scrape_seconds=round(time.monotonic() - started, 3))
+    except (kube.KubeError, kube.requests.RequestException) as e:
+        error = f"HTTP {e.status}" if isinstance(e, kube.KubeError) and e.status else type(e).__name__
+        return dict(result, up=False, error=error, scrape_seconds=round(time.monotonic() - started, 3))
+    result["scrape_seconds"] = round(time.monotonic() - started, 3)
+    if service_type == "ingestor":
+        health = body if isinstance(body, dict) else {"status": str(body).strip()}
+        return dict(result, up=True, health=health)
+    return dict(result, up=True, **collector_status(parse_metrics(body), name, time.time()))
+
+
+def collect_status(kube_client, services):
+    if not services:
+        return []
+    with ThreadPoolExecutor(max_workers=min(16, len(services))) as pool:
+        return list(pool.map(lambda service: scrape(kube_client, service), services))
+
+
+def format_number(value, digits=1, scale=1, suffix=""):
+    return "-" if value is None else f"{value * scale:.{digits}f}{suffix}"
+
+
+def format_age(seconds):
+    if seconds is None:
+        return "-"
+    if seconds < 120:
+        return f"{seconds:.0f}s"
+    if seconds < 7200:
+        return f"{seconds / 60:.0f}m"
+    return f"{seconds / 3600:.1f}h"
+
+
+def print_table(results, elapsed):
+    ingestor = next((r for r in results if r["type"] == "ingestor" and r["up"]), None)
+    last_seen = ingestor["health"].get("last_seen", {}) if ingestor else {}
+    now_ms = time.time() * 1000
+
+    header = ["SERVICE", "COIN", "UP", "COLLECTED/MIN", "ERRORS/MIN", "ERR%",
+              "API p50", "API p90", "API p99", "PRICE AGE"]
+    rows = []
+    for r in results:
+        if r["type"] != "collector":
+            continue
+        seen = last_seen.get((r["coin"] or "").upper())
+        age = format_age((now_ms - seen) / 1000) if seen is not None else "-"
+        if not r["up"]:
+            rows.append([r["name"], r["coin"] or "-", "no", "-", "-", "-", "-", "-", "-", age])
+            continue
+        latency = r["api_latency"]
+        rows.append([
+            r["name"], r["coin"] or "-", "yes",
+            format_number(r["collected_per_min"]), format_number(r["errors_per_min"], 2),
+            format_number(r["error_ratio"], 1, 100, "%"),
+            *(format_number(latency[key], 0, 1000, "ms") for key in ("p50", "p90", "p99")),
+            age,
+        ])
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+    for r in results:
+        if r["type"] != "ingestor":
+            continue
+        print()
+        if not r["up"]:
+            print(f"{r['name']}: down ({r['error']})")
+            continue
+        health = r["health"]
+        line = f"{r['name']}: {health.get('status', '?')}"
+        if "backlog_files" in health:
+            line += f", backlog {health['backlog_files']} file(s)"
+            if health["backlog_files"]:
+                line += f", oldest {format_age(health.get('backlog_oldest_file_age_seconds'))}"
+        if health.get("eta_seconds") is not None:
+            line += f", ETA {format_age(health['eta_seconds'])}"
+        print(line)
+
+    for r in results:
+        if r["type"] == "collector" and not r["up"]:
+            print(f"{r['name']}: {r['error']}")
+    print(f"\nScraped {len(results)} service(s) in {elapsed:.2f}s, rates averaged since each collector started")
+
+
+def status_command(server=None, as_json=False):
+    """Show live metrics of every collector and the ingestor defined in gitops.
+
+    server overrides the kubeconfig's API server, e.g. a local stub that
+    serves the /api/v1/namespaces/default/services/<name>:http/proxy/ paths.
+    """
+    services = discover_services(os.getcwd())
+    kube_client = kube.KubeClient(server) if server else kube.client()
+    started = time.monotonic()
+    results = collect_status(kube_client, services)
+    elapsed = time.monotonic() - started
+    if as_json:
+        print(json.dumps({"services": results, "seconds": round(elapsed, 3)}, indent=2))
+    else:
+        print_table(results, elapsed)
+    return 0 if all(r["up"] for r in results) else 1
@@ -1,15 +1,44 @@
 import sys
-from commands.create_service import create_service_command
-from commands.rm_service import rm_service_command
+from commands.create_service import create_service_command, create_services_command
+from commands.rm_service import rm_service_command, rm_services_command
+from commands.status import status_command
+
+def parse_services(args):
+    """Parse `name:coin:type ...` arguments or `--file <path>` into tuples.
+
+    The file lists one service per line as `name coin type` (or
+    `name:coin:type`); blank lines and lines starting with # are ignored.
+    """
+    if len(args) == 2 and args[0] == "--file":
+        with open(args[1]) as f:
+            specs = [line.split("#")[0].strip() for line in f]
+        specs = [spec for spec in specs if spec]
+    else:
+        specs = args
+
+    services = []
+    for spec in specs:
+        parts = spec.replace(":", " ").split()
+        if len(parts) != 3:
+            raise ValueError(f"Invalid service '{spec}', expected <name>:<coin>:<type>")
+        services.append(tuple(parts))
+    names = [name for name, _, _ in services]
+    if len(set(names)) != len(names):
+        raise ValueError("A service is listed more than once")
+    return services
 
 def main():
     if len(sys.argv) < 2:
         print("Usage:")
         print("  python ops-cli/main.py create-service <name> <coin> <type>")
         print("  python ops-cli/main.py rm-service <name> <coin> <type>")
+        print("  python ops-cli/main.py create-services <name>:<coin>:<type> ... | --file <services.txt>")
+        print("  python ops-cli/main.py rm-services <name>:<coin>:<type> ... | --file <services.txt>")
+        print("  python ops-cli/main.py status [--json] [--server <url>]")
         print("\nExamples:")
         print("  python ops-cli/main.py create-service eth-collector eth collector")
         print("  python ops-cli/main.py rm-service eth-collector eth collector")
+        print("  python ops-cli/main.py create-services doge-collector:doge:collector ltc-collector:ltc:collector")
         sys.exit(1)
 
     command = sys.argv[1]
@@ -19,28 +48,58 @@ def main():
             print("Usage: python ops-cli/main.py create-service <name> <coin> <type>")
             print("Example: python ops-cli/main.py create-service eth-collector eth collector")
             sys.exit(1)
-        
+
         name = sys.argv[2]
         coin = sys.argv[3]
         service_type = sys.argv[4]
-        
+
         create_service_command(name, coin, service_type)
-    
+
     elif command == "rm-service":
         if len(sys.argv) != 5:
             print("Usage: python ops-cli/main.py rm-service <name> <coin> <type>")
             print("Example: python ops-cli/main.py rm-service eth-collector eth collector")
             sys.exit(1)
-        
+
         name = sys.argv[2]
         coin = sys.argv[3]
         service_type = sys.argv[4]
-        
+
         rm_service_command(name, coin, service_type)
-    
+
+    elif command in ("create-services", "rm-services"):
+        try:
+            services = parse_services(sys.argv[2:])
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            services = []
+        if not services:
+            print(f"Usage: python ops-cli/main.py {command} <name>:<coin>:<type> ... | --file <services.txt>")
+            print(f"Example: python ops-cli/main.py {command} doge-collector:doge:collector ltc-collector:ltc:collector")
+            sys.exit(1)
+
+        if command == "create-services":
+            create_services_command(services)
+        else:
+            rm_services_command(services)
+
+    elif command == "status":
+        args = sys.argv[2:]
+        as_json = "--json" in args
+        if as_json:
+            args.remove("--json")
+        server = None
+        if len(args) == 2 and args[0] == "--server":
+            server = args[1]
+        elif args:
+            print("Usage: python ops-cli/main.py status [--json] [--server <url>]")
+            print("Example: python ops-cli/main.py status --server http://127.0.0.1:8001  # kubectl proxy")
+            sys.exit(1)
+        sys.exit(status_command(server, as_json))
+
     else:
         print(f"Unknown command: {command}")
-        print("Available commands: create-service, rm-service")
+        print("Available commands: create-service, rm-service, create-services, rm-services, status")
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,109 @@
+import json
+import threading
+from collections import namedtuple
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+Request = namedtuple("Request", "method path query headers body")
+
+
+class FakeAPIServer:
+    """A local stand-in for the Kubernetes API server (and services behind its proxy).
+
+    Routes map (method, path) to a handler called with the Request; it returns
+    (status, body) or (status, body, content type). A dict or list body is
+    sent as JSON, a str as text/plain unless a content type is given, and a
+    generator is streamed one JSON line per item, like a watch. Unrouted
+    paths answer a 404 Status. Every request is recorded in `requests`.
+    """
+
+    def __init__(self, port=0):
+        self.routes = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle_one(self, method):
+                url = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                request = Request(method, url.path, parse_qs(url.query), dict(self.headers),
+                                  self.rfile.read(length).decode() if length else "")
+                with fake.lock:
+                    fake.requests.append(request)
+                    handler = fake.routes.get((method, url.path))
+                if handler is None:
+                    result = (404, {"kind": "Status", "status": "Failure", "reason": "NotFound",
+                                    "message": f"{url.path} not found", "code": 404})
+                else:
+                    result = handler(request)
+                status, body = result[:2]
+                content_type = result[2] if len(result) > 2 else None
+                try:
+                    self.send(status, body, content_type)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def send(self, status, body, content_type):
+                if hasattr(body, "__next__"):
+                    # A watch: chunked JSON lines until the generator ends
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    for item in body:
+                        line = (json.dumps(item) + "\n").encode()
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                        self.wfile.flush()
+                    self.wfile.write(b"0\r\n\r\n")
+                    return
+                if isinstance(body, (dict, list)):
+                    data, content_type = json.dumps(body).encode(), content_type or "application/json"
+                else:
+                    data, content_type = str(body).encode(), content_type or "text/plain; charset=utf-8"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.handle_one("GET")
+
+            def do_POST(self):
+                self.handle_one("POST")
+
+            def do_PATCH(self):
+                self.handle_one("PATCH")
+
+            def do_DELETE(self):
+                self.handle_one("DELETE")
+
+            def log_message(self, format, *args):
+                return
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def route(self, method, path, handler):
+        with self.lock:
+            self.routes[(method, path)] = handler
+
+    def reply(self, method, path, status, body, content_type=None):
+        """Route method and path to a fixed response."""
+        self.route(method, path, lambda request: (status, body, content_type))
+
+    def requests_to(self, method, path):
+        with self.lock:
+            return [r for r in self.requests if r.method == method and r.path == path]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
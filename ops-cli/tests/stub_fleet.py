@@ -0,0 +1,94 @@
+import sys
+import time
+
+from commands import kube
+from tests.fake_apiserver import FakeAPIServer
+
+# Collectors and the ingestor behind a FakeAPIServer's service proxy, for
+# the status tests and for trying `ops-cli status` without a cluster:
+#
+#   cd ops-cli && python -m tests.stub_fleet 8001
+#   cd .. && python ops-cli/main.py status --server http://127.0.0.1:8001
+
+API_BUCKETS = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def proxy_path(name, endpoint):
+    return f"{kube.SERVICES.format(namespace='default')}/{name}:http/proxy/{endpoint}"
+
+
+def collector_metrics(name, collected, errors, uptime, latencies):
+    """A collector's /metrics, with latencies (seconds) observed on the API histogram."""
+    prefix = name.replace("-", "_")
+    lines = [
+        f"process_start_time_seconds {time.time() - uptime}",
+        f'{prefix}_data_collection_total{{symbol="X"}} {collected}',
+        f'{prefix}_data_collection_errors_total{{symbol="X"}} {errors}',
+    ]
+    for bound in API_BUCKETS:
+        count = sum(1 for latency in latencies if latency <= bound)
+        lines.append(f'{prefix}_api_call_duration_seconds_bucket{{endpoint="binance",le="{bound}"}} {count}')
+    lines.append(f'{prefix}_api_call_duration_seconds_bucket{{endpoint="binance",le="+Inf"}} {len(latencies)}')
+    lines.append(f'{prefix}_api_call_duration_seconds_count{{endpoint="binance"}} {len(latencies)}')
+    return "\n".join(lines) + "\n"
+
+
+def ingestor_health(last_seen, backlog=0, oldest=0.0, status="ok"):
+    return {
+        "status": status,
+        "backlog_files": backlog,
+        "backlog_oldest_file_age_seconds": oldest,
+        "last_seen": last_seen,
+    }
+
+
+def serve_collector(api, name, **metrics):
+    api.reply("GET", proxy_path(name, "metrics"), 200, collector_metrics(name, **metrics), "text/plain; version=0.0.4")
+
+
+def serve_ingestor(api, health, name="crypto-ingestor"):
+    api.reply("GET", proxy_path(name, "health"), 200, health)
+
+
+def serve_hung(api, name, endpoint, seconds):
+    """A service that accepts the request and answers after seconds."""
+    def hung(request):
+        time.sleep(seconds)
+        return 200, ""
+    api.route("GET", proxy_path(name, endpoint), hung)
+
+
+def serve_no_endpoints(api, name, endpoint):
+    # What the API server answers for a service without ready pods
+    api.reply("GET", proxy_path(name, endpoint), 503, {
+        "kind": "Status", "code": 503, "message": f'no endpoints available for service "{name}"',
+    })
+
+
+def healthy_fleet(api, services):
+    """Every (name, type, coin) service up; collectors with a few API calls."""
+    now_ms = int(time.time() * 1000)
+    last_seen = {}
+    for name, service_type, coin in services:
+        if service_type == "collector":
+            serve_collector(api, name, collected=600, errors=6, uptime=600, latencies=[0.04] * 90 + [0.2] * 10)
+            last_seen[coin] = now_ms - 5000
+    for name, service_type, _ in services:
+        if service_type == "ingestor":
+            serve_ingestor(api, ingestor_health(last_seen))
+
+
+if __name__ == "__main__":
+    import os
+    from commands.status import discover_services
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8001
+    api = FakeAPIServer(port)
+    healthy_fleet(api, discover_services(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+    with api:
+        print(f"Stub fleet on {api.url}, Ctrl-C to stop")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
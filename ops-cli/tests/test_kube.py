@@ -0,0 +1,159 @@
+import base64
+import json
+import unittest
+
+from commands import kube
+from tests.fake_apiserver import FakeAPIServer
+
+DEPLOYMENTS = kube.DEPLOYMENTS.format(namespace="default")
+PODS = kube.PODS.format(namespace="default")
+MANIFEST = "apiVersion: v1\nkind: ConfigMap\nmetadata:\n  name: btc-collector-config\n"
+
+
+def pod(name, version, ready=False):
+    return {
+        "metadata": {"name": name, "resourceVersion": version},
+        "status": {"conditions": [{"type": "Ready", "status": "True" if ready else "False"}]},
+    }
+
+
+def listing(version, *items):
+    return {"kind": "PodList", "metadata": {"resourceVersion": version}, "items": list(items)}
+
+
+class KubeClientTest(unittest.TestCase):
+    def setUp(self):
+        self.api = FakeAPIServer().__enter__()
+        self.addCleanup(self.api.__exit__, None, None, None)
+        self.client = kube.KubeClient(self.api.url, token="kube-token")
+
+    def test_apply_is_a_server_side_apply_patch(self):
+        path = f"{kube.CONFIGMAPS.format(namespace='default')}/btc-collector-config"
+        self.api.reply("PATCH", path, 200, {"kind": "ConfigMap", "metadata": {"name": "btc-collector-config"}})
+
+        result = self.client.apply(path, MANIFEST)
+
+        self.assertEqual(result["kind"], "ConfigMap")
+        [request] = self.api.requests_to("PATCH", path)
+        self.assertEqual(request.headers["Content-Type"], "application/apply-patch+yaml")
+        self.assertEqual(request.query, {"fieldManager": ["ops-cli"], "force": ["true"]})
+        self.assertEqual(request.body, MANIFEST)
+        self.assertEqual(request.headers["Authorization"], "Bearer kube-token")
+
+    def test_apply_with_another_field_manager(self):
+        path = f"{DEPLOYMENTS}/btc-collector"
+        self.api.reply("PATCH", path, 200, {})
+        self.client.apply(path, MANIFEST, field_manager="argocd-bootstrap")
+        self.assertEqual(self.api.requests_to("PATCH", path)[0].query["fieldManager"], ["argocd-bootstrap"])
+
+    def test_merge_patch(self):
+        path = f"{DEPLOYMENTS}/crypto-frontend"
+        self.api.reply("PATCH", path, 200, {"metadata": {"name": "crypto-frontend"}})
+
+        self.client.rollout_restart("default", "crypto-frontend")
+
+        [request] = self.api.requests_to("PATCH", path)
+        self.assertEqual(request.headers["Content-Type"], "application/merge-patch+json")
+        annotations = json.loads(request.body)["spec"]["template"]["metadata"]["annotations"]
+        self.assertIn("kubectl.kubernetes.io/restartedAt", annotations)
+
+    def test_missing_ok_turns_404_into_none(self):
+        self.assertIsNone(self.client.merge_patch(f"{DEPLOYMENTS}/gone", {"a": 1}, missing_ok=True))
+        self.assertIsNone(self.client.delete(f"{DEPLOYMENTS}/gone"))
+
+    def test_errors_map_to_kube_error_with_the_status_message(self):
+        path = f"{DEPLOYMENTS}/btc-collector"
+        self.api.reply("PATCH", path, 409, {"kind": "Status", "message": "Apply failed with 1 conflict", "code": 409})
+        with self.assertRaises(kube.KubeError) as caught:
+            self.client.apply(path, MANIFEST)
+        self.assertEqual(caught.exception.status, 409)
+        self.assertEqual(str(caught.exception), "409: Apply failed with 1 conflict")
+
+        with self.assertRaises(kube.KubeError) as caught:
+            self.client.get(f"{DEPLOYMENTS}/gone")
+        self.assertEqual(caught.exception.status, 404)
+
+        self.api.reply("GET", "/broken", 502, "upstream connect error")
+        with self.assertRaises(kube.KubeError) as caught:
+            self.client.get("/broken")
+        self.assertEqual((caught.exception.status, str(caught.exception)), (502, "502: upstream connect error"))
+
+    def test_service_proxy_returns_text_and_forwards_headers(self):
+        path = f"{kube.SERVICES.format(namespace='default')}/btc-collector:http/proxy/metrics"
+        self.api.reply("GET", path, 200, "btc_collector_up 1\n", "text/plain; version=0.0.4")
+
+        body = self.client.request("GET", path, headers={"X-Admin-Token": "s3cret"})
+
+        self.assertEqual(body, "btc_collector_up 1\n")
+        [request] = self.api.requests_to("GET", path)
+        self.assertEqual(request.headers["X-Admin-Token"], "s3cret")
+        self.assertEqual(request.headers["Authorization"], "Bearer kube-token")
+
+    def test_secret_value(self):
+        path = f"{kube.SECRETS.format(namespace='monitoring')}/grafana-admin"
+        self.api.reply("GET", path, 200, {"data": {"admin-user": base64.b64encode(b"admin").decode()}})
+        self.assertEqual(self.client.secret_value("monitoring", "grafana-admin", "admin-user"), "admin")
+        self.assertIsNone(self.client.secret_value("monitoring", "grafana-admin", "admin-password"))
+        self.assertIsNone(self.client.secret_value("monitoring", "missing", "admin-user"))
+
+    def test_watch_yields_events(self):
+        def watch(request):
+            self.assertEqual(request.query["watch"], ["1"])
+            return 200, iter([{"type": "ADDED", "object": pod("a", "2")}, {"type": "DELETED", "object": pod("a", "3")}])
+
+        self.api.route("GET", PODS, watch)
+        events = [(kind, obj["metadata"]["resourceVersion"]) for kind, obj in self.client.watch(PODS, 5)]
+        self.assertEqual(events, [("ADDED", "2"), ("DELETED", "3")])
+
+    def test_watch_error_status_raises(self):
+        self.api.reply("GET", PODS, 403, "forbidden")
+        with self.assertRaises(kube.KubeError) as caught:
+            list(self.client.watch(PODS, 5))
+        self.assertEqual(caught.exception.status, 403)
+
+    def test_wait_until_resumes_from_the_listed_resource_version(self):
+        lists = iter([listing("10", pod("a", "10")), listing("20", pod("a", "20"))])
+        watches = iter([
+            # Not ready yet; the server then ends the watch (timeoutSeconds)
+            [{"type": "MODIFIED", "object": pod("a", "11")}],
+            # The resourceVersion expired: the client has to relist
+            [{"type": "ERROR", "object": {"kind": "Status", "code": 410, "metadata": {}}}],
+            [{"type": "ADDED", "object": pod("b", "21")}, {"type": "MODIFIED", "object": pod("b", "22", ready=True)}],
+        ])
+        last = listing("30")
+
+        def pods(request):
+            if "watch" in request.query:
+                return 200, iter(next(watches))
+            return 200, next(lists, last)
+
+        self.api.route("GET", PODS, pods)
+        ready = self.client.wait_for_ready_pod("default", "app=btc-collector", timeout=10)
+
+        self.assertEqual(ready["metadata"]["name"], "b")
+        requests = self.api.requests_to("GET", PODS)
+        self.assertTrue(all(r.query["labelSelector"] == ["app=btc-collector"] for r in requests))
+        watched = [r.query["resourceVersion"][0] for r in requests if "watch" in r.query]
+        # Each watch starts where the previous listing left off
+        self.assertEqual(watched, ["10", "20", "30"])
+
+    def test_wait_until_times_out(self):
+        def pods(request):
+            if "watch" in request.query:
+                return 200, iter([])
+            return 200, listing("1", pod("a", "1"))
+
+        self.api.route("GET", PODS, pods)
+        self.assertIsNone(self.client.wait_for_ready_pod("default", "app=x", timeout=0.3))
+
+    def test_wait_for_object_filters_by_name(self):
+        path = kube.APPLICATIONS.format(namespace="argocd")
+        app = {"metadata": {"name": "btc-collector", "resourceVersion": "5"}}
+        self.api.reply("GET", path, 200, {"metadata": {"resourceVersion": "5"}, "items": [app]})
+
+        self.assertEqual(self.client.wait_for_object(path, "btc-collector", 5), app)
+        self.assertEqual(self.api.requests_to("GET", path)[0].query["fieldSelector"], ["metadata.name=btc-collector"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import io
+import os
+import json
+import time
+import socket
+import unittest
+from contextlib import redirect_stdout
+
+from commands import status
+from tests.fake_apiserver import FakeAPIServer
+from tests import stub_fleet
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SERVICES = status.discover_services(BASE_DIR)
+COLLECTORS = [name for name, service_type, _ in SERVICES if service_type == "collector"]
+
+
+def run_status(server, as_json=True):
+    """status_command from the repository root; returns (exit code, output)."""
+    out = io.StringIO()
+    cwd = os.getcwd()
+    os.chdir(BASE_DIR)
+    try:
+        with redirect_stdout(out):
+            code = status.status_command(server=server, as_json=as_json)
+    finally:
+        os.chdir(cwd)
+    return code, out.getvalue()
+
+
+def by_name(output):
+    return {service["name"]: service for service in json.loads(output)["services"]}
+
+
+class MetricsParsingTest(unittest.TestCase):
+    def test_parse_metrics(self):
+        samples = status.parse_metrics(
+            '# HELP x_total help\n'
+            'x_total{symbol="BTC",note="a \\"quoted\\" label"} 3\n'
+            'x_total{symbol="ETH"} 4.5\n'
+            'process_start_time_seconds 1.7e9\n'
+        )
+        self.assertEqual(status.metric_sum(samples, "x_total"), 7.5)
+        self.assertEqual(samples["x_total"][0][0]["symbol"], "BTC")
+        self.assertEqual(samples["process_start_time_seconds"], [({}, 1.7e9)])
+
+    def test_histogram_quantile_interpolates_like_promql(self):
+        text = stub_fleet.collector_metrics("c", 0, 0, 60, [0.04] * 90 + [0.2] * 10)
+        samples = status.parse_metrics(text)
+        name = "c_api_call_duration_seconds"
+        # 90 of 100 observations in (0.025, 0.05]: p50 is 50/90 of the way through it
+        self.assertAlmostEqual(status.histogram_quantile(samples, name, 0.5), 0.025 + 0.025 * 50 / 90)
+        self.assertAlmostEqual(status.histogram_quantile(samples, name, 0.9), 0.05)
+        self.assertAlmostEqual(status.histogram_quantile(samples, name, 0.99), 0.1 + 0.15 * 9 / 10)
+        self.assertIsNone(status.histogram_quantile({}, name, 0.5))
+
+
+class StatusCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.api = FakeAPIServer().__enter__()
+        self.addCleanup(self.api.__exit__, None, None, None)
+
+    def test_healthy_fleet(self):
+        stub_fleet.healthy_fleet(self.api, SERVICES)
+
+        code, output = run_status(self.api.url)
+
+        self.assertEqual(code, 0)
+        services = by_name(output)
+        self.assertEqual(set(services), {name for name, _, _ in SERVICES})
+        for name in COLLECTORS:
+            collector = services[name]
+            self.assertTrue(collector["up"])
+            self.assertAlmostEqual(collector["collected_per_min"], 60, delta=1)
+            self.assertAlmostEqual(collector["error_ratio"], 6 / 606)
+            self.assertAlmostEqual(collector["api_latency"]["p90"], 0.05)
+        ingestor = services["crypto-ingestor"]
+        self.assertEqual(ingestor["health"]["status"], "ok")
+        self.assertEqual(set(ingestor["health"]["last_seen"]), {coin for _, t, coin in SERVICES if t == "collector"})
+
+    def test_table(self):
+        stub_fleet.healthy_fleet(self.api, SERVICES)
+
+        code, output = run_status(self.api.url, as_json=False)
+
+        self.assertEqual(code, 0)
+        lines = output.splitlines()
+        self.assertTrue(lines[0].startswith("SERVICE"))
+        btc = next(line.split() for line in lines if line.startswith("btc-collector"))
+        # SERVICE COIN UP COLLECTED/MIN ERRORS/MIN ERR% p50 p90 p99 AGE
+        self.assertEqual(btc[:3], ["btc-collector", "BTC", "yes"])
+        self.assertEqual(btc[5], "1.0%")
+        self.assertEqual(btc[7], "50ms")
+        self.assertEqual(btc[9], "5s")
+        self.assertIn("crypto-ingestor: ok, backlog 0 file(s)", output)
+
+    def test_degraded_fleet(self):
+        stub_fleet.healthy_fleet(self.api, SERVICES)
+        # One collector failing most API calls, one without ready pods, and
+        # an ingestor working through a backlog
+        stub_fleet.serve_collector(self.api, "eth-collector", collected=10, errors=90, uptime=600,
+                                   latencies=[3.0] * 20)
+        stub_fleet.serve_no_endpoints(self.api, "sol-collector", "metrics")
+        stub_fleet.serve_ingestor(self.api, stub_fleet.ingestor_health(
+            {"BTC": int(time.time() * 1000) - 3 * 3600 * 1000}, backlog=1200, oldest=900.0,
+        ))
+
+        code, output = run_status(self.api.url)
+
+        self.assertEqual(code, 1)
+        services = by_name(output)
+        self.assertAlmostEqual(services["eth-collector"]["error_ratio"], 0.9)
+        self.assertGreater(services["eth-collector"]["api_latency"]["p50"], 2.5)
+        self.assertEqual((services["sol-collector"]["up"], services["sol-collector"]["error"]), (False, "HTTP 503"))
+        self.assertEqual(services["crypto-ingestor"]["health"]["backlog_files"], 1200)
+
+        code, output = run_status(self.api.url, as_json=False)
+        self.assertEqual(code, 1)
+        self.assertIn("crypto-ingestor: ok, backlog 1200 file(s), oldest 15m", output)
+        self.assertIn("sol-collector: HTTP 503", output)
+        btc = next(line.split() for line in output.splitlines() if line.startswith("btc-collector"))
+        self.assertEqual(btc[-1], "3.0h")
+
+    def test_hung_service_does_not_hold_up_the_others(self):
+        stub_fleet.healthy_fleet(self.api, SERVICES)
+        stub_fleet.serve_hung(self.api, "btc-collector", "metrics", seconds=2)
+        stub_fleet.serve_hung(self.api, "crypto-ingestor", "health", seconds=2)
+
+        started = time.monotonic()
+        code, output = run_status(self.api.url)
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(code, 1)
+        self.assertLess(elapsed, 1.5)
+        services = by_name(output)
+        self.assertEqual(services["btc-collector"]["error"], "timed out")
+        self.assertEqual(services["crypto-ingestor"]["error"], "timed out")
+        self.assertTrue(all(services[name]["up"] for name in COLLECTORS if name != "btc-collector"))
+
+    def test_unreachable_api_server(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+
+        started = time.monotonic()
+        code, output = run_status(f"http://127.0.0.1:{port}")
+
+        self.assertEqual(code, 1)
+        self.assertLess(time.monotonic() - started, 1.5)
+        services = by_name(output)
+        self.assertTrue(all(not service["up"] for service in services.values()))
+        self.assertEqual({service["error"] for service in services.values()}, {"ConnectionError"})
+
+        code, output = run_status(f"http://127.0.0.1:{port}", as_json=False)
+        self.assertIn("crypto-ingestor: down (ConnectionError)", output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from jinja2 import Environment, FileSystemLoader, StrictUndefined, meta
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TEMPLATES_DIR = os.path.join(BASE_DIR, "ops-cli", "templates")
+COLLECTORS = ["ada", "bnb", "btc", "eth", "sol", "xrp"]
+CONTEXT_NAMES = {"name", "coin", "type", "image", "namespace"}
+
+
+def render(template_name, name, coin, service_type="collector"):
+    # Same environment and context as create_services_command
+    env = Environment(loader=FileSystemLoader(TEMPLATES_DIR), undefined=StrictUndefined)
+    return env.get_template(template_name).render(
+        name=name, coin=coin.upper(), type=service_type,
+        image=f"diegohnunes/{name}:v2.0", namespace="default",
+    )
+
+
+class TemplateRenderTest(unittest.TestCase):
+    def test_templates_only_use_context_names(self):
+        # Go's {{...}} composite literals outside a raw block parse as Jinja
+        # expressions; a tuple of undefined names even renders without error
+        env = Environment(loader=FileSystemLoader(TEMPLATES_DIR))
+        for template_name in sorted(os.listdir(TEMPLATES_DIR)):
+            if template_name.endswith(".j2"):
+                with self.subTest(template=template_name):
+                    source = env.loader.get_source(env, template_name)[0]
+                    self.assertLessEqual(meta.find_undeclared_variables(env.parse(source)), CONTEXT_NAMES)
+
+    def test_every_template_renders(self):
+        for template_name in sorted(os.listdir(TEMPLATES_DIR)):
+            if template_name.endswith(".j2"):
+                with self.subTest(template=template_name):
+                    render(template_name, "doge-collector", "doge")
+
+    def test_main_go_matches_the_committed_collectors(self):
+        for coin in COLLECTORS:
+            name = f"{coin}-collector"
+            with self.subTest(collector=name):
+                with open(os.path.join(BASE_DIR, "apps", name, "main.go")) as f:
+                    self.assertEqual(render("main.go.j2", name, coin), f.read())
+
+    @unittest.skipUnless(shutil.which("gofmt"), "gofmt not installed")
+    def test_main_go_parses(self):
+        result = subprocess.run(
+            ["gofmt", "-e"], input=render("main.go.j2", "doge-collector", "doge"),
+            capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    @unittest.skipUnless(shutil.which("go"), "go not installed")
+    def test_go_vet(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for template_name, filename in (("main.go.j2", "main.go"), ("go.mod.j2", "go.mod")):
+                with open(os.path.join(tmp, filename), "w") as f:
+                    f.write(render(template_name, "doge-collector", "doge"))
+            # Resolving the module needs the network (or a warm module cache)
+            # and a toolchain that satisfies go.mod's go directive
+            tidy = subprocess.run(["go", "mod", "tidy"], cwd=tmp, capture_output=True, text=True)
+            if tidy.returncode != 0:
+                self.skipTest(f"go mod tidy failed: {tidy.stderr.strip().splitlines()[-1:]}")
+            vet = subprocess.run(["go", "vet", "."], cwd=tmp, capture_output=True, text=True)
+            self.assertEqual(vet.returncode, 0, vet.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
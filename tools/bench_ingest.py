@@ -0,0 +1,393 @@
+"""Benchmark the crypto-ingestor file path with synthetic collector load.
+
+Usage:
+  python tools/bench_ingest.py                                  # steady, 6 coins, 50 files/s for 20s
+  python tools/bench_ingest.py --profile burst --coins 20 --burst-size 50 --burst-every 2
+  python tools/bench_ingest.py --profile backfill --coins 6 --files 2000
+  python tools/bench_ingest.py --env STORAGE_LAYOUT=sharded --env WATCH_MODE=poll
+  python tools/bench_ingest.py --profile backfill --format segment --records-per-file 500
+  python tools/bench_ingest.py --json > baseline.json
+  python tools/bench_ingest.py --compare baseline.json          # exits 1 on a regression
+
+Starts apps/crypto-ingestor/main.py as a subprocess on a free port with a
+throwaway DATA_DIR and DB_PATH, then writes files the way the Go collectors
+do (<COIN>_<unix>.json, one indented JSON record each), or binary segments
+(--format segment, see apps/crypto-ingestor/segment.py):
+
+  steady    --rate files/s spread across the coins for --duration seconds
+  burst     --burst-size files per coin at once, every --burst-every seconds
+  backfill  --files "binance-historical" klines per coin, as fast as possible
+
+A file counts as ingested once the ingestor has deleted it, which happens
+only after its rows commit; latency is measured from the file being closed.
+Reports files/s, p50/p99 latency and database growth. Needs no cluster and
+nothing beyond the standard library.
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+
+INGESTOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "apps", "crypto-ingestor", "main.py")
+sys.path.insert(0, os.path.dirname(INGESTOR))
+import segment  # noqa: E402  (the ingestor's own encoder)
+
+SYMBOLS = ["BTC", "ETH", "SOL", "XRP", "ADA", "BNB"]
+# Compared by --compare: name -> True if higher is better
+COMPARED = {"files_per_sec": True, "latency_p50_ms": False, "latency_p99_ms": False}
+
+
+def coin_names(count):
+    return SYMBOLS[:count] + [f"C{i:03d}" for i in range(len(SYMBOLS) + 1, count + 1)]
+
+
+def go_timestamp(ms):
+    # time.Time's JSON form in a UTC container: RFC 3339 with nanoseconds
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f") + "000Z"
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def storage_bytes(*paths):
+    """Total size of the given files and of every file below the given directories."""
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in files:
+                    try:
+                        total += os.path.getsize(os.path.join(root, name))
+                    except FileNotFoundError:
+                        pass
+        else:
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    total += os.path.getsize(path + suffix)
+                except FileNotFoundError:
+                    pass
+    return total
+
+
+class Generator:
+    """Writes synthetic collector files and remembers when each was closed."""
+
+    def __init__(self, data_dir, coins, records_per_file=1, file_format="json"):
+        self.data_dir = data_dir
+        self.coins = coin_names(coins)
+        self.records_per_file = records_per_file
+        self.file_format = file_format
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.written = 0
+        # One synthetic clock per coin, so every file name and point is unique
+        self.clock = {coin: int(time.time()) * 1000 for coin in self.coins}
+        self.price = {coin: 100.0 * (i + 1) for i, coin in enumerate(self.coins)}
+
+    def write(self, coin, source="binance-api", step_ms=1000):
+        rows = []
+        for _ in range(self.records_per_file):
+            self.clock[coin] += step_ms
+            self.price[coin] *= 1 + ((self.clock[coin] // step_ms) % 7 - 3) / 10000
+            rows.append((coin, round(self.price[coin], 6), self.clock[coin], source))
+        if self.file_format == "segment":
+            name = f"{coin}_{self.clock[coin] // 1000}{segment.SUFFIX}"
+            segment.write_segment(os.path.join(self.data_dir, name), rows)
+        else:
+            name = f"{coin}_{self.clock[coin] // 1000}.json"
+            records = [
+                {"symbol": symbol, "price": price, "timestamp": go_timestamp(ts), "source": source}
+                for symbol, price, ts, source in rows
+            ]
+            with open(os.path.join(self.data_dir, name), "w") as f:
+                json.dump(records[0] if len(records) == 1 else records, f, indent=2)
+        with self.lock:
+            self.pending[name] = time.monotonic()
+            self.written += 1
+
+    def steady(self, rate, duration):
+        started = time.monotonic()
+        for i in range(int(rate * duration)):
+            delay = started + i / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.write(self.coins[i % len(self.coins)])
+
+    def burst(self, size, every, duration):
+        started = time.monotonic()
+        while time.monotonic() - started < duration:
+            tick = time.monotonic()
+            for _ in range(size):
+                for coin in self.coins:
+                    self.write(coin)
+            time.sleep(max(0.0, every - (time.monotonic() - tick)))
+
+    def backfill(self, files):
+        for coin in self.coins:
+            # Collectors backfill 1m klines, oldest first
+            self.clock[coin] -= (files + 1) * 60000
+        for _ in range(files):
+            for coin in self.coins:
+                self.write(coin, "binance-historical", step_ms=60000)
+
+
+class Monitor(threading.Thread):
+    """Polls DATA_DIR and its processing/ directory for files the ingestor removed."""
+
+    def __init__(self, generator, interval):
+        super().__init__(daemon=True)
+        self.generator = generator
+        self.interval = interval
+        self.processing = os.path.join(generator.data_dir, "processing")
+        self.latencies = []
+        self.last_done = None
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.poll()
+            time.sleep(self.interval)
+
+    def poll(self):
+        # Snapshot first: a file written during the scan must not look finished
+        with self.generator.lock:
+            candidates = dict(self.generator.pending)
+        if not candidates:
+            return
+        # DATA_DIR before processing/, so a file claimed mid-scan is still seen
+        present = set(_listdir(self.generator.data_dir)) | set(_listdir(self.processing))
+        now = time.monotonic()
+        finished = [name for name in candidates if name not in present]
+        if finished:
+            with self.generator.lock:
+                for name in finished:
+                    del self.generator.pending[name]
+            self.latencies.extend(now - candidates[name] for name in finished)
+            self.last_done = now
+
+    def wait_drained(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.generator.lock:
+                if not self.generator.pending:
+                    return True
+            time.sleep(self.interval)
+        return False
+
+
+def _listdir(path):
+    try:
+        return os.listdir(path)
+    except FileNotFoundError:
+        return []
+
+
+def scrape_metrics(port):
+    """The ingestor's /metrics samples as {name: value}, labelled series skipped."""
+    samples = {}
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+        for line in response.read().decode().splitlines():
+            if line and not line.startswith("#") and "{" not in line:
+                name, _, value = line.partition(" ")
+                samples[name] = float(value)
+    return samples
+
+
+def start_ingestor(workdir, port, overrides):
+    env = dict(os.environ)
+    env.update({
+        "DATA_DIR": os.path.join(workdir, "raw"),
+        "DB_PATH": os.path.join(workdir, "crypto.db"),
+        "SHARD_DIR": os.path.join(workdir, "shards"),
+        "ARCHIVE_DIR": os.path.join(workdir, "archive"),
+        "PORT": str(port),
+    })
+    env.update(overrides)
+    os.makedirs(env["DATA_DIR"], exist_ok=True)
+    log = open(os.path.join(workdir, "ingestor.log"), "w")
+    process = subprocess.Popen(
+        [sys.executable, "-u", os.path.abspath(INGESTOR)], cwd=os.path.dirname(os.path.abspath(INGESTOR)),
+        env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Ingestor exited with {process.returncode}, see {log.name}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1).read()
+            return process, env
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit(f"Ingestor did not become healthy within 30s, see {log.name}")
+
+
+def stop_ingestor(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def run(args, overrides):
+    workdir = tempfile.mkdtemp(prefix="bench-ingest-")
+    port = free_port()
+    process, env = start_ingestor(workdir, port, overrides)
+    try:
+        generator = Generator(env["DATA_DIR"], args.coins, args.records_per_file, args.format)
+        monitor = Monitor(generator, args.poll_interval)
+        storage = (env["DB_PATH"], env["SHARD_DIR"])
+        size_before = storage_bytes(*storage)
+        before = scrape_metrics(port)
+
+        monitor.start()
+        started = time.monotonic()
+        if args.profile == "steady":
+            generator.steady(args.rate, args.duration)
+        elif args.profile == "burst":
+            generator.burst(args.burst_size, args.burst_every, args.duration)
+        else:
+            generator.backfill(args.files)
+        generated = time.monotonic()
+        drained = monitor.wait_drained(args.timeout)
+        monitor.stopping.set()
+        monitor.join()
+        monitor.poll()
+
+        after = scrape_metrics(port)
+        size_after = storage_bytes(*storage)
+    finally:
+        stop_ingestor(process)
+        if args.keep:
+            print(f"Kept {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def delta(name):
+        return after.get(name, 0) - before.get(name, 0)
+
+    latencies = sorted(monitor.latencies)
+    elapsed = (monitor.last_done or generated) - started
+    records = delta("crypto_ingestor_records_ingested_total")
+    batches = delta("crypto_ingestor_batch_size_count")
+    return {
+        "profile": args.profile,
+        "coins": args.coins,
+        "format": args.format,
+        "records_per_file": args.records_per_file,
+        "env": overrides,
+        "files_written": generator.written,
+        "files_ingested": len(latencies),
+        "files_quarantined": int(delta("crypto_ingestor_files_quarantined_total")),
+        "drained": drained,
+        "records_committed": int(records),
+        "generate_seconds": round(generated - started, 3),
+        "elapsed_seconds": round(elapsed, 3),
+        "files_per_sec": round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+        "records_per_sec": round(records / elapsed, 1) if elapsed > 0 else None,
+        "latency_p50_ms": _ms(percentile(latencies, 50)),
+        "latency_p90_ms": _ms(percentile(latencies, 90)),
+        "latency_p99_ms": _ms(percentile(latencies, 99)),
+        "latency_max_ms": _ms(latencies[-1] if latencies else None),
+        "batches": int(batches),
+        "mean_batch_size": round(records / batches, 1) if batches else None,
+        "mean_commit_ms": _ms(delta("crypto_ingestor_commit_duration_seconds_sum") / batches) if batches else None,
+        "db_bytes_before": size_before,
+        "db_bytes_after": size_after,
+        "db_growth_bytes": size_after - size_before,
+        "db_bytes_per_record": round((size_after - size_before) / records, 1) if records else None,
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def compare(result, baseline, tolerance, file=sys.stdout):
+    """Print the change per compared metric; returns the metrics that regressed."""
+    regressions = []
+    print(f"\nAgainst baseline (tolerance {tolerance:.0%}):", file=file)
+    for name, higher_is_better in COMPARED.items():
+        old, new = baseline.get(name), result.get(name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = "REGRESSION" if worse > tolerance else "ok"
+        if worse > tolerance:
+            regressions.append(name)
+        print(f"  {name:<16} {old:>10} -> {new:>10}  ({change:+.1%})  {flag}", file=file)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark crypto-ingestor with synthetic collector files")
+    parser.add_argument("--profile", choices=["steady", "burst", "backfill"], default="steady")
+    parser.add_argument("--coins", type=int, default=6, help="number of symbols (default: 6)")
+    parser.add_argument("--rate", type=float, default=50, help="steady: files/s across all coins (default: 50)")
+    parser.add_argument("--duration", type=float, default=20, help="steady/burst: seconds of load (default: 20)")
+    parser.add_argument("--burst-size", type=int, default=20, help="burst: files per coin per burst (default: 20)")
+    parser.add_argument("--burst-every", type=float, default=2, help="burst: seconds between bursts (default: 2)")
+    parser.add_argument("--files", type=int, default=1000, help="backfill: files per coin (default: 1000)")
+    parser.add_argument("--records-per-file", type=int, default=1, help="JSON array files when > 1 (default: 1)")
+    parser.add_argument("--format", choices=["json", "segment"], default="json", help="file format (default: json)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="ingestor setting to benchmark, e.g. STORAGE_LAYOUT=sharded (repeatable)")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for the backlog to drain")
+    parser.add_argument("--poll-interval", type=float, default=0.01, help="completion polling (default: 0.01s)")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    parser.add_argument("--compare", metavar="BASELINE", help="result JSON of an earlier run; exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change (default: 0.2)")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary DATA_DIR, database and log")
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    for item in args.env:
+        key, sep, value = item.partition("=")
+        if not sep:
+            parser.error(f"--env expects KEY=VALUE, got {item!r}")
+        overrides[key] = value
+
+    result = run(args, overrides)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        width = max(len(name) for name in result)
+        for name, value in result.items():
+            print(f"{name:<{width}}  {value}")
+    if not result["drained"]:
+        print(f"\nBacklog not drained after {args.timeout}s", file=sys.stderr)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            # Keep stdout valid JSON with --json
+            regressions = compare(result, json.load(f), args.tolerance, sys.stderr if args.json else sys.stdout)
+    if regressions or not result["drained"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,481 @@
+"""Query and analytics CLI for the crypto price database.
+
+Usage:
+  python tools/check_db.py                       # summary: totals, last prices, BTC stats
+  python tools/check_db.py summary --symbol ETH
+  python tools/check_db.py stats --symbols BTC,ETH --from 2026-01-01 --to 2026-02-01
+  python tools/check_db.py stats --symbols BTC --interval 1h --format csv
+  python tools/check_db.py returns --symbol SOL --interval 5m --format csv > sol.csv
+  python tools/check_db.py correlation --symbols BTC,ETH,SOL,XRP,ADA,BNB --interval 1h
+
+--interval raw reads the ingestor's archived days (memory-mapped from
+--archive) followed by crypto_prices; 1m/5m/1h/1d read the close of each
+price_rollups bucket. Rows are streamed from SQLite in --chunk-size batches
+and reduced with NumPy, so memory stays flat however long the range is.
+With the ingestor's sharded layout, the per-symbol databases in --shards are
+attached and queried together with --db. --snapshot reads the consistent
+copies the ingestor publishes (SNAPSHOT_INTERVAL) instead of the live files,
+without taking any locks. Requires numpy.
+"""
+import argparse
+import csv
+import json
+import math
+import os
 import sqlite3
+import struct
+import sys
+from datetime import datetime, timezone
+
+import numpy as np
+
+
+DB_PATH = os.environ.get("DB_PATH", "/data/crypto.db")
+# Closed days the ingestor moved out of SQLite (ARCHIVE_AFTER_DAYS); raw
+# series read these first. Format documented in apps/crypto-ingestor/archive.py.
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "/data/archive")
+ARCHIVE_HEADER = struct.Struct("<4sHHqqq")
+# One database per symbol when the ingestor runs with STORAGE_LAYOUT=sharded
+SHARD_DIR = os.environ.get("SHARD_DIR", "/data/shards")
+# crypto.db and shards/ as last published by the ingestor (see snapshot.py)
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "/data/snapshot")
+INTERVALS = ["raw", "1m", "5m", "1h", "1d"]
+MS_PER_YEAR = 365 * 24 * 60 * 60 * 1000
+
+
+def open_db(db_path, shard_dir, symbols=None, immutable=False):
+    """Open db_path read-only with the shards of symbols (default: all) attached.
+
+    TEMP views named crypto_prices and price_rollups, the UNION ALL of the
+    main database's table and each shard's, shadow the main tables, so every
+    query here runs unchanged against either layout. SQLite's WHERE push-down
+    lets a per-symbol query use each shard's own index. immutable skips all
+    locking, for snapshot files that are never written in place.
+    """
+    mode = "mode=ro&immutable=1" if immutable else "mode=ro"
+    conn = sqlite3.connect(f"file:{db_path}?{mode}", uri=True)
+    paths = []
+    if os.path.isdir(shard_dir):
+        paths = sorted(
+            os.path.join(shard_dir, name) for name in os.listdir(shard_dir)
+            if name.endswith(".db") and (symbols is None or name[:-3] in symbols)
+        )
+    if not paths:
+        return conn
+    for i, path in enumerate(paths):
+        try:
+            conn.execute("ATTACH DATABASE ? AS ?", (f"file:{path}?{mode}", f"shard{i}"))
+        except sqlite3.OperationalError as e:
+            raise SystemExit(f"Cannot attach {path}: {e} (pass fewer --symbols)")
+    schemas = ["main"] + [f"shard{i}" for i in range(len(paths))]
+    for table in ("crypto_prices", "price_rollups"):
+        union = " UNION ALL ".join(f"SELECT * FROM {schema}.{table}" for schema in schemas)
+        conn.execute(f"CREATE TEMP VIEW {table} AS {union}")
+    return conn
+
+
+def parse_time(value):
+    """ISO 8601 date/datetime (naive = UTC) or epoch seconds/ms -> epoch ms."""
+    if value is None:
+        return None
+    try:
+        number = float(value)
+        return int(number if number > 1e11 else number * 1000)
+    except ValueError:
+        pass
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def format_time(ms):
+    if ms is None:
+        return None
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).isoformat()
+
+
+def price_series_sql(interval):
+    if interval == "raw":
+        return (
+            "SELECT timestamp, price FROM crypto_prices "
+            "WHERE symbol = ? AND timestamp >= ? AND timestamp < ? "
+            "ORDER BY timestamp",
+            [],
+        )
+    return (
+        "SELECT bucket, close FROM price_rollups "
+        "WHERE symbol = ? AND interval = ? AND bucket >= ? AND bucket < ? "
+        "ORDER BY bucket",
+        [interval],
+    )
+
+
+def iter_chunks(conn, sql, params, chunk_size):
+    """Yield the query result as float64 NumPy arrays of at most chunk_size rows."""
+    cur = conn.execute(sql, params)
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield np.array(rows, dtype=np.float64)
+
+
+def load_archive(path):
+    """Memory-map one archived day as (timestamps, prices) float64-ready arrays."""
+    if path.endswith(".parquet"):
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(path, memory_map=True)
+        return table.column("timestamp").to_numpy(), table.column("price").to_numpy()
+    with open(path, "rb") as f:
+        magic, version, _, count, _, _ = ARCHIVE_HEADER.unpack(f.read(ARCHIVE_HEADER.size))
+    if magic != b"CPA1" or version != 1:
+        raise ValueError(f"{path}: not a version 1 price archive")
+    timestamps = np.memmap(path, dtype="<i8", mode="r", offset=ARCHIVE_HEADER.size, shape=(count,))
+    prices = np.memmap(path, dtype="<f8", mode="r", offset=ARCHIVE_HEADER.size + 8 * count, shape=(count,))
+    return timestamps, prices
+
+
+def iter_archive(symbol, start, end):
+    """Yield (timestamps, prices) per archived UTC day of symbol, in time order."""
+    root = os.path.join(ARCHIVE_DIR, symbol)
+    if not os.path.isdir(root):
+        return
+    days = {}
+    for source in os.listdir(root):
+        for name in os.listdir(os.path.join(root, source)):
+            day, ext = os.path.splitext(name)
+            if ext in (".cpa", ".parquet"):
+                days.setdefault(day, []).append(os.path.join(root, source, name))
+    for day in sorted(days):
+        day_start = parse_time(day)
+        if day_start >= end or day_start + 86400000 <= start:
+            continue
+        columns = [load_archive(path) for path in days[day]]
+        timestamps = np.concatenate([c[0] for c in columns])
+        prices = np.concatenate([c[1] for c in columns])
+        if len(columns) > 1:
+            # Several sources for the day: interleave them by time
+            order = np.argsort(timestamps, kind="stable")
+            timestamps, prices = timestamps[order], prices[order]
+        keep = (timestamps >= start) & (timestamps < end)
+        if keep.any():
+            yield timestamps[keep].astype(np.float64), prices[keep].astype(np.float64)
+
+
+def iter_series(conn, symbol, interval, start, end, chunk_size):
+    """Yield (timestamps, prices) chunks for one symbol in time order."""
+    if interval == "raw":
+        for timestamps, prices in iter_archive(symbol, start, end):
+            start = max(start, int(timestamps[-1]) + 1)
+            yield timestamps, prices
+    sql, extra = price_series_sql(interval)
+    params = [symbol] + extra + [start, end]
+    for chunk in iter_chunks(conn, sql, params, chunk_size):
+        yield chunk[:, 0], chunk[:, 1]
+
+
+class RunningMoments:
+    """Count/mean/M2 accumulator merged chunk by chunk (Chan et al.)."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values):
+        if values.size == 0:
+            return
+        n_b = values.size
+        mean_b = float(values.mean())
+        m2_b = float(((values - mean_b) ** 2).sum())
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta * delta * self.n * n_b / n
+        self.n = n
+
+    def std(self):
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else None
+
+
+def symbol_stats(conn, symbol, interval, start, end, chunk_size):
+    count = 0
+    low, high = math.inf, -math.inf
+    price_sum = 0.0
+    weighted_sum = 0.0
+    first_ts = first_price = last_ts = last_price = None
+    log_returns = RunningMoments()
+
+    for ts, prices in iter_series(conn, symbol, interval, start, end, chunk_size):
+        if first_ts is None:
+            first_ts, first_price = ts[0], prices[0]
+        # Carry the previous chunk's last point so returns and time weights
+        # span the chunk boundary
+        if last_ts is not None:
+            ts = np.concatenate(([last_ts], ts))
+            prices = np.concatenate(([last_price], prices))
+            new = prices[1:]
+        else:
+            new = prices
+
+        count += new.size
+        low = min(low, float(new.min()))
+        high = max(high, float(new.max()))
+        price_sum += float(new.sum())
+        # Time-weighted: each price holds until the next observation
+        weighted_sum += float((prices[:-1] * np.diff(ts)).sum())
+        log_returns.update(np.diff(np.log(prices)))
+        last_ts, last_price = ts[-1], prices[-1]
+
+    if count == 0:
+        return {"symbol": symbol, "count": 0}
+
+    span = last_ts - first_ts
+    std = log_returns.std()
+    step = span / (count - 1) if count > 1 else None
+    return {
+        "symbol": symbol,
+        "interval": interval,
+        "count": count,
+        "first": format_time(int(first_ts)),
+        "last": format_time(int(last_ts)),
+        "first_price": float(first_price),
+        "last_price": float(last_price),
+        "min": low,
+        "max": high,
+        "mean": price_sum / count,
+        # No traded volume is recorded, so this is a time-weighted average
+        "twap": weighted_sum / span if span > 0 else float(last_price),
+        "total_return": float(last_price / first_price - 1),
+        "mean_log_return": log_returns.mean if log_returns.n else None,
+        "volatility": std,
+        "annualized_volatility": std * math.sqrt(MS_PER_YEAR / step) if std is not None and step else None,
+    }
+
+
+def iter_returns(conn, symbol, interval, start, end, chunk_size):
+    """Yield (timestamp ms, price, simple return, log return) rows."""
+    prev = np.nan
+    for ts, prices in iter_series(conn, symbol, interval, start, end, chunk_size):
+        base = np.concatenate(([prev], prices[:-1]))
+        simple = prices / base - 1
+        log = np.log(prices / base)
+        for t, price, r, lr in zip(ts.astype(np.int64).tolist(), prices.tolist(), simple.tolist(), log.tolist()):
+            # The first observation has no previous price
+            yield (t, price, None, None) if math.isnan(r) else (t, price, r, lr)
+        prev = prices[-1]
+
+
+def correlation(conn, symbols, interval, start, end, chunk_size):
+    """Pearson correlation matrix of per-bucket log returns.
+
+    Buckets are aligned in SQL; each pair uses the buckets where both symbols
+    have a return, accumulated across chunks as sums of products.
+    """
+    if interval == "raw":
+        raise ValueError("correlation needs aligned buckets; use --interval 1m/5m/1h/1d")
+    columns = ", ".join(f"max(CASE WHEN symbol = ? THEN close END)" for _ in symbols)
+    sql = (
+        f"SELECT bucket, {columns} FROM price_rollups "
+        f"WHERE interval = ? AND bucket >= ? AND bucket < ? "
+        f"AND symbol IN ({', '.join('?' for _ in symbols)}) "
+        f"GROUP BY bucket ORDER BY bucket"
+    )
+    params = list(symbols) + [interval, start, end] + list(symbols)
+
+    k = len(symbols)
+    n = np.zeros((k, k))
+    s_x = np.zeros((k, k))
+    s_xx = np.zeros((k, k))
+    s_xy = np.zeros((k, k))
+    prev = None
+    for chunk in iter_chunks(conn, sql, params, chunk_size):
+        # NULL (no bucket for that symbol) arrives as NaN
+        closes = np.log(chunk[:, 1:])
+        if prev is not None:
+            closes = np.vstack((prev, closes))
+        returns = np.diff(closes, axis=0)
+        prev = closes[-1:]
+
+        valid = ~np.isnan(returns)
+        x = np.where(valid, returns, 0.0)
+        m = valid.astype(np.float64)
+        n += m.T @ m
+        s_x += x.T @ m          # [i, j]: sum of i's returns where j is present too
+        s_xx += (x * x).T @ m
+        s_xy += x.T @ x
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = n * s_xy - s_x * s_x.T
+        var = (n * s_xx - s_x * s_x) * (n * s_xx - s_x * s_x).T
+        corr = cov / np.sqrt(var)
+    return {
+        "interval": interval,
+        "symbols": list(symbols),
+        "observations": n.astype(int).tolist(),
+        "correlation": [[None if math.isnan(v) else round(float(v), 6) for v in row] for row in corr],
+    }
+
+
+def summary(conn, symbol):
+    total = conn.execute("SELECT count(*) FROM crypto_prices").fetchone()[0]
+    latest = conn.execute(
+        "SELECT symbol, price, timestamp FROM crypto_prices ORDER BY timestamp DESC LIMIT 5"
+    ).fetchall()
+    stats = conn.execute(
+        "SELECT MIN(low), MAX(high), SUM(price_sum) / SUM(count) FROM price_rollups "
+        "WHERE symbol = ? AND interval = '1d'",
+        (symbol,),
+    ).fetchone()
+    return {
+        "total_records": total,
+        "latest": [{"symbol": s, "price": p, "timestamp": format_time(t)} for s, p, t in latest],
+        "stats": {"symbol": symbol, "min": stats[0], "max": stats[1], "avg": stats[2]},
+    }
+
+
+def print_summary(result):
+    print(f"Total records: {result['total_records']}")
+    print("\nLast 5 prices:")
+    for row in result["latest"]:
+        print(f"{row['symbol']}: ${row['price']:.2f} at {row['timestamp']}")
+    stats = result["stats"]
+    if stats["min"] is None:
+        print(f"\nNo {stats['symbol']} data")
+        return
+    print(f"\n{stats['symbol']} Price Stats:")
+    print(f"  Min: ${stats['min']:.2f}")
+    print(f"  Max: ${stats['max']:.2f}")
+    print(f"  Avg: ${stats['avg']:.2f}")
+
+
+def write_rows(rows, fieldnames, fmt):
+    if fmt == "json":
+        json.dump([dict(zip(fieldnames, row)) for row in rows], sys.stdout, indent=2)
+        print()
+    elif fmt == "csv":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(fieldnames)
+        writer.writerows(rows)
+    else:
+        print("  ".join(f"{name:>14}" for name in fieldnames))
+        for row in rows:
+            print("  ".join(f"{format_cell(value):>14}" for value in row))
+
+
+def format_cell(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return str(value)
+
+
+def main(argv=None):
+    global ARCHIVE_DIR
+    # Accepted before or after the subcommand; SUPPRESS keeps a subcommand
+    # from resetting a value given before it
+    common = argparse.ArgumentParser(add_help=False, argument_default=argparse.SUPPRESS)
+    common.add_argument("--db", help=f"SQLite database (default: {DB_PATH})")
+    common.add_argument("--format", choices=["text", "json", "csv"], help="default: text")
+    common.add_argument("--chunk-size", type=int, help="rows fetched per read (default: 50000)")
+    common.add_argument("--archive", help=f"archived raw days, used for --interval raw (default: {ARCHIVE_DIR})")
+    common.add_argument("--shards", help=f"per-symbol databases of the sharded layout (default: {SHARD_DIR})")
+    common.add_argument(
+        "--snapshot", nargs="?", const=SNAPSHOT_DIR, metavar="DIR",
+        help=f"read the ingestor's published snapshot in DIR (default: {SNAPSHOT_DIR}) instead of --db/--shards",
+    )
+
+    parser = argparse.ArgumentParser(description="Query and analyse the crypto price database", parents=[common])
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("summary", parents=[common], help="totals, latest prices and all-time stats")
+    p.add_argument("--symbol", default="BTC")
+
+    for name, help_text in [
+        ("stats", "per-symbol price, return and volatility statistics"),
+        ("returns", "per-observation simple and log returns for one symbol"),
+        ("correlation", "log-return correlation matrix across symbols"),
+    ]:
+        p = sub.add_parser(name, parents=[common], help=help_text)
+        if name == "returns":
+            p.add_argument("--symbol", required=True)
+        else:
+            p.add_argument("--symbols", required=True, help="comma-separated, e.g. BTC,ETH,SOL")
+        p.add_argument("--from", dest="start", help="ISO 8601 or epoch (inclusive)")
+        p.add_argument("--to", dest="end", help="ISO 8601 or epoch (exclusive)")
+        if name == "correlation":
+            # Returns must line up bucket by bucket, so only rollup intervals
+            p.add_argument("--interval", choices=INTERVALS[1:], default="1m")
+        else:
+            p.add_argument("--interval", choices=INTERVALS, default="raw")
+
+    args = parser.parse_args(argv)
+    for name, default in [
+        ("db", DB_PATH), ("format", "text"), ("chunk_size", 50000), ("archive", ARCHIVE_DIR), ("shards", SHARD_DIR),
+    ]:
+        if not hasattr(args, name):
+            setattr(args, name, default)
+    ARCHIVE_DIR = args.archive
+    snapshot = getattr(args, "snapshot", None)
+    if snapshot:
+        args.db = os.path.join(snapshot, os.path.basename(DB_PATH))
+        args.shards = os.path.join(snapshot, "shards")
+        if not os.path.exists(args.db):
+            raise SystemExit(f"No snapshot at {args.db}; is SNAPSHOT_INTERVAL set on the ingestor?")
+    command = args.command or "summary"
+    # Only the shards a command reads; summary looks at every symbol
+    if command == "returns":
+        symbols = {args.symbol.upper()}
+    elif command in ("stats", "correlation"):
+        symbols = {s.strip().upper() for s in args.symbols.split(",")}
+    else:
+        symbols = None
+    conn = open_db(args.db, args.shards, symbols, immutable=bool(snapshot))
+
+    if command == "summary":
+        result = summary(conn, getattr(args, "symbol", "BTC").upper())
+        if args.format == "text":
+            print_summary(result)
+        elif args.format == "json":
+            print(json.dumps(result, indent=2))
+        else:
+            write_rows([(r["symbol"], r["price"], r["timestamp"]) for r in result["latest"]],
+                       ["symbol", "price", "timestamp"], "csv")
+        conn.close()
+        return
+
+    start = parse_time(args.start) if args.start else -2 ** 62
+    end = parse_time(args.end) if args.end else 2 ** 62
+
+    if command == "stats":
+        results = [
+            symbol_stats(conn, symbol.strip().upper(), args.interval, start, end, args.chunk_size)
+            for symbol in args.symbols.split(",")
+        ]
+        fieldnames = list(max(results, key=len).keys())
+        write_rows([[r.get(f) for f in fieldnames] for r in results], fieldnames, args.format)
 
-conn = sqlite3.connect('/data/crypto.db')
+    elif command == "returns":
+        rows = iter_returns(conn, args.symbol.upper(), args.interval, start, end, args.chunk_size)
+        fieldnames = ["timestamp", "price", "return", "log_return"]
+        if args.format == "json":
+            # Materialised only for JSON; text and CSV stream row by row
+            rows = list(rows)
+        write_rows(((format_time(ts), p, r, lr) for ts, p, r, lr in rows), fieldnames, args.format)
 
-# Total de registros
-total = conn.execute('SELECT count(*) FROM crypto_prices').fetchone()[0]
-print(f'Total records: {total}')
+    elif command == "correlation":
+        symbols = [s.strip().upper() for s in args.symbols.split(",")]
+        result = correlation(conn, symbols, args.interval, start, end, args.chunk_size)
+        if args.format == "json":
+            print(json.dumps(result, indent=2))
+        else:
+            rows = [[symbol] + row for symbol, row in zip(symbols, result["correlation"])]
+            write_rows(rows, ["symbol"] + symbols, args.format)
 
-# Últimos 5 preços
-print('\nLast 5 prices:')
-for row in conn.execute('SELECT symbol, price, timestamp FROM crypto_prices ORDER BY timestamp DESC LIMIT 5').fetchall():
-    print(f'{row[0]}: ${row[1]:.2f} at {row[2]}')
+    conn.close()
 
-# Estatísticas de preço
-stats = conn.execute('SELECT MIN(price), MAX(price), AVG(price) FROM crypto_prices WHERE symbol = "BTC"').fetchone()
-print(f'\nBTC Price Stats:')
-print(f'  Min: ${stats[0]:.2f}')
-print(f'  Max: ${stats[1]:.2f}')
-print(f'  Avg: ${stats[2]:.2f}')
 
-conn.close()
+if __name__ == "__main__":
+    main()